@@ -3,8 +3,8 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from core.logging import setup_logging
 from core.config import settings
-from db.session import engine
-from models.base import Base
+from db.schema import ensure_schema
+from db.session import async_engine, engine
 
 from controllers.dashboard import router as dashboard_router
 from controllers.health import router as health_router
@@ -12,6 +12,9 @@ from controllers.invoices import router as invoices_router
 from controllers.risk import router as risk_router
 from controllers.sync import router as sync_router
 
+from services.erp_client import close_http_client, get_http_client
+from services.ai_enrichment import get_enrichment_queue
+from services.executor import shutdown_executor
 from services.scheduler import Scheduler
 
 
@@ -34,8 +37,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# --- DB tables ---
-Base.metadata.create_all(bind=engine)
+# --- DB tables (+ additive columns for existing DBs) ---
+# API-only replicas leave schema changes to the sync worker (services/worker.py)
+if settings.APP_ROLE != "api":
+    ensure_schema(engine)
 
 # --- Routers ---
 app.include_router(dashboard_router)
@@ -49,14 +54,25 @@ app.include_router(sync_router)
 app.state.ttl_cache = {}  # dict[str, (expires_at, data)]
 
 scheduler = Scheduler()
+app.state.scheduler = scheduler  # /sync/status reads the adaptive interval from here
 
 
 @app.on_event("startup")
 async def on_startup():
-    # Start background sync loop (delta by modified) if enabled
-    await scheduler.start()
+    # Open the shared ERPNext connection pool (keep-alive across sync cycles)
+    get_http_client()
+    # Background AI enrichment (every role: /risk/recalculate enqueues too)
+    await get_enrichment_queue().start()
+    # Start background sync loop (delta by modified) if enabled; API-only replicas leave it to the worker
+    if settings.APP_ROLE != "api":
+        await scheduler.start()
 
 
 @app.on_event("shutdown")
 async def on_shutdown():
     await scheduler.stop()
+    await get_enrichment_queue().stop()
+    await close_http_client()
+    shutdown_executor()
+    if async_engine is not None:
+        await async_engine.dispose()
@@ -1,18 +1,17 @@
 from fastapi import APIRouter, Depends, Query, Request
-from sqlalchemy.orm import Session
 
 from core.config import settings
-from db.session import get_db
+from db.session import get_read_db, run_read
 from helpers import cache_get, cache_set
 from schemas.responses import ApiResponse
 
 router = APIRouter(prefix="/dashboard", tags=["dashboard"])
 
 @router.get("/summary", response_model=ApiResponse[dict])
-def dashboard_summary(
+async def dashboard_summary(
     request: Request,
     limit: int = Query(500, ge=1, le=2000),
-    db: Session = Depends(get_db),
+    db=Depends(get_read_db),
 ):
     """
     Dashboard summary (DB-driven):
@@ -27,9 +26,9 @@ def dashboard_summary(
     if cached is not None:
         return ApiResponse(data=cached)
 
-    from queries.invoices import list_invoices  # local import
+    from queries.invoices import list_invoices, list_invoices_async  # local import
 
-    invoices = list_invoices(db, limit=limit)
+    invoices = await run_read(db, list_invoices, list_invoices_async, limit=limit)
 
     risk_counts = {"LOW": 0, "MEDIUM": 0, "HIGH": 0, "CRITICAL": 0, "NO_RISK": 0}
     suppliers = set()
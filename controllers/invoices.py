@@ -1,50 +1,62 @@
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query
 
-from db.session import get_db
-from queries.invoices import list_invoices
+from db.session import get_read_db, run_read
+from queries.invoices import (
+    get_invoice_by_invoice_id,
+    get_invoice_by_invoice_id_async,
+    list_invoices,
+    list_invoices_async,
+)
 from schemas.responses import ApiResponse
 from schemas.invoice import InvoiceOut, InvoiceItemOut
 
 router = APIRouter(prefix="/invoices", tags=["invoices"])
 
 
+def _invoice_out(inv, include_items: bool = True) -> InvoiceOut:
+    items_out = []
+    if include_items:
+        items_out = [
+            InvoiceItemOut(
+                item_code=i.item_code,
+                item_name=i.item_name,
+                qty=i.qty,
+                rate=i.rate,
+                amount=i.amount,
+            )
+            for i in (inv.items or [])
+        ]
+
+    return InvoiceOut(
+        invoice_id=inv.invoice_id,
+        supplier=inv.supplier,
+        posting_date=inv.posting_date,
+        grand_total=inv.grand_total,
+        erp_modified=inv.erp_modified,
+        items=items_out,
+    )
+
+
 @router.get("", response_model=ApiResponse[list[InvoiceOut]])
-def get_invoices(
+async def get_invoices(
     limit: int = Query(500, ge=1, le=500),
     include_items: bool = Query(True),
-    db: Session = Depends(get_db),
+    db=Depends(get_read_db),
 ):
     """
     Returns invoices from DB (source of truth).
     include_items=true includes qty/rate for each item (needed for UI).
     """
-    rows = list_invoices(db, limit=limit)
-
-    out: list[InvoiceOut] = []
-    for inv in rows:
-        items_out = []
-        if include_items:
-            items_out = [
-                InvoiceItemOut(
-                    item_code=i.item_code,
-                    item_name=i.item_name,
-                    qty=i.qty,
-                    rate=i.rate,
-                    amount=i.amount,
-                )
-                for i in (inv.items or [])
-            ]
-
-        out.append(
-            InvoiceOut(
-                invoice_id=inv.invoice_id,
-                supplier=inv.supplier,
-                posting_date=inv.posting_date,
-                grand_total=inv.grand_total,
-                erp_modified=inv.erp_modified,
-                items=items_out,
-            )
-        )
+    rows = await run_read(db, list_invoices, list_invoices_async, limit=limit)
+    return ApiResponse(data=[_invoice_out(inv, include_items) for inv in rows])
+
 
-    return ApiResponse(data=out)
+@router.get("/{invoice_id}", response_model=ApiResponse[InvoiceOut])
+async def get_invoice(invoice_id: str, db=Depends(get_read_db)):
+    """
+    One invoice with its items (invoice detail view).
+    """
+    inv = await run_read(db, get_invoice_by_invoice_id, get_invoice_by_invoice_id_async, invoice_id=invoice_id)
+    if inv is None:
+        raise HTTPException(status_code=404, detail="invoice not found")
+    return ApiResponse(data=_invoice_out(inv))
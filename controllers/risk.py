@@ -1,28 +1,29 @@
-from fastapi import APIRouter, Depends, Query, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.orm import Session
 
 from core.config import settings
-from db.session import get_db
+from db.session import get_db, get_read_db, run_read
 from helpers import cache_get, cache_set
-from queries.risk import list_anomalies, upsert_risk
+from queries.risk import count_stale_risk, count_stale_risk_async, list_anomalies, list_anomalies_async
 from schemas.responses import ApiResponse
 from schemas.risk import RiskOut
-from services.risk_engine import compute_risk
+from services.risk_recalc import recalculate_risk as recalculate_invoices, recalculate_stale
+from services.risk_rules import refresh_rules, refresh_rules_async, reload_rules
 
 router = APIRouter(prefix="/risk", tags=["risk"])
 
 
 @router.get("/anomalies", response_model=ApiResponse[list[RiskOut]])
-def anomalies(
+async def anomalies(
     min_rate: float = Query(0.6, ge=0.0, le=1.0),
     limit: int = Query(500, ge=1, le=500),
-    db: Session = Depends(get_db),
+    db=Depends(get_read_db),
 ):
     """
     DB-driven anomalies list (fast).
     Returns supplier + invoice_id + risk + reasons.
     """
-    invoices = list_anomalies(db, min_rate=min_rate, limit=limit)
+    invoices = await run_read(db, list_anomalies, list_anomalies_async, min_rate=min_rate, limit=limit)
 
     out: list[RiskOut] = []
     for inv in invoices:
@@ -42,11 +43,11 @@ def anomalies(
 
 
 @router.get("/vendors", response_model=ApiResponse[dict])
-def vendors_chart(
+async def vendors_chart(
     request: Request,
     min_rate: float = Query(0.0, ge=0.0, le=1.0),
     limit: int = Query(500, ge=1, le=2000),
-    db: Session = Depends(get_db),
+    db=Depends(get_read_db),
 ):
     """
     Vendors chart data for frontend:
@@ -63,9 +64,9 @@ def vendors_chart(
     # Pull a lot of invoices (DB source of truth)
     # Using existing invoices endpoint query logic would be another option,
     # but here we aggregate from ORM objects quickly.
-    from queries.invoices import list_invoices  # local import to avoid circular
+    from queries.invoices import list_invoices, list_invoices_async  # local import to avoid circular
 
-    invoices = list_invoices(db, limit=limit)
+    invoices = await run_read(db, list_invoices, list_invoices_async, limit=limit)
 
     by_supplier: dict[str, dict] = {}
     for inv in invoices:
@@ -118,58 +119,75 @@ def vendors_chart(
 def recalculate_risk(
     request: Request,
     limit: int = Query(500, ge=1, le=2000),
+    force: bool = Query(False),
     db: Session = Depends(get_db),
 ):
     """
     ADMIN / MAINTENANCE:
-    Force recompute risk for last N invoices from DB.
+    Recompute risk for last N invoices from DB.
     Use this after changing risk rules or enabling AI, without touching ERPNext.
+    Only invoices whose risk inputs changed (input fingerprint) are rescored; force=true rescores all N.
 
     It also clears cached dashboard data after recalculation.
     """
-    from queries.invoices import list_invoices  # local import to avoid circular
+    res = recalculate_invoices(db, limit=limit, force=force)
+    cleared = _clear_dashboard_cache(request)
+
+    return ApiResponse(
+        data={
+            "status": "ok",
+            "checked": res["checked"],
+            "recalculated": res["recalculated"],
+            "written": res["written"],
+            "limit": limit,
+            "ttl_cache_cleared_keys": cleared,
+        }
+    )
 
-    invoices = list_invoices(db, limit=limit)
 
-    updated = 0
-    for inv in invoices:
-        risk = compute_risk(
-            {"grand_total": inv.grand_total},
-            [
-                {
-                    "qty": it.qty,
-                    "rate": it.rate,
-                    "amount": it.amount,
-                    "item_code": it.item_code,
-                    "item_name": it.item_name,
-                    "idx": it.idx,
-                }
-                for it in (inv.items or [])
-            ],
-        )
+@router.get("/rules", response_model=ApiResponse[dict])
+async def rules_status(db=Depends(get_read_db)):
+    """
+    Active risk rules version + how many invoices are not scored under it yet.
+    """
+    rules = await run_read(db, refresh_rules, refresh_rules_async)
+    stale = await run_read(db, count_stale_risk, count_stale_risk_async, rules_version=rules.version)
+    return ApiResponse(data={**rules.summary(), "stale_invoices": stale})
 
-        upsert_risk(
-            db,
-            invoice_pk=inv.id,
-            rate=float(risk["rate"]),
-            risk_level=str(risk["risk_level"]),
-            reasons=risk["reasons"],
-        )
-        updated += 1
 
-    # Clear cached charts/summary after recalculation
+@router.post("/rules/reload", include_in_schema=False, response_model=ApiResponse[dict])
+def reload_risk_rules(request: Request, db: Session = Depends(get_db)):
+    """
+    ADMIN / MAINTENANCE:
+    Re-read the rule table (RISK_RULES_PATH), publish it to the DB (every API replica and the
+    sync worker switch to it) and rescore ONLY invoices whose risk inputs changed (other rules
+    version, AI mode, invoice data). A broken rules file keeps the current rules (400).
+    """
     try:
-        cache = request.app.state.ttl_cache
-        from helpers import cache_clear_prefix
-        cleared = cache_clear_prefix(cache, "vendors:")
-    except Exception:
-        cleared = 0
+        previous, rules = reload_rules(db)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"invalid risk rules: {e}")
+
+    res = recalculate_stale(db)
+    cleared = _clear_dashboard_cache(request) if res["written"] else 0
 
     return ApiResponse(
         data={
             "status": "ok",
-            "recalculated": updated,
-            "limit": limit,
+            "previous_version": previous,
+            "rules_version": rules.version,
+            "recalculated": res["recalculated"],
+            "written": res["written"],
             "ttl_cache_cleared_keys": cleared,
         }
     )
+
+
+def _clear_dashboard_cache(request: Request) -> int:
+    # Clear cached charts/summary after recalculation
+    try:
+        cache = request.app.state.ttl_cache
+        from helpers import cache_clear_prefix
+        return cache_clear_prefix(cache, "vendors:")
+    except Exception:
+        return 0
@@ -1,23 +1,38 @@
-from fastapi import APIRouter, Depends, Request
+import json
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
 
-from db.session import get_db
-from services.sync_service import SyncService
+from core.config import settings
+from db.session import get_db, get_read_db
+from services.sync_service import get_sync_service
+from services.webhook import parse_payload, verify_signature
 from schemas.responses import ApiResponse
 from helpers import cache_clear_prefix
 
 router = APIRouter(prefix="/sync", tags=["sync"])
 
-_sync = SyncService()
+_sync = get_sync_service()  # shared with the scheduler
+
+
+def _handed_over(response: Response, action: str) -> ApiResponse:
+    # another worker holds the sync lease: it runs the trigger on its next poll (single writer)
+    response.status_code = 202
+    return ApiResponse(data={"status": "requested", "action": action})
 
 
 @router.post("/run", response_model=ApiResponse[dict])
-async def run_sync(request: Request, db: Session = Depends(get_db)):
+async def run_sync(request: Request, response: Response, db: Session = Depends(get_db)):
     """
     Run one sync cycle manually.
+    If a cycle is already running (scheduler or another request), this waits for
+    the single follow-up cycle shared by all late callers ("coalesced": true).
+    Another worker leading the sync => the cycle is handed over to it (202, "requested").
     After sync, we clear TTL cached dashboard endpoints (vendors etc.)
     """
-    res = await _sync.run_one_cycle(db)
+    res = await request.app.state.scheduler.run_exclusive(lambda: _sync.run_one_cycle(db), {"cycle": True})
+    if res is None:
+        return _handed_over(response, "cycle")
 
     # Invalidate cached charts/summary after sync
     try:
@@ -29,3 +44,122 @@ async def run_sync(request: Request, db: Session = Depends(get_db)):
         pass
 
     return ApiResponse(data=res)
+
+
+@router.post("/backfill", response_model=ApiResponse[dict])
+async def run_backfill(
+    request: Request,
+    response: Response,
+    pages: int = Query(1, ge=1, le=1000),
+    reset: bool = Query(False),
+    db: Session = Depends(get_db),
+):
+    """
+    Import history page by page (oldest first).
+    Progress is committed per page, so calling again resumes where it stopped.
+    reset=true starts again from the oldest invoice.
+    Another worker leading the sync => handed over to it (202, "requested").
+    """
+    res = await request.app.state.scheduler.run_exclusive(
+        lambda: _sync.run_backfill(db, max_pages=pages, reset=reset),
+        {"backfill": {"pages": pages, "reset": reset}},
+    )
+    if res is None:
+        return _handed_over(response, "backfill")
+
+    try:
+        cache = request.app.state.ttl_cache
+        res["ttl_cache_cleared_keys"] = cache_clear_prefix(cache, "vendors:")
+    except Exception:
+        pass
+
+    return ApiResponse(data=res)
+
+
+@router.get("/backfill", response_model=ApiResponse[dict])
+async def backfill_progress(db=Depends(get_read_db)):
+    """
+    Backfill progress: cursor, processed invoices, pages, remaining (if ERPNext reachable).
+    """
+    return ApiResponse(data=await _sync.backfill_progress(db))
+
+
+@router.post("/reconcile", response_model=ApiResponse[dict])
+async def run_reconcile(request: Request, response: Response, db: Session = Depends(get_db)):
+    """
+    Compare per-month invoice counts with ERPNext and remove invoices
+    deleted / cancelled there (only mismatching months are listed).
+    Another worker leading the sync => handed over to it (202, "requested").
+    """
+    res = await request.app.state.scheduler.run_exclusive(lambda: _sync.run_reconcile(db), {"reconcile": True})
+    if res is None:
+        return _handed_over(response, "reconcile")
+
+    try:
+        cache = request.app.state.ttl_cache
+        res["ttl_cache_cleared_keys"] = cache_clear_prefix(cache, "vendors:")
+    except Exception:
+        pass
+
+    return ApiResponse(data=res)
+
+
+@router.get("/status", response_model=ApiResponse[dict])
+async def sync_status(request: Request):
+    """
+    Scheduler status: running flag, current adaptive interval, last cycle result.
+    """
+    scheduler = getattr(request.app.state, "scheduler", None)
+    if scheduler is None:
+        return ApiResponse(data={"running": False})
+    return ApiResponse(data=scheduler.status())
+
+
+@router.post("/webhook", status_code=202, response_model=ApiResponse[dict])
+async def erpnext_webhook(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+):
+    """
+    ERPNext webhook (Purchase Invoice insert / update / cancel).
+    - auth: SYNC_WEBHOOK_SECRET (X-Frappe-Webhook-Signature HMAC or X-Webhook-Secret)
+    - insert/update: names are queued and synced right after the response
+    - cancel/trash: invoice is removed locally right away (under the sync lock / lease;
+      another worker leading the sync => handed over to it, "removed": null)
+    """
+    if not settings.SYNC_WEBHOOK_SECRET:
+        raise HTTPException(status_code=404, detail="webhook not configured")
+
+    body = await request.body()
+    if not verify_signature(body, request.headers, settings.SYNC_WEBHOOK_SECRET):
+        raise HTTPException(status_code=401, detail="invalid webhook signature")
+
+    try:
+        to_sync, to_remove = parse_payload(json.loads(body or b"null"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    removed: int | None = 0
+    if to_remove:
+        # one request per name: sync_state values are short
+        removed = await request.app.state.scheduler.run_exclusive(
+            lambda: _sync.remove_invoices(db, to_remove),
+            [{"remove": [name]} for name in to_remove],
+        )
+        try:
+            cache_clear_prefix(request.app.state.ttl_cache, "vendors:")
+        except Exception:
+            pass
+
+    if to_sync:
+        _sync.enqueue_invoices(to_sync)
+        background_tasks.add_task(_drain_pending, request.app.state.scheduler)
+
+    return ApiResponse(data={"status": "accepted", "queued": to_sync, "removed": removed})
+
+
+async def _drain_pending(scheduler) -> None:
+    if await scheduler.run_exclusive(_sync.drain_pending, {"cycle": True}) is None:
+        # handed over: the leader's next cycle reads these changes from ERPNext (modified was bumped)
+        _sync.discard_pending()
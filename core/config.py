@@ -18,23 +18,87 @@ class Settings(BaseSettings):
     ERPNEXT_API_KEY: str
     ERPNEXT_API_SECRET: str
 
+    # Shared HTTP connection pool (one per process, keep-alive)
+    ERPNEXT_TIMEOUT_SECONDS: float = 20.0
+    ERPNEXT_MAX_CONNECTIONS: int = 20
+    ERPNEXT_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    ERPNEXT_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    ERPNEXT_HTTP2: bool = False  # requires: pip install "httpx[http2]"
+
+    # Request budget / retries / circuit breaker (per ERPNext host)
+    ERPNEXT_RATE_LIMIT_PER_SECOND: float = 10.0  # token bucket refill; 0 => unlimited
+    ERPNEXT_RATE_LIMIT_BURST: int = 20
+    ERPNEXT_MAX_RETRIES: int = 3  # extra attempts on 429 / 5xx / network errors
+    ERPNEXT_RETRY_BACKOFF_SECONDS: float = 0.5  # full-jitter exponential backoff base
+    ERPNEXT_RETRY_BACKOFF_MAX_SECONDS: float = 8.0
+    ERPNEXT_BREAKER_FAILURE_THRESHOLD: int = 5  # consecutive failed requests => circuit opens
+    ERPNEXT_BREAKER_RESET_SECONDS: float = 30.0  # open => one trial request after this
+
     # --------------------------------------------------
     # Database
     # --------------------------------------------------
     DATABASE_URL: str = "sqlite:///./app.db"
+    DB_ASYNC_ENABLED: bool = False  # async engine for read endpoints (aiosqlite / asyncpg)
+
+    # --------------------------------------------------
+    # Process role
+    # --------------------------------------------------
+    # "all" => API + scheduler in one process (default)
+    # "api" => API only: no scheduler, no schema changes (run `python -m services.worker` next to it)
+    APP_ROLE: str = "all"
 
     # --------------------------------------------------
     # Sync / Scheduler
     # --------------------------------------------------
     SYNC_ENABLED: bool = True
-    SYNC_INTERVAL_SECONDS: int = 5
+    SYNC_INTERVAL_SECONDS: int = 5  # base interval (adaptive: backoff when idle, 0 under backlog)
+    SYNC_INTERVAL_MAX_SECONDS: int = 300
+    SYNC_BACKOFF_FACTOR: float = 2.0
+    SYNC_JITTER_RATIO: float = 0.1
+
+    # Push ingestion (ERPNext webhooks). When a secret is set, polling becomes a safety net.
+    SYNC_WEBHOOK_SECRET: str | None = None
+    SYNC_WEBHOOK_POLL_INTERVAL_SECONDS: int = 300
     SYNC_MAX_CHANGED_PER_CYCLE: int = 50
+    SYNC_FETCH_CONCURRENCY: int = 8  # max in-flight ERPNext detail requests per cycle
+    SYNC_BATCH_ITEMS: bool = True  # fetch items via the child table, many invoices per request
+    SYNC_ITEMS_BATCH_SIZE: int = 100  # invoices per child-table request (keeps the URL short)
+    SYNC_PERSIST_CHUNK_SIZE: int = 200  # invoices written per DB transaction
+    SYNC_CHECKPOINT_SECONDS: float = 5.0  # also commit (+ cursor checkpoint) at least this often
+    SYNC_STOP_TIMEOUT_SECONDS: float = 10.0  # shutdown waits this long for the cycle to checkpoint
+    SYNC_THREADPOOL_SIZE: int = 4  # threads for blocking sync stages (DB, risk/AI) off the event loop
+    SYNC_SCORE_CONCURRENCY: int = 4  # risk scoring workers (pipeline stage; bounded by the thread pool)
+    SYNC_PIPELINE_QUEUE_SIZE: int = 200  # max items waiting between two pipeline stages (backpressure)
+
+    # Backfill / backlog drain (ascending pages, resumable)
+    SYNC_BACKFILL_ENABLED: bool = True
+    SYNC_BACKFILL_PAGE_SIZE: int = 200
+    SYNC_BACKFILL_PAGES_PER_TICK: int = 5  # pages per scheduler tick (keeps delta sync responsive)
+
+    # Leader election: with several workers only the lease holder runs the scheduler loop
+    SYNC_LEADER_ELECTION: bool = True
+    SYNC_LEADER_LEASE_SECONDS: int = 30  # holder renews every third of this; dead holder => takeover after expiry
+    # manual triggers (/sync/*, webhooks) on a non-leader are left in sync_state; the leader polls this often
+    SYNC_REQUEST_POLL_SECONDS: float = 2.0
+
+    # Reconciliation: find invoices deleted / cancelled in ERPNext (per-month count digests)
+    SYNC_RECONCILE_ENABLED: bool = True
+    SYNC_RECONCILE_INTERVAL_SECONDS: int = 3600
+    SYNC_RECONCILE_DELETE: bool = True  # false => orphans are only reported, not removed
+    # an invoice failing this many syncs is dead-lettered: the cursor moves past it, reconcile retries it
+    SYNC_MAX_INVOICE_ATTEMPTS: int = 3
 
     # --------------------------------------------------
     # Internal Cache (seconds)
     # --------------------------------------------------
     DASHBOARD_TTL_SECONDS: int = 15
 
+    # --------------------------------------------------
+    # Risk rules (versioned rule table; empty path => bundled core/risk_rules.json)
+    # --------------------------------------------------
+    RISK_RULES_PATH: str = ""
+    RISK_RECALC_PAGE_SIZE: int = 5000  # invoices rescored per transaction after a rule change
+
     # --------------------------------------------------
     # AI Provider (OpenAI / Claude / None)
     # --------------------------------------------------
@@ -44,6 +108,14 @@ class Settings(BaseSettings):
 
     # Optional: which model to use (keep default simple)
     OPENAI_MODEL: str = "gpt-4o-mini"
+    OPENAI_BASE_URL: str | None = None  # OpenAI-compatible endpoint (proxy, local stub); None => api.openai.com
+    AI_TIMEOUT_SECONDS: float = 15.0
+
+    # AI enrichment off the critical path: rule-based risk is stored at once, the AI
+    # adjustment patches the row later (background worker, bounded concurrency)
+    AI_ASYNC_ENRICHMENT: bool = True
+    AI_ENRICH_CONCURRENCY: int = 4
+    AI_ENRICH_QUEUE_SIZE: int = 1000  # full queue => job dropped, row stays pending (next recalc re-queues)
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,16 @@
+from sqlalchemy.orm import Session
+
+
+def dialect_insert(db: Session, model):
+    """
+    INSERT construct that supports .on_conflict_do_update() (SQLite / PostgreSQL).
+    Returns None for other dialects => callers fall back to the ORM path.
+    """
+    name = db.get_bind().dialect.name
+    if name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    return insert(model)
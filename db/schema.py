@@ -0,0 +1,32 @@
+import logging
+
+from sqlalchemy import inspect, text
+
+from models.base import Base
+import models.invoice  # noqa: F401  (register tables on Base.metadata)
+import models.risk  # noqa: F401
+import models.sync_state  # noqa: F401
+
+log = logging.getLogger("schema")
+
+
+def ensure_schema(bind) -> None:
+    """
+    create_all + add NULLABLE columns/indexes that newer code expects on older tables.
+    (no Alembic in this project; only additive, nullable changes are handled here)
+    """
+    Base.metadata.create_all(bind=bind)
+
+    insp = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        existing = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in existing or not col.nullable:
+                continue
+            col_type = col.type.compile(dialect=bind.dialect)
+            log.info("adding column %s.%s (%s)", table.name, col.name, col_type)
+            with bind.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {col.name} {col_type}'))
+
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
@@ -1,5 +1,9 @@
+from fastapi import Depends
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
 
 from core.config import settings
 
@@ -22,3 +26,60 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# --------------------------------------------------
+# Optional async engine (DB_ASYNC_ENABLED=true)
+# sqlite -> aiosqlite, postgresql -> asyncpg (same DATABASE_URL)
+# --------------------------------------------------
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def async_database_url(url: str) -> str:
+    u = make_url(url)
+    backend = u.get_backend_name()
+    if u.get_driver_name() in ("aiosqlite", "asyncpg"):
+        return url
+    if backend not in _ASYNC_DRIVERS:
+        raise ValueError(f"DB_ASYNC_ENABLED=true is not supported for database backend '{backend}'")
+    return u.set(drivername=_ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+async_engine = None
+AsyncSessionLocal = None
+
+if settings.DB_ASYNC_ENABLED:
+    # Fail fast: missing aiosqlite/asyncpg raises here, at startup
+    async_engine = create_async_engine(
+        async_database_url(settings.DATABASE_URL),
+        pool_pre_ping=True,
+    )
+    AsyncSessionLocal = async_sessionmaker(
+        bind=async_engine,
+        autoflush=False,
+        expire_on_commit=False,
+    )
+
+
+async def get_read_db(db: Session = Depends(get_db)):
+    """
+    Session for read endpoints: AsyncSession when DB_ASYNC_ENABLED, else the sync one.
+    Use with run_read() so controllers work in both modes.
+    """
+    if AsyncSessionLocal is None:
+        yield db
+        return
+    async with AsyncSessionLocal() as adb:
+        yield adb
+
+
+async def run_read(db, sync_fn, async_fn, **kwargs):
+    """
+    Call the async query on an AsyncSession, else the sync query in the threadpool.
+    """
+    if isinstance(db, AsyncSession):
+        return await async_fn(db, **kwargs)
+    return await run_in_threadpool(sync_fn, db, **kwargs)
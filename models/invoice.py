@@ -15,6 +15,7 @@ class Invoice(Base):
 
     erp_modified = Column(String(32), index=True, nullable=True)
     items_hash = Column(String(64), index=True, nullable=True)
+    row_digest = Column(String(64), nullable=True)  # digest of the header fields => skip no-op writes
 
     items = relationship("InvoiceItem", back_populates="invoice", cascade="all, delete-orphan")
     risk = relationship("RiskAnalysis", back_populates="invoice", uselist=False, cascade="all, delete-orphan")
@@ -37,4 +38,6 @@ class InvoiceItem(Base):
     rate = Column(Float, nullable=True)   # unit price
     amount = Column(Float, nullable=True)
 
+    fingerprint = Column(String(64), nullable=True)  # hash of name/qty/rate/amount => diff updates
+
     invoice = relationship("Invoice", back_populates="items")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Float, String, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, Float, String, DateTime, ForeignKey, JSON, Text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
@@ -14,7 +14,25 @@ class RiskAnalysis(Base):
     rate = Column(Float, nullable=False, default=0.0)
     risk_level = Column(String(32), nullable=False, default="LOW")
     reasons = Column(JSON, nullable=False, default=list)
+    rules_version = Column(String(64), index=True, nullable=True)  # rule table version that produced this row
+    input_fingerprint = Column(String(64), nullable=True)  # items_hash + grand_total + rules version + AI mode
+    ai_status = Column(String(16), nullable=True)  # None (AI off) | "pending" (queued enrichment) | "done"
+    result_digest = Column(String(64), nullable=True)  # digest of the stored values => skip no-op writes
 
     calculated_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
     invoice = relationship("Invoice", back_populates="risk")
+
+
+class RiskRuleSet(Base):
+    """
+    Rule tables published by /risk/rules/reload; the newest row is the active one for
+    every process (API replicas, sync worker), not just the one that handled the reload.
+    """
+    __tablename__ = "risk_rule_sets"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(String(64), nullable=False)
+    document = Column(Text, nullable=False)  # rules JSON as loaded (see services/risk_rules.py)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
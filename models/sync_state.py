@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, String, DateTime, Float
 from sqlalchemy.sql import func
 
 from models.base import Base
@@ -10,5 +10,23 @@ class SyncState(Base):
     id = Column(Integer, primary_key=True)
     key = Column(String(64), unique=True, nullable=False)  # e.g. "purchase_invoice_last_modified"
     value = Column(String(255), nullable=True)
+    # keyset cursors: `value` holds `modified`, cursor_name the last `name` at that modified
+    cursor_name = Column(String(140), nullable=True)
+    # leases (leader election): `value` holds the holder id, expires_at is a unix timestamp
+    expires_at = Column(Float, nullable=True)
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class SyncFailure(Base):
+    """
+    Dead letters: invoices whose sync keeps failing (one row per invoice, removed once stored).
+    """
+    __tablename__ = "sync_failures"
+
+    id = Column(Integer, primary_key=True)
+    invoice_id = Column(String(140), unique=True, nullable=False)
+    modified = Column(String(64), nullable=True)  # ERPNext `modified` that failed (a new change starts over)
+    attempts = Column(Integer, nullable=False, default=0)
 
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
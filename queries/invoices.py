@@ -1,9 +1,17 @@
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import delete
+import hashlib
+import json
 
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import delete, func, insert, select, update
+
+from db.dialect import dialect_insert
 from models.invoice import Invoice, InvoiceItem
 
 
+INVOICE_FIELDS = ("supplier", "posting_date", "grand_total", "erp_modified", "items_hash")
+
+
 def get_invoice_by_invoice_id(db: Session, invoice_id: str) -> Invoice | None:
     return (
         db.query(Invoice)
@@ -13,6 +21,56 @@ def get_invoice_by_invoice_id(db: Session, invoice_id: str) -> Invoice | None:
     )
 
 
+def get_erp_modified_map(db: Session, invoice_ids: list[str], chunk_size: int = 500) -> dict[str, str | None]:
+    """
+    invoice_id -> erp_modified for the ids that already exist in DB.
+    One narrow set-based query per chunk (no ORM objects, no joins).
+    """
+    out: dict[str, str | None] = {}
+    ids = list(dict.fromkeys(i for i in invoice_ids if i))
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        rows = db.query(Invoice.invoice_id, Invoice.erp_modified).filter(Invoice.invoice_id.in_(chunk)).all()
+        out.update({inv_id: erp_mod for inv_id, erp_mod in rows})
+    return out
+
+
+def delete_invoices(db: Session, invoice_ids: list[str], commit: bool = True) -> int:
+    """
+    Remove invoices (items + risk go with them via ORM cascade). Returns rows removed.
+    """
+    ids = [i for i in invoice_ids if i]
+    if not ids:
+        return 0
+    rows = db.query(Invoice).filter(Invoice.invoice_id.in_(ids)).all()
+    for inv in rows:
+        db.delete(inv)
+    if commit:
+        db.commit()
+    else:
+        db.flush()
+    return len(rows)
+
+
+def count_invoices_by_month(db: Session) -> dict[str, int]:
+    """
+    Local reconciliation digest: posting month ("YYYY-MM", "" when unset) -> invoice count.
+    """
+    month = func.substr(Invoice.posting_date, 1, 7)
+    rows = db.query(month, func.count(Invoice.id)).group_by(month).all()
+    out: dict[str, int] = {}
+    for m, n in rows:
+        out[m or ""] = out.get(m or "", 0) + n
+    return out
+
+
+def list_invoice_ids_in_month(db: Session, month: str) -> list[str]:
+    q = db.query(Invoice.invoice_id)
+    if month:
+        q = q.filter(func.substr(Invoice.posting_date, 1, 7) == month)
+    else:
+        q = q.filter((Invoice.posting_date.is_(None)) | (Invoice.posting_date == ""))
+    return [inv_id for (inv_id,) in q.all()]
 
 
 def list_invoices(db: Session, limit: int = 500) -> list[Invoice]:
@@ -25,51 +83,256 @@ def list_invoices(db: Session, limit: int = 500) -> list[Invoice]:
     )
 
 
-def upsert_invoice_and_items(db: Session, *, invoice_data: dict, items: list[dict]) -> Invoice:
+def list_invoices_by_pks(db: Session, invoice_pks: list[int]) -> list[Invoice]:
+    if not invoice_pks:
+        return []
+    return (
+        db.query(Invoice)
+        .options(selectinload(Invoice.items))
+        .filter(Invoice.id.in_(invoice_pks))
+        .order_by(Invoice.id.desc())
+        .all()
+    )
+
+
+def list_risk_inputs(db: Session, invoice_pks: list[int]) -> dict:
     """
-    Upsert invoice + replace its items (safe for UNIQUE constraints).
-    invoice_data keys expected:
-      invoice_id, supplier, posting_date, grand_total, erp_modified, items_hash
+    Columnar risk-engine input for the given invoices (compute_risk_batch):
+    {"invoice_pks", "grand_total", "items_hash", "offsets", "qty", "rate"}; items of invoice i
+    are qty/rate[offsets[i]:offsets[i + 1]] in insertion order. Plain column rows, no ORM objects.
     """
+    invoices = []
+    for start in range(0, len(invoice_pks), 500):
+        invoices.extend(db.execute(
+            select(Invoice.id, Invoice.grand_total, Invoice.items_hash)
+            .where(Invoice.id.in_(invoice_pks[start:start + 500]))
+        ).all())
+    invoices.sort(key=lambda r: r.id, reverse=True)
+    pks = [r.id for r in invoices]
+    position = {pk: i for i, pk in enumerate(pks)}
+
+    counts = [0] * len(pks)
+    rows: list[tuple[int, float, float]] = []
+    for start in range(0, len(pks), 500):
+        chunk = pks[start:start + 500]
+        rows.extend(
+            (position[r.invoice_id_fk], r.qty or 0.0, r.rate or 0.0)
+            for r in db.execute(
+                select(InvoiceItem.invoice_id_fk, InvoiceItem.qty, InvoiceItem.rate)
+                .where(InvoiceItem.invoice_id_fk.in_(chunk))
+                .order_by(InvoiceItem.id)
+            )
+        )
+    rows.sort(key=lambda r: r[0])  # stable => item order kept per invoice
+
+    offsets = [0]
+    for pos, _, _ in rows:
+        counts[pos] += 1
+    for c in counts:
+        offsets.append(offsets[-1] + c)
+
+    return {
+        "invoice_pks": pks,
+        "grand_total": [r.grand_total or 0.0 for r in invoices],
+        "items_hash": [r.items_hash for r in invoices],
+        "offsets": offsets,
+        "qty": [r[1] for r in rows],
+        "rate": [r[2] for r in rows],
+    }
+
+
+# ---------------------------
+# Async equivalents (DB_ASYNC_ENABLED); selectinload => no lazy loads on AsyncSession
+# ---------------------------
+
+async def get_invoice_by_invoice_id_async(db: AsyncSession, invoice_id: str) -> Invoice | None:
+    res = await db.execute(
+        select(Invoice)
+        .options(selectinload(Invoice.items), selectinload(Invoice.risk))
+        .where(Invoice.invoice_id == invoice_id)
+        .limit(1)
+    )
+    return res.scalars().first()
+
+
+async def list_invoices_async(db: AsyncSession, limit: int = 500) -> list[Invoice]:
+    res = await db.execute(
+        select(Invoice)
+        .options(selectinload(Invoice.items), selectinload(Invoice.risk))
+        .order_by(Invoice.id.desc())
+        .limit(limit)
+    )
+    return list(res.scalars().all())
+
 
+def normalize_item(it: dict) -> dict:
+    """
+    ERPNext item dict -> InvoiceItem column values (same coercion everywhere).
+    """
+    return {
+        "idx": int(it.get("idx") or 0),
+        "item_code": str(it.get("item_code") or ""),
+        "item_name": str(it.get("item_name") or it.get("item_code") or ""),
+        "qty": float(it.get("qty") or 0.0),
+        "rate": float(it.get("rate") or 0.0),
+        "amount": float(it.get("amount") or 0.0),
+    }
+
+
+def item_fingerprint(row: dict) -> str:
+    """
+    Fingerprint of an item's mutable values; identity is (item_code, idx) like uq_invoice_item.
+    """
+    raw = json.dumps([row["item_name"], row["qty"], row["rate"], row["amount"]], separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def sync_items(db: Session, items_by_invoice_pk: dict[int, list[dict]]) -> dict[str, int]:
+    """
+    Bring stored items in line with `items_by_invoice_pk` by diffing on (item_code, idx):
+    only lines that were added, changed (fingerprint differs) or removed are written.
+    No commit. Returns {"inserted", "updated", "deleted"} counts.
+    """
+    counts = {"inserted": 0, "updated": 0, "deleted": 0}
+    if not items_by_invoice_pk:
+        return counts
+
+    existing: dict[tuple, tuple[int, str | None]] = {}
+    rows = (
+        db.query(InvoiceItem.id, InvoiceItem.invoice_id_fk, InvoiceItem.item_code, InvoiceItem.idx, InvoiceItem.fingerprint)
+        .filter(InvoiceItem.invoice_id_fk.in_(list(items_by_invoice_pk)))
+        .all()
+    )
+    for item_pk, inv_pk, item_code, idx, fp in rows:
+        existing[(inv_pk, item_code, idx)] = (item_pk, fp)
+
+    to_insert: list[dict] = []
+    to_update: list[dict] = []
+    wanted: set[tuple] = set()
+
+    for inv_pk, items in items_by_invoice_pk.items():
+        for it in items or []:
+            row = normalize_item(it)
+            row["fingerprint"] = item_fingerprint(row)
+            key = (inv_pk, row["item_code"], row["idx"])
+            if key in wanted:
+                continue  # duplicate line in payload => first one wins (unique key)
+            wanted.add(key)
+
+            hit = existing.get(key)
+            if hit is None:
+                to_insert.append({"invoice_id_fk": inv_pk, **row})
+            elif hit[1] != row["fingerprint"]:
+                to_update.append({"id": hit[0], **row})
+
+    to_delete = [item_pk for key, (item_pk, _) in existing.items() if key not in wanted]
+
+    if to_delete:
+        db.execute(delete(InvoiceItem).where(InvoiceItem.id.in_(to_delete)))
+    if to_update:
+        db.execute(update(InvoiceItem), to_update)  # bulk UPDATE by primary key
+    if to_insert:
+        db.execute(insert(InvoiceItem), to_insert)
+
+    counts.update(inserted=len(to_insert), updated=len(to_update), deleted=len(to_delete))
+    return counts
+
+
+def _invoice_row(invoice_data: dict) -> dict:
     inv_id = str(invoice_data.get("invoice_id") or "").strip()
     if not inv_id:
         raise ValueError("invoice_data.invoice_id is required")
+    row = {
+        "invoice_id": inv_id,
+        "supplier": invoice_data.get("supplier"),
+        "posting_date": invoice_data.get("posting_date"),
+        "grand_total": float(invoice_data.get("grand_total") or 0.0),
+        "erp_modified": invoice_data.get("erp_modified"),
+        "items_hash": invoice_data.get("items_hash"),
+    }
+    row["row_digest"] = invoice_digest(row)
+    return row
+
+
+def invoice_digest(row: dict) -> str:
+    """
+    Digest of the stored header fields => equal digest = no-op write.
+    """
+    raw = json.dumps([row[field] for field in INVOICE_FIELDS], separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _upsert_invoice_row(db: Session, row: dict) -> tuple[Invoice, bool]:
+    inv = db.query(Invoice).filter(Invoice.invoice_id == row["invoice_id"]).first()
+    if inv is not None and inv.row_digest == row["row_digest"]:
+        return inv, False
 
-    inv = db.query(Invoice).filter(Invoice.invoice_id == inv_id).first()
     if inv is None:
-        inv = Invoice(invoice_id=inv_id)
+        inv = Invoice(invoice_id=row["invoice_id"])
         db.add(inv)
-        db.flush()  # assign inv.id
 
     # Update invoice fields
-    inv.supplier = invoice_data.get("supplier")
-    inv.posting_date = invoice_data.get("posting_date")
-    inv.grand_total = float(invoice_data.get("grand_total") or 0.0)
-    inv.erp_modified = invoice_data.get("erp_modified")
-    inv.items_hash = invoice_data.get("items_hash")
+    for field in (*INVOICE_FIELDS, "row_digest"):
+        setattr(inv, field, row[field])
 
     db.flush()  # ensure inv.id exists
+    return inv, True
 
-    # Replace items to avoid UNIQUE constraint issues
-    db.execute(delete(InvoiceItem).where(InvoiceItem.invoice_id_fk == inv.id))
-    db.flush()
-
-    for it in items or []:
-        db.add(
-            InvoiceItem(
-                invoice_id_fk=inv.id,
-                idx=int(it.get("idx") or 0),
-                item_code=str(it.get("item_code") or ""),
-                item_name=str(it.get("item_name") or it.get("item_code") or ""),
-                qty=float(it.get("qty") or 0.0),
-                rate=float(it.get("rate") or 0.0),
-                amount=float(it.get("amount") or 0.0),
+
+def bulk_upsert_invoices_and_items(
+    db: Session,
+    records: list[tuple[dict, list[dict]]],
+) -> tuple[dict[str, int], dict[str, int]]:
+    """
+    Set-based upsert of many invoices + diff their items, WITHOUT commit
+    (caller writes risk + cursor in the same transaction).
+    records: [(invoice_data, items), ...]
+    Headers whose stored digest already matches are not written.
+    Returns (invoice_id -> invoices.id, {"evaluated", "written", "items_written"}).
+    """
+    # last write wins for duplicated invoice ids (ON CONFLICT can't touch a row twice)
+    by_id = {}
+    for invoice_data, items in records:
+        row = _invoice_row(invoice_data)
+        by_id[row["invoice_id"]] = (row, items or [])
+    if not by_id:
+        return {}, {"evaluated": 0, "written": 0, "items_written": 0}
+
+    stored = _get_invoice_digests(db, list(by_id))
+    changed = [row for inv_id, (row, _) in by_id.items() if stored.get(inv_id, (None, None))[1] != row["row_digest"]]
+
+    if changed:
+        stmt = dialect_insert(db, Invoice)
+        if stmt is None:
+            for row in changed:
+                _upsert_invoice_row(db, row)
+        else:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Invoice.invoice_id],
+                set_={field: getattr(stmt.excluded, field) for field in (*INVOICE_FIELDS, "row_digest")},
             )
-        )
+            db.execute(stmt, changed)  # executemany: one compiled statement for any batch size
+
+    pk_by_id = {inv_id: pk for inv_id, (pk, _) in stored.items()}
+    new_ids = [inv_id for inv_id in by_id if inv_id not in pk_by_id]
+    if new_ids:
+        pk_by_id.update({inv_id: pk for inv_id, (pk, _) in _get_invoice_digests(db, new_ids).items()})
+
+    item_counts = sync_items(db, {pk_by_id[inv_id]: items for inv_id, (_, items) in by_id.items()})
+
+    return pk_by_id, {
+        "evaluated": len(by_id),
+        "written": len(changed),
+        "items_written": sum(item_counts.values()),
+    }
 
-    db.commit()
 
-    # Optional: load relationships
-    db.refresh(inv)
-    return inv
+def _get_invoice_digests(db: Session, invoice_ids: list[str], chunk_size: int = 500) -> dict[str, tuple[int, str | None]]:
+    out: dict[str, tuple[int, str | None]] = {}
+    for start in range(0, len(invoice_ids), chunk_size):
+        chunk = invoice_ids[start:start + chunk_size]
+        for inv_id, pk, digest in (
+            db.query(Invoice.invoice_id, Invoice.id, Invoice.row_digest).filter(Invoice.invoice_id.in_(chunk)).all()
+        ):
+            out[inv_id] = (pk, digest)
+    return out
@@ -1,7 +1,37 @@
-from sqlalchemy.orm import Session
-from models.risk import RiskAnalysis
+import hashlib
+import json
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+
+from db.dialect import dialect_insert
+from models.risk import RiskAnalysis, RiskRuleSet
 from models.invoice import Invoice
 
+RISK_FIELDS = ("rate", "risk_level", "reasons", "rules_version", "input_fingerprint", "ai_status", "result_digest")
+
+
+def risk_digest(
+    rate: float,
+    risk_level: str,
+    reasons: list,
+    rules_version: str | None = None,
+    input_fingerprint: str | None = None,
+    ai_status: str | None = None,
+) -> str:
+    """
+    Digest of everything upsert_risk would store => equal digest = no-op write.
+    """
+    raw = json.dumps(
+        [float(rate), str(risk_level), reasons, rules_version, input_fingerprint, ai_status],
+        separators=(",", ":"),
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
 
 def upsert_risk(
     db: Session,
@@ -10,22 +40,152 @@ def upsert_risk(
     rate: float,
     risk_level: str,
     reasons: list,
-) -> None:
+    rules_version: str | None = None,
+    input_fingerprint: str | None = None,
+    ai_status: str | None = None,
+    commit: bool = True,
+) -> bool:
+    """
+    Insert / update one risk row. Identical result (same digest) => no UPDATE, no commit.
+    Returns True when something was written.
+    """
+    digest = risk_digest(rate, risk_level, reasons, rules_version, input_fingerprint, ai_status)
     row = db.query(RiskAnalysis).filter(RiskAnalysis.invoice_id_fk == invoice_pk).first()
+    if row is not None and row.result_digest == digest:
+        return False
+
     if not row:
-        row = RiskAnalysis(
-            invoice_id_fk=invoice_pk,
-            rate=rate,
-            risk_level=risk_level,
-            reasons=reasons,
-        )
+        row = RiskAnalysis(invoice_id_fk=invoice_pk)
         db.add(row)
-    else:
-        row.rate = rate
-        row.risk_level = risk_level
-        row.reasons = reasons
+    row.rate = rate
+    row.risk_level = risk_level
+    row.reasons = reasons
+    row.rules_version = rules_version
+    row.input_fingerprint = input_fingerprint
+    row.ai_status = ai_status
+    row.result_digest = digest
+
+    if commit:
+        db.commit()
+    return True
+
+
+def bulk_upsert_risk(db: Session, rows: list[dict]) -> int:
+    """
+    Set-based upsert of risk rows, WITHOUT commit.
+    rows: [{"invoice_pk", "rate", "risk_level", "reasons", "rules_version"?, "input_fingerprint"?, "ai_status"?}, ...]
+    Rows whose stored result digest already matches are skipped.
+    Returns how many rows were written.
+    """
+    if not rows:
+        return 0
+
+    values = []
+    for r in rows:
+        v = {
+            "invoice_id_fk": r["invoice_pk"],
+            "rate": float(r["rate"]),
+            "risk_level": str(r["risk_level"]),
+            "reasons": r["reasons"],
+            "rules_version": r.get("rules_version"),
+            "input_fingerprint": r.get("input_fingerprint"),
+            "ai_status": r.get("ai_status"),
+        }
+        v["result_digest"] = risk_digest(
+            v["rate"], v["risk_level"], v["reasons"], v["rules_version"], v["input_fingerprint"], v["ai_status"]
+        )
+        values.append(v)
+
+    stored = get_risk_digests(db, [v["invoice_id_fk"] for v in values])
+    values = [v for v in values if stored.get(v["invoice_id_fk"]) != v["result_digest"]]
+    if not values:
+        return 0
+
+    stmt = dialect_insert(db, RiskAnalysis)
+    if stmt is None:
+        for v in values:
+            row = db.query(RiskAnalysis).filter(RiskAnalysis.invoice_id_fk == v["invoice_id_fk"]).first()
+            if row is None:
+                db.add(RiskAnalysis(**v))
+            else:
+                for field, value in v.items():
+                    setattr(row, field, value)
+        db.flush()
+        return len(values)
+
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[RiskAnalysis.invoice_id_fk],
+        set_={field: getattr(stmt.excluded, field) for field in RISK_FIELDS},
+    )
+    db.execute(stmt, values)  # executemany: one compiled statement for any batch size
+    return len(values)
+
+
+def get_risk_digests(db: Session, invoice_pks: list[int], chunk_size: int = 500) -> dict[int, str | None]:
+    out: dict[int, str | None] = {}
+    for start in range(0, len(invoice_pks), chunk_size):
+        chunk = invoice_pks[start:start + chunk_size]
+        out.update(
+            db.query(RiskAnalysis.invoice_id_fk, RiskAnalysis.result_digest)
+            .filter(RiskAnalysis.invoice_id_fk.in_(chunk))
+            .all()
+        )
+    return out
+
+
+def stale_risk_filter(rules_version: str):
+    """
+    Invoices without a risk row or scored under another rules version (outer join on risk).
+    """
+    return or_(
+        RiskAnalysis.id.is_(None),
+        RiskAnalysis.rules_version.is_(None),
+        RiskAnalysis.rules_version != rules_version,
+    )
+
+
+def count_stale_risk(db: Session, rules_version: str) -> int:
+    return db.execute(
+        select(func.count(Invoice.id))
+        .outerjoin(RiskAnalysis, RiskAnalysis.invoice_id_fk == Invoice.id)
+        .where(stale_risk_filter(rules_version))
+    ).scalar_one()
+
+
+def list_risk_fingerprints(db: Session, *, before_pk: int | None = None, limit: int = 5000) -> list:
+    """
+    Keyset page (newest first, by invoice PK) of what staleness depends on:
+    rows of (id, items_hash, grand_total, input_fingerprint); fingerprint None = no risk row.
+    Narrow columns only, so scanning every invoice stays cheap.
+    """
+    stmt = (
+        select(Invoice.id, Invoice.items_hash, Invoice.grand_total, RiskAnalysis.input_fingerprint)
+        .outerjoin(RiskAnalysis, RiskAnalysis.invoice_id_fk == Invoice.id)
+    )
+    if before_pk is not None:
+        stmt = stmt.where(Invoice.id < before_pk)
+    return db.execute(stmt.order_by(Invoice.id.desc()).limit(limit)).all()
+
 
+def publish_rule_set(db: Session, version: str, document: str) -> int:
+    """
+    Make a rules document the active one for all processes. Returns its id.
+    """
+    row = RiskRuleSet(version=version, document=document)
+    db.add(row)
     db.commit()
+    return row.id
+
+
+def get_active_rule_set_id(db: Session) -> int | None:
+    """
+    Id of the newest published rules document (None = nothing published, use the rules file).
+    """
+    return db.execute(select(func.max(RiskRuleSet.id))).scalar()
+
+
+def get_rule_set_document(db: Session, rule_set_id: int) -> str | None:
+    return db.execute(select(RiskRuleSet.document).where(RiskRuleSet.id == rule_set_id)).scalar()
 
 
 def list_anomalies(db: Session, min_rate: float = 0.6, limit: int = 500) -> list[Invoice]:
@@ -38,3 +198,36 @@ def list_anomalies(db: Session, min_rate: float = 0.6, limit: int = 500) -> list
         .limit(limit)
         .all()
     )
+
+
+# ---------------------------
+# Async equivalents (DB_ASYNC_ENABLED)
+# ---------------------------
+
+async def count_stale_risk_async(db: AsyncSession, rules_version: str) -> int:
+    res = await db.execute(
+        select(func.count(Invoice.id))
+        .outerjoin(RiskAnalysis, RiskAnalysis.invoice_id_fk == Invoice.id)
+        .where(stale_risk_filter(rules_version))
+    )
+    return res.scalar_one()
+
+
+async def get_active_rule_set_id_async(db: AsyncSession) -> int | None:
+    return (await db.execute(select(func.max(RiskRuleSet.id)))).scalar()
+
+
+async def get_rule_set_document_async(db: AsyncSession, rule_set_id: int) -> str | None:
+    return (await db.execute(select(RiskRuleSet.document).where(RiskRuleSet.id == rule_set_id))).scalar()
+
+
+async def list_anomalies_async(db: AsyncSession, min_rate: float = 0.6, limit: int = 500) -> list[Invoice]:
+    res = await db.execute(
+        select(Invoice)
+        .options(selectinload(Invoice.risk))
+        .join(RiskAnalysis, RiskAnalysis.invoice_id_fk == Invoice.id)
+        .where(RiskAnalysis.rate >= min_rate)
+        .order_by(RiskAnalysis.rate.desc())
+        .limit(limit)
+    )
+    return list(res.scalars().all())
@@ -1,5 +1,10 @@
+import json
+import uuid
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from models.sync_state import SyncState
+from models.sync_state import SyncFailure, SyncState
 
 
 def get_state(db: Session, key: str) -> str | None:
@@ -7,11 +12,133 @@ def get_state(db: Session, key: str) -> str | None:
     return row.value if row else None
 
 
-def set_state(db: Session, key: str, value: str | None) -> None:
+def set_state(db: Session, key: str, value: str | None, commit: bool = True) -> None:
     row = db.query(SyncState).filter(SyncState.key == key).first()
     if not row:
         row = SyncState(key=key, value=value)
         db.add(row)
     else:
         row.value = value
+    if commit:
+        db.commit()
+    else:
+        db.flush()
+
+
+def get_cursor(db: Session, key: str) -> tuple[str | None, str | None]:
+    """
+    Compound (modified, name) cursor. name is None for cursors written before it existed.
+    """
+    row = db.query(SyncState).filter(SyncState.key == key).first()
+    return (row.value, row.cursor_name) if row else (None, None)
+
+
+def set_cursor(db: Session, key: str, modified: str | None, name: str | None, commit: bool = True) -> None:
+    row = db.query(SyncState).filter(SyncState.key == key).first()
+    if not row:
+        row = SyncState(key=key, value=modified, cursor_name=name)
+        db.add(row)
+    else:
+        row.value = modified
+        row.cursor_name = name
+    if commit:
+        db.commit()
+    else:
+        db.flush()
+
+
+SYNC_REQUEST_PREFIX = "sync_request:"
+
+
+def add_sync_request(db: Session, request: dict) -> None:
+    """
+    Leave a manual sync trigger for the scheduler leader (one row per request => no merge race).
+    """
+    db.add(SyncState(key=f"{SYNC_REQUEST_PREFIX}{uuid.uuid4().hex}", value=json.dumps(request)))
+    db.commit()
+
+
+def take_sync_requests(db: Session) -> list[dict]:
+    """
+    Pending manual triggers, oldest first; removed in the same transaction.
+    """
+    rows = (
+        db.query(SyncState)
+        .filter(SyncState.key.like(f"{SYNC_REQUEST_PREFIX}%"))
+        .order_by(SyncState.id)
+        .all()
+    )
+    if not rows:
+        return []
+    out = []
+    for row in rows:
+        try:
+            out.append(json.loads(row.value or "{}"))
+        except ValueError:
+            pass
+        db.delete(row)
     db.commit()
+    return out
+
+
+def get_sync_failures(db: Session, invoice_ids: list[str], chunk_size: int = 500) -> dict[str, SyncFailure]:
+    """
+    Failure rows of these invoices (usually none => one cheap indexed lookup).
+    """
+    out: dict[str, SyncFailure] = {}
+    for i in range(0, len(invoice_ids), chunk_size):
+        chunk = invoice_ids[i:i + chunk_size]
+        for row in db.query(SyncFailure).filter(SyncFailure.invoice_id.in_(chunk)).all():
+            out[row.invoice_id] = row
+    return out
+
+
+def record_sync_failures(db: Session, failed: list[dict]) -> dict[str, int]:
+    """
+    Count one more failed attempt per invoice meta (flush, no commit); a new ERPNext
+    `modified` starts over at 1. Returns invoice_id -> attempts.
+    """
+    by_id = {m["invoice_id"]: m.get("modified") for m in failed}
+    rows = get_sync_failures(db, list(by_id))
+    out: dict[str, int] = {}
+    for inv_id, modified in by_id.items():
+        row = rows.get(inv_id)
+        if row is None:
+            row = SyncFailure(invoice_id=inv_id, attempts=0)
+            db.add(row)
+        if row.modified != modified:
+            row.modified, row.attempts = modified, 0
+        row.attempts += 1
+        out[inv_id] = row.attempts
+    db.flush()
+    return out
+
+
+def list_dead_letters(db: Session, min_attempts: int, limit: int = 100) -> list[str]:
+    """
+    Invoices given up by the cursor (attempts >= min_attempts), least recently tried first.
+    """
+    rows = (
+        db.query(SyncFailure.invoice_id)
+        .filter(SyncFailure.attempts >= min_attempts)
+        .order_by(SyncFailure.updated_at, SyncFailure.id)
+        .limit(limit)
+        .all()
+    )
+    return [r[0] for r in rows]
+
+
+def clear_sync_failures(db: Session, invoice_ids: list[str], commit: bool = True) -> None:
+    if invoice_ids:
+        db.query(SyncFailure).filter(SyncFailure.invoice_id.in_(invoice_ids)).delete(synchronize_session=False)
+    if commit:
+        db.commit()
+
+
+# ---------------------------
+# Async equivalents (DB_ASYNC_ENABLED)
+# ---------------------------
+
+async def get_state_async(db: AsyncSession, key: str) -> str | None:
+    res = await db.execute(select(SyncState.value).where(SyncState.key == key).limit(1))
+    return res.scalar_one_or_none()
@@ -0,0 +1,213 @@
+import asyncio
+import logging
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from db.session import SessionLocal
+from queries.invoices import list_invoices_by_pks
+from queries.risk import upsert_risk
+from services.ai_risk import AIRiskClient
+from services.executor import run_blocking
+from services.risk_engine import enrich_risk, input_fingerprint
+
+log = logging.getLogger("ai_enrichment")
+
+
+class AIEnrichmentQueue:
+    """
+    Background AI enrichment, off the sync critical path.
+    Sync / recalculation store the rule-based risk at once with ai_status="pending" and
+    enqueue the invoice pks after their commit; AI_ENRICH_CONCURRENCY workers call OpenAI
+    on the async client and patch the row (adjusted rate + "AI metadata" reason, "done").
+    - enqueue() is thread-safe (persist stage runs on the thread pool) and never blocks:
+      duplicates are coalesced, a full queue (AI_ENRICH_QUEUE_SIZE) drops the job
+    - a dropped / lost job leaves the row pending with a no-AI input fingerprint, so the
+      next stale recalculation rescores and enqueues it again
+    - a row rewritten while its AI call was in flight (result_digest changed) is not patched
+    """
+
+    def __init__(
+        self,
+        client: AIRiskClient | None = None,
+        session_factory: Callable[[], Session] = SessionLocal,
+    ) -> None:
+        self.client = client
+        self.session_factory = session_factory
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self._queued: set[int] = set()  # pks waiting or in flight (coalesces duplicates)
+        self.in_flight = 0
+        self.done = 0
+        self.skipped = 0
+        self.failed = 0
+        self.dropped = 0
+
+    async def start(self) -> None:
+        if self._workers:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=max(1, settings.AI_ENRICH_QUEUE_SIZE))
+        if self.client is None:
+            self.client = AIRiskClient()  # settings read now, not at import
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"ai-enrich-{i}")
+            for i in range(max(1, settings.AI_ENRICH_CONCURRENCY))
+        ]
+        log.info("AI enrichment queue started (%s workers)", len(self._workers))
+
+    async def stop(self) -> None:
+        workers, self._workers = self._workers, []
+        for task in workers:
+            task.cancel()
+        if workers:
+            await asyncio.wait(workers)
+        if self.client is not None:
+            await self.client.aclose()
+        self._loop = None
+        self._queued.clear()
+
+    def enqueue(self, invoice_pks: list[int]) -> None:
+        """
+        Queue invoices for enrichment; safe from any thread.
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            log.warning("AI enrichment queue not running: %s invoices left pending", len(invoice_pks))
+            return
+        loop.call_soon_threadsafe(self._put, list(invoice_pks))
+
+    async def join(self) -> None:
+        """
+        Wait until every queued job is finished (tests / graceful drain).
+        """
+        if self._queue is not None:
+            await self._queue.join()
+
+    def status(self) -> dict:
+        return {
+            "running": bool(self._workers),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "in_flight": self.in_flight,
+            "done": self.done,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+    def _put(self, invoice_pks: list[int]) -> None:
+        if self._queue is None:
+            return
+        dropped = 0
+        for pk in invoice_pks:
+            if pk in self._queued:
+                continue
+            try:
+                self._queue.put_nowait(pk)
+            except asyncio.QueueFull:
+                dropped += 1
+                continue
+            self._queued.add(pk)
+        if dropped:
+            self.dropped += dropped
+            log.warning("AI enrichment queue full: %s invoices left pending", dropped)
+
+    async def _worker(self) -> None:
+        assert self._queue is not None
+        while True:
+            pk = await self._queue.get()
+            self.in_flight += 1
+            try:
+                if await self._enrich(pk):
+                    self.done += 1
+                else:
+                    self.skipped += 1
+            except Exception as e:
+                self.failed += 1
+                log.exception("AI enrichment failed for invoice pk=%s: %s", pk, e)
+            finally:
+                self.in_flight -= 1
+                self._queued.discard(pk)
+                self._queue.task_done()
+
+    async def _enrich(self, invoice_pk: int) -> bool:
+        job = await run_blocking(self._load, invoice_pk)
+        if job is None:
+            return False
+
+        ai = await self.client.analyze_invoice_async(
+            invoice=job["invoice"],
+            items=job["items"],
+            base_rate=float(job["base"]["rate"]),
+            base_level=str(job["base"]["risk_level"]),
+        )
+        return await run_blocking(self._save, invoice_pk, job, enrich_risk(job["base"], ai))
+
+    def _load(self, invoice_pk: int) -> dict | None:
+        """
+        Pending risk row + the invoice data the model needs; None = nothing to enrich.
+        """
+        with self.session_factory() as db:
+            invoices = list_invoices_by_pks(db, [invoice_pk])
+            if not invoices or invoices[0].risk is None or invoices[0].risk.ai_status != "pending":
+                return None
+            inv, row = invoices[0], invoices[0].risk
+            return {
+                "invoice": {"grand_total": inv.grand_total},
+                "items": [
+                    {
+                        "qty": it.qty,
+                        "rate": it.rate,
+                        "amount": it.amount,
+                        "item_code": it.item_code,
+                        "item_name": it.item_name,
+                        "idx": it.idx,
+                    }
+                    for it in (inv.items or [])
+                ],
+                "base": {
+                    "rate": row.rate,
+                    "risk_level": row.risk_level,
+                    "reasons": list(row.reasons or []),
+                    "rules_version": row.rules_version,
+                },
+                "items_hash": inv.items_hash,
+                "grand_total": inv.grand_total,
+                "result_digest": row.result_digest,
+            }
+
+    def _save(self, invoice_pk: int, job: dict, risk: dict) -> bool:
+        """
+        Patch the row unless it changed since _load (a newer sync / recalc owns it now).
+        """
+        with self.session_factory() as db:
+            invoices = list_invoices_by_pks(db, [invoice_pk])
+            row = invoices[0].risk if invoices else None
+            if row is None or row.result_digest != job["result_digest"]:
+                return False
+            written = upsert_risk(
+                db,
+                invoice_pk=invoice_pk,
+                rate=float(risk["rate"]),
+                risk_level=str(risk["risk_level"]),
+                reasons=risk["reasons"],
+                rules_version=risk.get("rules_version"),
+                input_fingerprint=input_fingerprint(job["items_hash"], job["grand_total"], risk.get("rules_version")),
+                ai_status=risk["ai_status"],
+            )
+            return written
+
+
+_queue: AIEnrichmentQueue | None = None
+
+
+def get_enrichment_queue() -> AIEnrichmentQueue:
+    """
+    Process-wide enrichment queue (started / stopped with the app or the sync worker).
+    """
+    global _queue
+    if _queue is None:
+        _queue = AIEnrichmentQueue()
+    return _queue
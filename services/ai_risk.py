@@ -1,5 +1,5 @@
 from typing import Any, Dict, List
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
 from core.config import settings
 
@@ -18,10 +18,12 @@ class AIRiskClient:
         if not settings.AI_ENABLED or settings.AI_PROVIDER != "openai":
             self.enabled = False
             self.client = None
+            self._async_client = None
             return
 
         self.enabled = True
-        self.client = OpenAI(api_key=settings.OPENAI_API_KEY)
+        self.client = OpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL)
+        self._async_client: AsyncOpenAI | None = None  # created on first async call (needs a running loop)
         self.model = settings.OPENAI_MODEL
 
     def analyze_invoice(
@@ -36,62 +38,105 @@ class AIRiskClient:
         Returns a SAFE, bounded AI response.
         If AI fails → returns neutral enrichment.
         """
-
-        # Hard fallback (QA-safe)
-        fallback = {
-            "risk_adjustment": 0.0,
-            "extra_reasons": [],
-            "supplier_signal": "UNKNOWN",
-        }
-
         if not self.enabled:
-            return fallback
+            return self._fallback()
 
         try:
-            prompt = self._build_prompt(
-                invoice=invoice,
-                items=items,
-                base_rate=base_rate,
-                base_level=base_level,
-            )
-
             resp = self.client.chat.completions.create(
-                model=self.model,
-                temperature=0.1,  # low = stable for QA
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            "You are a financial risk analysis engine. "
-                            "You MUST respond with VALID JSON ONLY. "
-                            "No explanations, no markdown, no text outside JSON."
-                        ),
-                    },
-                    {"role": "user", "content": prompt},
-                ],
-                timeout=15,
+                **self._request(invoice=invoice, items=items, base_rate=base_rate, base_level=base_level)
             )
+            return self._validate(resp.choices[0].message.content)
 
-            raw = resp.choices[0].message.content
-            data = self._safe_parse_json(raw)
+        except Exception:
+            # NEVER break sync / API because of AI
+            return self._fallback()
 
-            # Validate & clamp
-            return {
-                "risk_adjustment": self._clamp(
-                    float(data.get("risk_adjustment", 0.0)), -0.2, 0.2
-                ),
-                "extra_reasons": list(data.get("extra_reasons", []))[:5],
-                "supplier_signal": str(data.get("supplier_signal", "UNKNOWN")),
-            }
+    async def analyze_invoice_async(
+        self,
+        *,
+        invoice: Dict[str, Any],
+        items: List[Dict[str, Any]],
+        base_rate: float,
+        base_level: str,
+    ) -> Dict[str, Any]:
+        """
+        Same as analyze_invoice, on the async client (background enrichment worker).
+        """
+        if not self.enabled:
+            return self._fallback()
+
+        try:
+            if self._async_client is None:
+                self._async_client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL)
+            resp = await self._async_client.chat.completions.create(
+                **self._request(invoice=invoice, items=items, base_rate=base_rate, base_level=base_level)
+            )
+            return self._validate(resp.choices[0].message.content)
 
         except Exception:
             # NEVER break sync / API because of AI
-            return fallback
+            return self._fallback()
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
 
     # -------------------------
     # Helpers
     # -------------------------
 
+    def _fallback(self) -> Dict[str, Any]:
+        # Hard fallback (QA-safe)
+        return {
+            "risk_adjustment": 0.0,
+            "extra_reasons": [],
+            "supplier_signal": "UNKNOWN",
+        }
+
+    def _request(
+        self,
+        *,
+        invoice: Dict[str, Any],
+        items: List[Dict[str, Any]],
+        base_rate: float,
+        base_level: str,
+    ) -> Dict[str, Any]:
+        prompt = self._build_prompt(
+            invoice=invoice,
+            items=items,
+            base_rate=base_rate,
+            base_level=base_level,
+        )
+        return {
+            "model": self.model,
+            "temperature": 0.1,  # low = stable for QA
+            "messages": [
+                {
+                    "role": "system",
+                    "content": (
+                        "You are a financial risk analysis engine. "
+                        "You MUST respond with VALID JSON ONLY. "
+                        "No explanations, no markdown, no text outside JSON."
+                    ),
+                },
+                {"role": "user", "content": prompt},
+            ],
+            "timeout": settings.AI_TIMEOUT_SECONDS,
+        }
+
+    def _validate(self, raw: str) -> Dict[str, Any]:
+        data = self._safe_parse_json(raw)
+
+        # Validate & clamp
+        return {
+            "risk_adjustment": self._clamp(
+                float(data.get("risk_adjustment", 0.0)), -0.2, 0.2
+            ),
+            "extra_reasons": list(data.get("extra_reasons", []))[:5],
+            "supplier_signal": str(data.get("supplier_signal", "UNKNOWN")),
+        }
+
     def _build_prompt(
         self,
         *,
@@ -1,5 +1,114 @@
+import asyncio
+import json
+import logging
+
 import httpx
 from core.config import settings
+from services.resilience import CircuitBreaker, TokenBucket, backoff_delay
+
+log = logging.getLogger("erp_client")
+
+CANCELLED_DOCSTATUS = 2
+
+
+def is_cancelled(row: dict) -> bool:
+    """
+    ERPNext docstatus 2 = cancelled. One rule everywhere: excluded from the reconcile digest,
+    never stored by the sync (delta, backfill, webhook), removed when seen.
+    """
+    return str(row.get("docstatus")) == str(CANCELLED_DOCSTATUS)
+
+
+# ---------------------------
+# Shared pooled HTTP client (one per process)
+# ---------------------------
+_http_client: httpx.AsyncClient | None = None
+_http_client_loop: asyncio.AbstractEventLoop | None = None
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=settings.ERPNEXT_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.ERPNEXT_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.ERPNEXT_KEEPALIVE_EXPIRY_SECONDS,
+    )
+    timeout = httpx.Timeout(settings.ERPNEXT_TIMEOUT_SECONDS)
+
+    if settings.ERPNEXT_HTTP2:
+        try:
+            return httpx.AsyncClient(timeout=timeout, limits=limits, http2=True)
+        except ImportError:
+            # HTTP/2 is optional: fall back to HTTP/1.1 keep-alive
+            log.warning("ERPNEXT_HTTP2=true but 'h2' is not installed -> using HTTP/1.1")
+
+    return httpx.AsyncClient(timeout=timeout, limits=limits)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Return the process-wide pooled client (created lazily).
+    Connections are reused across cycles, so detail fetches skip TCP/TLS setup.
+    A pool is bound to the event loop it was created in, so a new loop gets a new pool.
+    """
+    global _http_client, _http_client_loop
+    loop = asyncio.get_running_loop()
+    if _http_client is None or _http_client.is_closed or _http_client_loop is not loop:
+        _http_client = _build_http_client()
+        _http_client_loop = loop
+    return _http_client
+
+
+async def close_http_client() -> None:
+    """
+    Close the shared client (safe to call more than once).
+    """
+    global _http_client, _http_client_loop
+    client, loop = _http_client, _http_client_loop
+    _http_client, _http_client_loop = None, None
+    if client is None or client.is_closed:
+        return
+    if loop is asyncio.get_running_loop():
+        await client.aclose()
+
+
+# ---------------------------
+# Per-host request budget + circuit breaker (shared by every ERPClient in the process)
+# ---------------------------
+class _HostGuard:
+    def __init__(self, host: str) -> None:
+        self.bucket = TokenBucket(settings.ERPNEXT_RATE_LIMIT_PER_SECOND, settings.ERPNEXT_RATE_LIMIT_BURST)
+        self.breaker = CircuitBreaker(
+            f"ERPNext {host}",
+            settings.ERPNEXT_BREAKER_FAILURE_THRESHOLD,
+            settings.ERPNEXT_BREAKER_RESET_SECONDS,
+        )
+
+
+_guards: dict[str, _HostGuard] = {}
+
+
+def get_guard(base_url: str) -> _HostGuard:
+    host = httpx.URL(base_url).host or base_url
+    if host not in _guards:
+        _guards[host] = _HostGuard(host)
+    return _guards[host]
+
+
+def erp_health() -> dict:
+    """
+    Breaker state + remaining request budget per ERPNext host (for /sync/status).
+    """
+    return {
+        host: {**g.breaker.status(), "tokens_available": round(g.bucket.available(), 2)}
+        for host, g in _guards.items()
+    }
+
+
+def _retry_after(r: httpx.Response) -> float | None:
+    try:
+        return float(r.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
 
 
 class ERPClient:
@@ -10,25 +119,170 @@ class ERPClient:
             "Accept": "application/json",
         }
 
-    async def list_purchase_invoices(self, limit: int = 500) -> list[dict]:
+    async def _get(self, url: str, params: dict | None = None) -> httpx.Response:
+        """
+        GET through the host guard:
+        - open circuit => CircuitOpenError right away (no request, no timeout wait)
+        - every attempt spends one token of the host's request budget
+        - 429 / 5xx / network errors are retried with jittered backoff (Retry-After honoured);
+          when retries run out the breaker counts one failure
+        - other 4xx are raised as-is and say nothing about ERPNext health
+        """
+        guard = get_guard(self.base)
+        guard.breaker.before_call()
+
+        attempts = max(0, settings.ERPNEXT_MAX_RETRIES) + 1
+        try:
+            for attempt in range(attempts):
+                await guard.bucket.acquire()
+                retry_after = None
+                try:
+                    r = await get_http_client().get(url, headers=self.headers, params=params)
+                    if r.status_code == 429 or r.status_code >= 500:
+                        retry_after = _retry_after(r)
+                        r.raise_for_status()
+                except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                    if attempt + 1 >= attempts:
+                        guard.breaker.record_failure()
+                        raise
+                    delay = backoff_delay(
+                        attempt,
+                        settings.ERPNEXT_RETRY_BACKOFF_SECONDS,
+                        settings.ERPNEXT_RETRY_BACKOFF_MAX_SECONDS,
+                        retry_after,
+                    )
+                    log.warning("ERPNext request failed (%s), retry %s/%s in %.2fs", e, attempt + 1, attempts - 1, delay)
+                    await asyncio.sleep(delay)
+                    continue
+
+                r.raise_for_status()  # other 4xx: no verdict on ERPNext health (trial cancelled below)
+                guard.breaker.record_success()
+                return r
+        except BaseException:
+            guard.breaker.cancel_trial()  # no-op unless a half-open trial ended without a verdict
+            raise
+
+    async def list_purchase_invoices(
+        self,
+        limit: int = 500,
+        modified_after: str | None = None,
+        name_after: str | None = None,
+    ) -> list[dict]:
         """
-        Minimal fields + modified for delta decisions.
+        Minimal fields + modified + docstatus for delta decisions (cancelled invoices are
+        listed too: cancelling bumps `modified`, and the sync removes their local copy).
         Works with ERPNext REST: /api/resource/Purchase Invoice
+        Keyset page, oldest first: (modified, name) > (modified_after, name_after),
+        ordered by modified asc, name asc. Idle cycles return [], and invoices sharing
+        one `modified` (bulk submit) are split across pages without skips or re-reads.
         """
         url = f"{self.base}/api/resource/Purchase%20Invoice"
         params = {
-            "fields": '["name","supplier","posting_date","grand_total","modified"]',
+            "fields": '["name","supplier","posting_date","grand_total","modified","docstatus"]',
             "limit_page_length": str(limit),
-            "order_by": "modified desc",
+            "order_by": "modified asc, name asc",
         }
-        async with httpx.AsyncClient(timeout=20.0) as client:
-            r = await client.get(url, headers=self.headers, params=params)
-            r.raise_for_status()
-            return (r.json().get("data") or [])
+        params.update(_after_filters(modified_after, name_after))
+        r = await self._get(url, params)
+        return (r.json().get("data") or [])
+
+    async def list_purchase_invoices_by_name(self, names: list[str]) -> list[dict]:
+        """
+        List rows (delta list fields + docstatus) for specific invoices (webhook path, reconcile check).
+        """
+        url = f"{self.base}/api/resource/Purchase%20Invoice"
+        params = {
+            "fields": '["name","supplier","posting_date","grand_total","modified","docstatus"]',
+            "filters": json.dumps([["name", "in", list(names)]]),
+            "limit_page_length": str(len(names)),
+        }
+        r = await self._get(url, params)
+        return (r.json().get("data") or [])
+
+    async def count_purchase_invoices(self, modified_after: str | None = None, name_after: str | None = None) -> int:
+        """
+        Count invoices after a (modified, name) cursor (used for backfill progress).
+        frappe.client.get_count has no or_filters => strictly-newer + same-modified tail.
+        """
+        count = await self._count([["modified", ">", modified_after]] if modified_after else None)
+        if modified_after and name_after is not None:
+            count += await self._count([["modified", "=", modified_after], ["name", ">", name_after]])
+        return count
+
+    async def _count(self, filters: list | None) -> int:
+        url = f"{self.base}/api/method/frappe.client.get_count"
+        params = {"doctype": "Purchase Invoice"}
+        if filters:
+            params["filters"] = json.dumps(filters)
+        r = await self._get(url, params)
+        return int(r.json().get("message") or 0)
+
+    async def count_purchase_invoices_in_month(self, month: str) -> int:
+        """
+        Remote reconciliation digest for one posting month ("YYYY-MM", "" = no posting date).
+        Cancelled invoices (docstatus 2) are not counted.
+        """
+        return await self._count(_month_filters(month))
+
+    async def list_purchase_invoice_names_in_month(self, month: str) -> list[str]:
+        """
+        Name-only listing of one posting month (drill-down of a mismatching bucket).
+        """
+        url = f"{self.base}/api/resource/Purchase%20Invoice"
+        params = {
+            "fields": '["name"]',
+            "filters": json.dumps(_month_filters(month)),
+            "limit_page_length": "0",
+        }
+        r = await self._get(url, params)
+        return [row["name"] for row in (r.json().get("data") or []) if row.get("name")]
+
+    async def list_purchase_invoice_items(self, parents: list[str]) -> dict[str, list[dict]]:
+        """
+        Items for many invoices in ONE request (child doctype "Purchase Invoice Item").
+        Only the fields used by canonical_items / InvoiceItem are requested.
+        Returns {invoice name: [item, ...]}; invoices without items map to [].
+        """
+        url = f"{self.base}/api/resource/Purchase%20Invoice%20Item"
+        params = {
+            "parent": "Purchase Invoice",  # required by Frappe for child doctypes
+            "fields": '["parent","idx","item_code","item_name","qty","rate","amount"]',
+            "filters": json.dumps([["parent", "in", list(parents)]]),
+            "order_by": "parent asc, idx asc",
+            "limit_page_length": "0",  # 0 => no limit (bounded by the parent list)
+        }
+        r = await self._get(url, params)
+
+        grouped: dict[str, list[dict]] = {name: [] for name in parents}
+        for it in (r.json().get("data") or []):
+            grouped.setdefault(it.get("parent"), []).append(it)
+        return grouped
 
     async def get_purchase_invoice(self, name: str) -> dict:
         url = f"{self.base}/api/resource/Purchase%20Invoice/{name}"
-        async with httpx.AsyncClient(timeout=20.0) as client:
-            r = await client.get(url, headers=self.headers)
-            r.raise_for_status()
-            return (r.json().get("data") or {})
+        r = await self._get(url)
+        return (r.json().get("data") or {})
+
+
+
+def _after_filters(modified_after: str | None, name_after: str | None) -> dict:
+    """
+    Strict tuple compare (modified, name) > (M, N) in Frappe filter syntax:
+    modified >= M AND (modified > M OR name > N). Without N => modified > M.
+    """
+    if not modified_after:
+        return {}
+    if name_after is None:
+        return {"filters": json.dumps([["modified", ">", modified_after]])}
+    return {
+        "filters": json.dumps([["modified", ">=", modified_after]]),
+        "or_filters": json.dumps([["modified", ">", modified_after], ["name", ">", name_after]]),
+    }
+
+
+def _month_filters(month: str) -> list:
+    if not month:
+        return [["posting_date", "is", "not set"], ["docstatus", "!=", CANCELLED_DOCSTATUS]]
+    year, mon = (int(x) for x in month.split("-"))
+    nxt = f"{year + 1}-01-01" if mon == 12 else f"{year}-{mon + 1:02d}-01"
+    return [["posting_date", ">=", f"{month}-01"], ["posting_date", "<", nxt], ["docstatus", "!=", CANCELLED_DOCSTATUS]]
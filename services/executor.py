@@ -0,0 +1,39 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from core.config import settings
+
+
+# ---------------------------
+# Dedicated thread pool for blocking sync stages (SQLAlchemy, rule engine, OpenAI SDK)
+# Keeps the event loop free => API latency stays flat while the scheduler runs.
+# ---------------------------
+_pool: ThreadPoolExecutor | None = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(
+            max_workers=max(1, settings.SYNC_THREADPOOL_SIZE),
+            thread_name_prefix="sync-blocking",
+        )
+    return _pool
+
+
+async def run_blocking(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    await fn(*args, **kwargs) on the sync thread pool.
+    A Session passed in must not be used concurrently: await each DB call before the next.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(fn, *args, **kwargs))
+
+
+def shutdown_executor() -> None:
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -22,3 +22,12 @@ def items_hash(items: list[dict]) -> str:
     payload = canonical_items(items)
     raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
     return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def risk_fingerprint(items_hash: str | None, grand_total: float | None, rules_version: str | None, ai_mode: str) -> str:
+    """
+    Everything a stored risk depends on: same fingerprint => rescoring gives the same row.
+    """
+    payload = [items_hash, float(grand_total or 0), rules_version, ai_mode]
+    raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
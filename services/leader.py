@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable
+
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+
+from db.session import SessionLocal
+from models.sync_state import SyncState
+
+log = logging.getLogger("leader")
+
+
+LEADER_LEASE_KEY = "scheduler_leader"
+
+
+def new_holder_id() -> str:
+    # host + pid identify the worker in logs; the suffix keeps restarts distinct
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class Lease:
+    """
+    DB-backed lease in `sync_state` (value = holder id, expires_at = unix time).
+    Acquire and renew are the same atomic UPDATE: it only matches when the row is free,
+    expired, or already ours, so at most one holder wins per expiry window.
+    Expiry uses each worker's clock: keep the lease well above expected clock skew.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float,
+        key: str = LEADER_LEASE_KEY,
+        holder_id: str | None = None,
+        session_factory: sessionmaker = SessionLocal,
+    ) -> None:
+        self.key = key
+        self.ttl_seconds = float(ttl_seconds)
+        self.holder_id = holder_id or new_holder_id()
+        self.session_factory = session_factory
+
+    def try_acquire(self) -> bool:
+        """
+        Take the lease if it is free/expired, or extend it if we hold it (heartbeat).
+        """
+        now = time.time()
+        db: Session = self.session_factory()
+        try:
+            _ensure_row(db, self.key)
+            res = db.execute(
+                update(SyncState)
+                .where(
+                    SyncState.key == self.key,
+                    or_(
+                        SyncState.value == self.holder_id,
+                        SyncState.value.is_(None),
+                        SyncState.expires_at.is_(None),
+                        SyncState.expires_at < now,
+                    ),
+                )
+                .values(value=self.holder_id, expires_at=now + self.ttl_seconds)
+            )
+            db.commit()
+            return res.rowcount == 1
+        finally:
+            db.close()
+
+    def release(self) -> None:
+        """
+        Give the lease up (graceful shutdown) so another worker takes over without waiting for expiry.
+        """
+        db: Session = self.session_factory()
+        try:
+            db.execute(
+                update(SyncState)
+                .where(SyncState.key == self.key, SyncState.value == self.holder_id)
+                .values(value=None, expires_at=None)
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def current_holder(self) -> str | None:
+        db: Session = self.session_factory()
+        try:
+            row = db.query(SyncState.value, SyncState.expires_at).filter(SyncState.key == self.key).first()
+        finally:
+            db.close()
+        if not row or row.value is None or (row.expires_at or 0) < time.time():
+            return None
+        return row.value
+
+
+@asynccontextmanager
+async def hold_lease(
+    lease: Lease,
+    on_lost: Callable[[], Awaitable[None]] | None = None,
+) -> AsyncIterator[bool]:
+    """
+    Hold `lease` for the duration of the block (manual sync run outside the scheduler).
+    Yields False (nothing held) when another worker has it. While held it is renewed every
+    third of its ttl; a failed renewal awaits on_lost() so the work stops writing.
+    Lease calls run on their own thread, not on the sync pool they would queue behind.
+    """
+    if not await asyncio.to_thread(lease.try_acquire):
+        yield False
+        return
+
+    async def renew() -> None:
+        while True:
+            await asyncio.sleep(max(0.1, lease.ttl_seconds / 3))
+            try:
+                held = await asyncio.to_thread(lease.try_acquire)
+            except Exception as e:
+                log.warning("lease renewal failed: %s", e)
+                held = False
+            if not held:
+                log.warning("lost lease %s while holding it for a manual run", lease.holder_id)
+                if on_lost is not None:
+                    await on_lost()
+                return
+
+    task = asyncio.create_task(renew())
+    try:
+        yield True
+    finally:
+        task.cancel()
+        await asyncio.wait([task])
+        try:
+            await asyncio.to_thread(lease.release)
+        except Exception as e:
+            log.warning("lease release failed: %s", e)
+
+
+def _ensure_row(db: Session, key: str) -> None:
+    if db.query(SyncState.id).filter(SyncState.key == key).first():
+        return
+    db.add(SyncState(key=key, value=None))
+    try:
+        db.commit()
+    except IntegrityError:
+        # another worker created it first
+        db.rollback()
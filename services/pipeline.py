@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Iterable
+
+log = logging.getLogger("pipeline")
+
+_DONE = object()  # end-of-stream marker, one per worker of the receiving stage
+
+
+class Stage:
+    """
+    One pipeline stage: `workers` tasks take batches (the next item + whatever else is
+    already queued, up to `batch_size`) from a bounded input queue and pass the handler's
+    outputs to the next stage. A full queue blocks the stage before it => backpressure.
+    handler(batch) -> outputs; an exception fails the whole batch (on_error(batch, exc)).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[list], Awaitable[list]],
+        *,
+        workers: int = 1,
+        batch_size: int = 1,
+        queue_size: int = 100,
+        on_error: Callable[[list, BaseException], None] | None = None,
+    ) -> None:
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.on_error = on_error
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+
+        self.processed = 0
+        self.emitted = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+        self._finished_workers = 0
+
+    async def put(self, item: Any) -> None:
+        await self.queue.put(item)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    def stats(self, elapsed: float) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "processed": self.processed,
+            "emitted": self.emitted,
+            "failed": self.failed,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "throughput_per_s": round(self.processed / elapsed, 1) if elapsed > 0 else None,
+            # busy share of the stage's worker time: the bottleneck stage is close to 1.0
+            "utilization": round(self.busy_seconds / (elapsed * self.workers), 3) if elapsed > 0 else None,
+        }
+
+
+class Pipeline:
+    """
+    Stages connected by bounded queues, all running concurrently.
+    run(items) returns once every item has left the last stage.
+    """
+
+    def __init__(self, stages: list[Stage]) -> None:
+        self.stages = stages
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+
+    async def run(self, items: Iterable[Any]) -> None:
+        self.started_at = time.perf_counter()
+        tasks = [
+            asyncio.create_task(self._worker(n))
+            for n, stage in enumerate(self.stages)
+            for _ in range(stage.workers)
+        ]
+        try:
+            first = self.stages[0]
+            for item in items:
+                await first.put(item)
+            for _ in range(first.workers):
+                await first.queue.put(_DONE)
+            await asyncio.gather(*tasks)
+        finally:
+            for t in tasks:
+                t.cancel()
+            self.finished_at = time.perf_counter()
+
+    def stats(self) -> dict:
+        if self.started_at is None:
+            return {}
+        elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+        return {
+            "running": self.finished_at is None,
+            "elapsed_seconds": round(elapsed, 3),
+            "stages": {s.name: s.stats(elapsed) for s in self.stages},
+        }
+
+    async def _worker(self, n: int) -> None:
+        stage = self.stages[n]
+        nxt = self.stages[n + 1] if n + 1 < len(self.stages) else None
+
+        done = False
+        while not done:
+            item = await stage.queue.get()
+            if item is _DONE:
+                break
+
+            batch = [item]
+            while len(batch) < stage.batch_size:
+                try:
+                    item = stage.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if item is _DONE:
+                    done = True
+                    break
+                batch.append(item)
+
+            started = time.perf_counter()
+            try:
+                outputs = await stage.handler(batch)
+            except Exception as e:
+                log.exception("stage %s failed for a batch of %s: %s", stage.name, len(batch), e)
+                stage.failed += len(batch)
+                outputs = []
+                if stage.on_error is not None:
+                    stage.on_error(batch, e)
+            finally:
+                stage.busy_seconds += time.perf_counter() - started
+
+            stage.processed += len(batch)
+            stage.emitted += len(outputs)
+            if nxt is not None:
+                for out in outputs:
+                    await nxt.put(out)
+
+        # last worker of this stage closes the next one
+        stage._finished_workers += 1
+        if nxt is not None and stage._finished_workers == stage.workers:
+            for _ in range(nxt.workers):
+                await nxt.queue.put(_DONE)
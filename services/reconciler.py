@@ -0,0 +1,98 @@
+import asyncio
+import logging
+
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from services.erp_client import is_cancelled
+from services.executor import run_blocking
+
+from queries.invoices import count_invoices_by_month, delete_invoices, list_invoice_ids_in_month
+
+log = logging.getLogger("reconciler")
+
+CONFIRM_BATCH_SIZE = 100  # names per confirmation request (keeps the URL short)
+
+
+async def reconcile(erp, db: Session, *, delete: bool = True) -> dict:
+    """
+    Find invoices that exist locally but were deleted / cancelled in ERPNext.
+    - digest per posting month: local GROUP BY count vs. remote get_count (not cancelled; the
+      sync never stores cancelled invoices either, see erp_client.is_cancelled)
+    - only months whose counts differ are drilled into (name-only list)
+    - candidates are confirmed by name before removal, so an invoice whose posting date
+      moved to another month (not synced yet) is never removed
+    Equal counts can hide "one deleted + one new"; once the new one is synced the month
+    differs and the next pass catches the orphan.
+    """
+    local_counts = await run_blocking(count_invoices_by_month, db)
+    months = sorted(local_counts)
+
+    sem = asyncio.Semaphore(max(1, settings.SYNC_FETCH_CONCURRENCY))
+
+    async def remote_count(month: str) -> int:
+        async with sem:
+            return await erp.count_purchase_invoices_in_month(month)
+
+    remote = await asyncio.gather(*(remote_count(m) for m in months), return_exceptions=True)
+
+    mismatched: list[str] = []
+    failed_buckets: list[str] = []
+    for month, count in zip(months, remote):
+        if isinstance(count, BaseException):
+            log.warning("remote count failed for bucket %r: %s", month, count)
+            failed_buckets.append(month)
+        elif count != local_counts[month]:
+            mismatched.append(month)
+
+    candidates: list[str] = []
+    for month in mismatched:
+        # local first, remote second => an invoice created in between is never a candidate
+        local_ids = await run_blocking(list_invoice_ids_in_month, db, month)
+        try:
+            async with sem:
+                remote_names = set(await erp.list_purchase_invoice_names_in_month(month))
+        except Exception as e:
+            log.warning("drill-down failed for bucket %r: %s", month, e)
+            failed_buckets.append(month)
+            continue
+        candidates.extend(sorted(set(local_ids) - remote_names))
+
+    orphans, unconfirmed = await _confirm_orphans(erp, candidates)
+
+    removed = 0
+    if orphans and delete:
+        removed = await run_blocking(delete_invoices, db, orphans)
+    if orphans:
+        log.info("reconcile: %s orphan invoice(s) %s (removed=%s)", len(orphans), orphans[:20], removed)
+
+    return {
+        "status": "ok" if not failed_buckets and not unconfirmed else "partial",
+        "buckets": len(months),
+        "mismatched_buckets": mismatched,
+        "failed_buckets": failed_buckets,
+        "orphans": orphans,
+        "unconfirmed": unconfirmed,
+        "removed": removed,
+    }
+
+
+async def _confirm_orphans(erp, candidates: list[str]) -> tuple[list[str], list[str]]:
+    """
+    Keep only names that ERPNext no longer has, or has as cancelled.
+    A batch whose check fails is logged and left alone (returned as unconfirmed); the
+    other batches still count, and the next pass retries it.
+    """
+    orphans: list[str] = []
+    unconfirmed: list[str] = []
+    for start in range(0, len(candidates), CONFIRM_BATCH_SIZE):
+        chunk = candidates[start:start + CONFIRM_BATCH_SIZE]
+        try:
+            rows = await erp.list_purchase_invoices_by_name(chunk)
+        except Exception as e:
+            log.warning("orphan check failed for %s candidate(s) %s: %s", len(chunk), chunk[:5], e)
+            unconfirmed.extend(chunk)
+            continue
+        alive = {r.get("name") for r in rows if not is_cancelled(r)}
+        orphans.extend(n for n in chunk if n not in alive)
+    return orphans, unconfirmed
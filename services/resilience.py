@@ -0,0 +1,119 @@
+import asyncio
+import random
+import time
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a dependency whose circuit breaker is open.
+    """
+
+    def __init__(self, name: str, retry_in: float) -> None:
+        super().__init__(f"{name} unavailable (circuit open, retry in {retry_in:.1f}s)")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class TokenBucket:
+    """
+    Request budget: `rate` tokens/second, up to `burst` saved up.
+    acquire() waits for a token. Single event-loop use only (no lock needed: there is
+    no await between reading and taking tokens). rate <= 0 => unlimited.
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = float(rate)
+        self.capacity = float(max(1, burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def available(self) -> float:
+        if self.rate <= 0:
+            return float("inf")
+        self._refill()
+        return self.tokens
+
+
+class CircuitBreaker:
+    """
+    closed -> (failure_threshold consecutive failures) -> open
+    open -> (reset_seconds later) -> half_open: one trial call goes through
+    half_open -> success => closed / failure => open again
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float) -> None:
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = float(reset_seconds)
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial_in_flight = False
+
+    def before_call(self) -> None:
+        """
+        Raise CircuitOpenError when calls must not go out right now.
+        """
+        if self.state == "closed":
+            return
+        retry_in = self.retry_in()
+        if self.state == "open" and retry_in <= 0:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return
+        raise CircuitOpenError(self.name, max(retry_in, 0.0))
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def cancel_trial(self) -> None:
+        # half-open trial ended without a verdict (cancelled): let the next call try
+        self._trial_in_flight = False
+
+    def retry_in(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return self.opened_at + self.reset_seconds - time.monotonic()
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_in_seconds": round(max(0.0, self.retry_in()), 3) if self.state != "closed" else None,
+        }
+
+
+def backoff_delay(attempt: int, base: float, ceiling: float, retry_after: float | None = None) -> float:
+    """
+    Full-jitter exponential backoff; a server Retry-After (capped at `ceiling`) is a floor.
+    """
+    delay = random.uniform(0, min(ceiling, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(ceiling, retry_after))
+    return delay
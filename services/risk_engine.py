@@ -1,7 +1,9 @@
-from typing import Any, List
+from typing import Any, List, Sequence
 
 from core.config import settings
 from services.ai_risk import AIRiskClient
+from services.hasher import risk_fingerprint
+from services.risk_rules import get_rules
 
 
 _ai = AIRiskClient()
@@ -12,83 +14,62 @@ def clamp01(x: float) -> float:
 
 
 def _level_from_rate(rate: float) -> str:
-    if rate >= 0.9:
-        return "CRITICAL"
-    elif rate >= 0.7:
-        return "HIGH"
-    elif rate >= 0.4:
-        return "MEDIUM"
-    else:
-        return "LOW"
+    return get_rules().level(rate)
 
 
 def _compute_rule_based(invoice: dict, items: list[dict]) -> dict:
     """
     Baseline deterministic risk engine (QA-friendly).
-    Uses Quantity + Unit Price + Invoice Total heuristics.
-
-    NEW: Added MEDIUM rules so the system has a realistic ladder:
+    Uses Quantity + Unit Price + Invoice Total heuristics, defined as data in the
+    versioned rule table (core/risk_rules.json, see services/risk_rules.py):
       LOW -> MEDIUM -> HIGH -> CRITICAL
     """
-    reasons: list[dict] = []
-    rate = 0.0
-
-    for it in items:
-        qty = float(it.get("qty") or 0)
-        unit_price = float(it.get("rate") or 0)
-
-        # -------------------------
-        # CRITICAL / HIGH (existing)
-        # -------------------------
-        if qty >= 30 and unit_price >= 10000:
-            rate = max(rate, 1.0)
-            reasons.append(
-                {"reason": "Extreme quantity & unit price", "details": {"qty": qty, "unit_price": unit_price}}
-            )
-        elif qty >= 10 and unit_price >= 3000:
-            rate = max(rate, 0.9)
-            reasons.append(
-                {"reason": "High quantity and high unit price", "details": {"qty": qty, "unit_price": unit_price}}
-            )
-        elif unit_price >= 10000:
-            rate = max(rate, 0.8)
-            reasons.append({"reason": "Very high unit price", "details": {"unit_price": unit_price}})
-        elif qty >= 25:
-            rate = max(rate, 0.7)
-            reasons.append({"reason": "Very high quantity", "details": {"qty": qty}})
-
-        # -------------------------
-        # MEDIUM (NEW)
-        # -------------------------
-        # Medium if unit price is high-ish but not extreme
-        if unit_price >= 7000 and unit_price < 10000:
-            rate = max(rate, 0.5)
-            reasons.append({"reason": "Elevated unit price", "details": {"unit_price": unit_price}})
-
-        # Medium if quantity is notable but not very high
-        if qty >= 15 and qty < 25:
-            rate = max(rate, 0.45)
-            reasons.append({"reason": "Notable quantity", "details": {"qty": qty}})
-
-    # -------------------------
-    # Invoice total heuristics
-    # -------------------------
-    total = float(invoice.get("grand_total") or 0)
-
-    # MEDIUM (NEW): notable invoice total
-    if 80000 <= total < 200000:
-        rate = max(rate, 0.55)
-        reasons.append({"reason": "Notable invoice total", "details": {"grand_total": total}})
-
-    # HIGH (existing): very high invoice total
-    if total >= 200000:
-        rate = max(rate, 0.85)
-        reasons.append({"reason": "Very high invoice total", "details": {"grand_total": total}})
-
-    rate = clamp01(rate)
-    level = _level_from_rate(rate)
-
-    return {"rate": float(rate), "risk_level": str(level), "reasons": reasons}
+    return get_rules().evaluate(invoice, items)
+
+
+def compute_risk_batch(
+    qty: Sequence[float],
+    rate: Sequence[float],
+    offsets: Sequence[int],
+    grand_total: Sequence[float],
+) -> list[dict]:
+    """
+    Vectorized _compute_rule_based for many invoices at once (recalculation after a rule change).
+    Columnar input: items of invoice i are qty/rate[offsets[i]:offsets[i + 1]]
+    (len(offsets) == len(grand_total) + 1); None must already be 0.
+    Output is identical to _compute_rule_based, invoice by invoice.
+    """
+    return get_rules().evaluate_batch(qty, rate, offsets, grand_total)
+
+
+def ai_mode() -> str:
+    """
+    AI part of the risk inputs: "off" or "<provider>:<model>".
+    """
+    if not settings.AI_ENABLED or settings.AI_PROVIDER != "openai":
+        return "off"
+    return f"{settings.AI_PROVIDER}:{settings.OPENAI_MODEL}"
+
+
+def input_fingerprint(
+    items_hash: str | None,
+    grand_total: float | None,
+    rules_version: str | None = None,
+    ai: str | None = None,
+) -> str:
+    """
+    Fingerprint of a risk row's inputs under the active rules / AI mode (see RiskAnalysis.input_fingerprint).
+    """
+    return risk_fingerprint(items_hash, grand_total, rules_version or get_rules().version, ai or ai_mode())
+
+
+def result_fingerprint(items_hash: str | None, grand_total: float | None, risk: dict) -> str:
+    """
+    Fingerprint to store with a compute_risk result. A row still waiting for its AI
+    enrichment counts as scored without AI => a lost job shows up as stale on the next recalc.
+    """
+    ai = "off" if risk.get("ai_status") == "pending" else None
+    return input_fingerprint(items_hash, grand_total, risk.get("rules_version"), ai=ai)
 
 
 def compute_risk(invoice: dict, items: list[dict]) -> dict:
@@ -97,13 +78,18 @@ def compute_risk(invoice: dict, items: list[dict]) -> dict:
     1) Rule-based deterministic score (source of truth)
     2) Optional OpenAI enrichment (small adjustment + extra reasons)
        + stores one "AI metadata" object into reasons for audit/debug
+    AI_ASYNC_ENRICHMENT => step 2 is left to the background worker (services/ai_enrichment.py):
+    the rule-based result comes back at once with ai_status="pending".
     """
     base = _compute_rule_based(invoice, items)
 
     # AI is optional - keep deterministic behavior when disabled
-    if not settings.AI_ENABLED or settings.AI_PROVIDER != "openai":
+    if ai_mode() == "off":
         return base
 
+    if settings.AI_ASYNC_ENRICHMENT:
+        return {**base, "ai_status": "pending"}
+
     # AI enrichment (safe fallback handled inside AIRiskClient)
     ai = _ai.analyze_invoice(
         invoice=invoice,
@@ -111,7 +97,13 @@ def compute_risk(invoice: dict, items: list[dict]) -> dict:
         base_rate=float(base["rate"]),
         base_level=str(base["risk_level"]),
     )
+    return enrich_risk(base, ai)
+
 
+def enrich_risk(base: dict, ai: dict) -> dict:
+    """
+    Rule-based result + AI response (AIRiskClient) => final risk with ai_status="done".
+    """
     adjustment = float(ai.get("risk_adjustment", 0.0))
     supplier_signal = str(ai.get("supplier_signal", "UNKNOWN"))
     extra_reasons = ai.get("extra_reasons", []) or []
@@ -150,4 +142,6 @@ def compute_risk(invoice: dict, items: list[dict]) -> dict:
         "rate": float(final_rate),
         "risk_level": str(final_level),
         "reasons": merged_reasons,
+        "rules_version": base["rules_version"],
+        "ai_status": "done",
     }
@@ -0,0 +1,124 @@
+import logging
+
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from queries.invoices import list_invoices_by_pks, list_risk_inputs
+from queries.risk import bulk_upsert_risk, list_risk_fingerprints, upsert_risk
+from services.ai_enrichment import get_enrichment_queue
+from services.risk_engine import ai_mode, compute_risk, compute_risk_batch, input_fingerprint, result_fingerprint
+from services.risk_rules import refresh_rules
+
+log = logging.getLogger("risk_recalc")
+
+
+def recalculate_risk(db: Session, *, limit: int | None, force: bool = False) -> dict:
+    """
+    Rescore the newest `limit` invoices (None => all) whose risk inputs changed:
+    the stored input_fingerprint differs from the one of the invoice's current
+    items_hash / grand_total under the active rules version and AI mode (no risk row
+    counts as changed). force=True rescores every checked invoice.
+    The scan reads narrow keyset pages (RISK_RECALC_PAGE_SIZE); only stale invoices are
+    loaded and rescored, one transaction per page; a rescored row identical to the stored
+    one is not written (see upsert_risk).
+    Returns {"checked", "recalculated", "written"}.
+    """
+    version = refresh_rules(db).version  # published rules (another process may have reloaded), fixed for the pass
+    page_size = max(1, settings.RISK_RECALC_PAGE_SIZE)
+
+    checked = recalculated = written = 0
+    before_pk = None
+    while limit is None or checked < limit:
+        n = page_size if limit is None else min(page_size, limit - checked)
+        rows = list_risk_fingerprints(db, before_pk=before_pk, limit=n)
+        if not rows:
+            break
+        checked += len(rows)
+        before_pk = rows[-1].id
+
+        stale = [
+            r.id for r in rows
+            if force or r.input_fingerprint != input_fingerprint(r.items_hash, r.grand_total, version)
+        ]
+        if stale:
+            evaluated, n_written = _rescore(db, stale)
+            recalculated += evaluated
+            written += n_written
+        if len(rows) < n:
+            break
+
+    log.info(
+        "risk recalculation (rules %s, ai %s): %s checked, %s rescored, %s written",
+        version, ai_mode(), checked, recalculated, written,
+    )
+    return {"checked": checked, "recalculated": recalculated, "written": written}
+
+
+def recalculate_stale(db: Session) -> dict:
+    """
+    Rescore every invoice whose risk inputs changed (after a rules reload / AI switch).
+    """
+    return recalculate_risk(db, limit=None)
+
+
+def _rescore(db: Session, invoice_pks: list[int]) -> tuple[int, int]:
+    """
+    Score the given invoices from DB data; commit only if a row changed.
+    Returns (evaluated, written).
+    Rule-only (AI disabled, or AI left to the background queue with AI_ASYNC_ENRICHMENT):
+    columnar load + vectorized compute_risk_batch, one bulk write; AI rows are stored
+    "pending" and handed to the enrichment queue after the commit.
+    Inline AI: per invoice, since the model needs the full item dicts.
+    """
+    ai_on = ai_mode() != "off"
+    if not ai_on or settings.AI_ASYNC_ENRICHMENT:
+        cols = list_risk_inputs(db, invoice_pks)
+        risks = compute_risk_batch(cols["qty"], cols["rate"], cols["offsets"], cols["grand_total"])
+        if ai_on:
+            risks = [{**risk, "ai_status": "pending"} for risk in risks]
+        written = bulk_upsert_risk(db, [
+            {
+                "invoice_pk": pk,
+                **risk,
+                "input_fingerprint": result_fingerprint(h, total, risk),
+            }
+            for pk, h, total, risk in zip(cols["invoice_pks"], cols["items_hash"], cols["grand_total"], risks)
+        ])
+        if written:
+            db.commit()
+        if ai_on:
+            get_enrichment_queue().enqueue(cols["invoice_pks"])
+        return len(risks), written
+
+    written = 0
+    invoices = list_invoices_by_pks(db, invoice_pks)
+    for inv in invoices:
+        risk = compute_risk(
+            {"grand_total": inv.grand_total},
+            [
+                {
+                    "qty": it.qty,
+                    "rate": it.rate,
+                    "amount": it.amount,
+                    "item_code": it.item_code,
+                    "item_name": it.item_name,
+                    "idx": it.idx,
+                }
+                for it in (inv.items or [])
+            ],
+        )
+
+        written += upsert_risk(
+            db,
+            invoice_pk=inv.id,
+            rate=float(risk["rate"]),
+            risk_level=str(risk["risk_level"]),
+            reasons=risk["reasons"],
+            rules_version=risk.get("rules_version"),
+            input_fingerprint=result_fingerprint(inv.items_hash, inv.grand_total, risk),
+            ai_status=risk.get("ai_status"),
+            commit=False,
+        )
+    if written:
+        db.commit()
+    return len(invoices), written
@@ -0,0 +1,287 @@
+import gc
+import json
+import logging
+import operator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Sequence
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from queries.risk import (
+    get_active_rule_set_id,
+    get_active_rule_set_id_async,
+    get_rule_set_document,
+    get_rule_set_document_async,
+    publish_rule_set,
+)
+
+log = logging.getLogger("risk_rules")
+
+DEFAULT_RULES_PATH = Path(__file__).resolve().parents[1] / "core" / "risk_rules.json"
+
+ITEM_FIELDS = ("qty", "unit_price")
+INVOICE_FIELDS = ("grand_total",)
+
+# same operators for Python floats and NumPy arrays
+_OPS: dict[str, Callable] = {
+    "gte": operator.ge,
+    "gt": operator.gt,
+    "lte": operator.le,
+    "lt": operator.lt,
+}
+
+
+class _Rule:
+    """
+    One compiled rule: all conditions must hold => `rate` + a reason with `details` fields.
+    """
+
+    def __init__(self, spec: dict, fields: tuple[str, ...]) -> None:
+        self.reason = str(spec["reason"])
+        self.rate = float(spec["rate"])
+        self.conditions: list[tuple[str, Callable, float]] = []
+        for field, ops in (spec.get("when") or {}).items():
+            if field not in fields:
+                raise ValueError(f"rule {self.reason!r}: unknown field {field!r} (expected one of {fields})")
+            for op, value in ops.items():
+                if op not in _OPS:
+                    raise ValueError(f"rule {self.reason!r}: unknown operator {op!r} (expected one of {tuple(_OPS)})")
+                self.conditions.append((field, _OPS[op], float(value)))
+        if not self.conditions:
+            raise ValueError(f"rule {self.reason!r} has no conditions")
+
+        self.details = tuple(spec.get("details") or ())
+        unknown = set(self.details) - set(fields)
+        if unknown:
+            raise ValueError(f"rule {self.reason!r}: unknown detail fields {sorted(unknown)}")
+
+    def matches(self, values: dict[str, float]) -> bool:
+        return all(op(values[field], value) for field, op, value in self.conditions)
+
+    def mask(self, columns: dict[str, np.ndarray], size: int) -> np.ndarray:
+        m = np.ones(size, dtype=bool)
+        for field, op, value in self.conditions:
+            m &= op(columns[field], value)
+        return m
+
+    def reason_for(self, values: dict[str, float]) -> dict:
+        return {"reason": self.reason, "details": {f: values[f] for f in self.details}}
+
+
+class RuleSet:
+    """
+    Risk rules loaded from data (core/risk_rules.json or RISK_RULES_PATH), compiled once.
+    - item_ladder: per item, the FIRST matching rule applies
+    - item_rules: per item, every matching rule applies
+    - invoice_rules: on the invoice total, every matching rule applies
+    Invoice rate = max of all applied rates (clamped to 0..1); level from `levels`.
+    evaluate() scores one invoice; evaluate_batch() scores columnar input with NumPy
+    masks and returns exactly what evaluate() would, invoice by invoice.
+    """
+
+    def __init__(self, spec: dict) -> None:
+        self.spec = spec  # as loaded => what reload_rules publishes for the other processes
+        self.version = str(spec["version"])
+        self.levels = sorted(
+            ((float(lv["min_rate"]), str(lv["level"])) for lv in spec.get("levels") or []),
+            reverse=True,
+        )
+        self.default_level = str(spec.get("default_level", "LOW"))
+        self.item_ladder = [_Rule(r, ITEM_FIELDS) for r in spec.get("item_ladder") or []]
+        self.item_rules = [_Rule(r, ITEM_FIELDS) for r in spec.get("item_rules") or []]
+        self.invoice_rules = [_Rule(r, INVOICE_FIELDS) for r in spec.get("invoice_rules") or []]
+
+    @classmethod
+    def from_file(cls, path: str | Path) -> "RuleSet":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def level(self, rate: float) -> str:
+        for min_rate, level in self.levels:
+            if rate >= min_rate:
+                return level
+        return self.default_level
+
+    def summary(self) -> dict:
+        return {
+            "version": self.version,
+            "item_ladder": len(self.item_ladder),
+            "item_rules": len(self.item_rules),
+            "invoice_rules": len(self.invoice_rules),
+        }
+
+    def _result(self, rate: float, reasons: list[dict]) -> dict:
+        rate = max(0.0, min(1.0, rate))
+        return {"rate": rate, "risk_level": self.level(rate), "reasons": reasons, "rules_version": self.version}
+
+    def evaluate(self, invoice: dict, items: list[dict]) -> dict:
+        reasons: list[dict] = []
+        rate = 0.0
+
+        for it in items:
+            values = {"qty": float(it.get("qty") or 0), "unit_price": float(it.get("rate") or 0)}
+            for rule in self.item_ladder:
+                if rule.matches(values):
+                    rate = max(rate, rule.rate)
+                    reasons.append(rule.reason_for(values))
+                    break
+            for rule in self.item_rules:
+                if rule.matches(values):
+                    rate = max(rate, rule.rate)
+                    reasons.append(rule.reason_for(values))
+
+        values = {"grand_total": float(invoice.get("grand_total") or 0)}
+        for rule in self.invoice_rules:
+            if rule.matches(values):
+                rate = max(rate, rule.rate)
+                reasons.append(rule.reason_for(values))
+
+        return self._result(rate, reasons)
+
+    def evaluate_batch(
+        self,
+        qty: Sequence[float],
+        rate: Sequence[float],
+        offsets: Sequence[int],
+        grand_total: Sequence[float],
+    ) -> list[dict]:
+        items = {
+            "qty": np.asarray(qty, dtype=np.float64),
+            "unit_price": np.asarray(rate, dtype=np.float64),
+        }
+        totals = {"grand_total": np.asarray(grand_total, dtype=np.float64)}
+        n_items = len(items["qty"])
+        n = len(totals["grand_total"])
+        owner = np.repeat(np.arange(n), np.diff(np.asarray(offsets, dtype=np.int64)))
+
+        # ladder: index of the first matching rule per item (-1 = none)
+        ladder_idx = np.full(n_items, -1, dtype=np.int64)
+        item_rate = np.zeros(n_items, dtype=np.float64)
+        for i, rule in enumerate(self.item_ladder):
+            m = (ladder_idx < 0) & rule.mask(items, n_items)
+            ladder_idx[m] = i
+            item_rate[m] = np.maximum(item_rate[m], rule.rate)
+
+        item_masks = [rule.mask(items, n_items) for rule in self.item_rules]
+        for rule, m in zip(self.item_rules, item_masks):
+            item_rate = np.maximum(item_rate, np.where(m, rule.rate, 0.0))
+
+        inv_rate = np.zeros(n, dtype=np.float64)
+        np.maximum.at(inv_rate, owner, item_rate)
+
+        invoice_masks = [rule.mask(totals, n) for rule in self.invoice_rules]
+        for rule, m in zip(self.invoice_rules, invoice_masks):
+            inv_rate = np.maximum(inv_rate, np.where(m, rule.rate, 0.0))
+
+        # reasons: only flagged items / invoices reach Python
+        reasons: list[list[dict]] = [[] for _ in range(n)]
+        flagged = ladder_idx >= 0
+        for m in item_masks:
+            flagged |= m
+        flagged = np.flatnonzero(flagged)
+
+        with _gc_paused():
+            qs = items["qty"][flagged].tolist()
+            ps = items["unit_price"][flagged].tolist()
+            hits = [m[flagged].tolist() for m in item_masks]
+            for k, (inv, ladder) in enumerate(zip(owner[flagged].tolist(), ladder_idx[flagged].tolist())):
+                values = {"qty": qs[k], "unit_price": ps[k]}
+                out = reasons[inv]
+                if ladder >= 0:
+                    out.append(self.item_ladder[ladder].reason_for(values))
+                for rule, hit in zip(self.item_rules, hits):
+                    if hit[k]:
+                        out.append(rule.reason_for(values))
+
+            for rule, m in zip(self.invoice_rules, invoice_masks):
+                for inv in np.flatnonzero(m).tolist():
+                    reasons[inv].append(rule.reason_for({"grand_total": float(totals["grand_total"][inv])}))
+
+            return [self._result(r, reasons[i]) for i, r in enumerate(inv_rate.tolist())]
+
+
+@contextmanager
+def _gc_paused() -> Iterator[None]:
+    # millions of small dicts that all stay alive make the cyclic GC rescan them over and over
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+_active: RuleSet | None = None
+_active_id: int | None = None  # published rule set (risk_rule_sets) _active came from; None = rules file
+
+
+def _rules_path() -> Path:
+    return Path(settings.RISK_RULES_PATH) if settings.RISK_RULES_PATH else DEFAULT_RULES_PATH
+
+
+def get_rules() -> RuleSet:
+    """
+    Active rule set of this process (loaded from file on first use; kept in line with the
+    published rule set by refresh_rules at every scoring entry point).
+    """
+    global _active
+    if _active is None:
+        _active = RuleSet.from_file(_rules_path())
+        log.info("risk rules %s loaded from %s", _active.version, _rules_path())
+    return _active
+
+
+def reload_rules(db: Session | None = None) -> tuple[str | None, RuleSet]:
+    """
+    Re-read the rules file. Returns (previous_version, new rule set).
+    With `db` the rules are also published (risk_rule_sets) => every other process switches
+    on its next refresh_rules. A broken file raises and keeps the current rules active.
+    """
+    global _active, _active_id
+    previous = refresh_rules(db).version if db is not None else (_active.version if _active is not None else None)
+    rules = RuleSet.from_file(_rules_path())
+    rule_set_id = None
+    if db is not None:
+        rule_set_id = publish_rule_set(db, rules.version, json.dumps(rules.spec, separators=(",", ":")))
+    _active, _active_id = rules, rule_set_id
+    log.info("risk rules reloaded: %s -> %s", previous, rules.version)
+    return previous, rules
+
+
+def refresh_rules(db: Session) -> RuleSet:
+    """
+    Switch to the newest published rule set if another process reloaded the rules.
+    One indexed MAX(id) per call; the document is only read when it changed.
+    """
+    rule_set_id = get_active_rule_set_id(db)
+    if rule_set_id is None or rule_set_id == _active_id:
+        return get_rules()
+    return _switch_to(rule_set_id, get_rule_set_document(db, rule_set_id))
+
+
+async def refresh_rules_async(db: AsyncSession) -> RuleSet:
+    """
+    refresh_rules() on an AsyncSession (read endpoints with DB_ASYNC_ENABLED).
+    """
+    rule_set_id = await get_active_rule_set_id_async(db)
+    if rule_set_id is None or rule_set_id == _active_id:
+        return get_rules()
+    return _switch_to(rule_set_id, await get_rule_set_document_async(db, rule_set_id))
+
+
+def _switch_to(rule_set_id: int, document: str | None) -> RuleSet:
+    global _active, _active_id
+    try:
+        rules = RuleSet(json.loads(document or ""))
+    except (ValueError, KeyError, TypeError) as e:
+        log.warning("published risk rules #%s are invalid (%s) -> keeping %s", rule_set_id, e, get_rules().version)
+        return get_rules()
+    previous = _active.version if _active is not None else None
+    _active, _active_id = rules, rule_set_id
+    log.info("risk rules %s -> %s (published #%s)", previous, rules.version, rule_set_id)
+    return rules
@@ -1,20 +1,50 @@
 import asyncio
 import logging
+import random
+import time
+from typing import Any, Awaitable, Callable
+
 from sqlalchemy.orm import Session
 
 from core.config import settings
 from db.session import SessionLocal
-from services.sync_service import SyncService
+from services.ai_enrichment import get_enrichment_queue
+from services.erp_client import close_http_client, erp_health, get_http_client
+from services.leader import Lease, hold_lease
+from queries.sync_state import add_sync_request, take_sync_requests
+from services.sync_service import get_sync_service
 
 log = logging.getLogger("scheduler")
 
 
 class Scheduler:
     def __init__(self) -> None:
-        self.sync = SyncService()
+        self.sync = get_sync_service()  # same coordinator as /sync/* => shared lock + single-flight
+        self.session_factory = SessionLocal
         self._task: asyncio.Task | None = None
+        self._heartbeat_task: asyncio.Task | None = None
+        self._work: asyncio.Future | None = None  # leader tick in progress (cancelled on lease loss)
         self._stop = asyncio.Event()
 
+        # leader election: only the lease holder runs cycles (one sync loop across workers)
+        self.lease: Lease | None = (
+            Lease(settings.SYNC_LEADER_LEASE_SECONDS) if settings.SYNC_LEADER_ELECTION else None
+        )
+        self._leading = asyncio.Event()
+        if self.lease is None:
+            self._leading.set()
+
+        # adaptive interval state (exposed via status())
+        self.current_interval: float = _base_interval()
+        self.next_run_at: float | None = None
+        self.last_cycle_at: float | None = None
+        self.last_result: dict | None = None
+        self.cycles = 0
+        self.last_reconcile_at: float | None = None
+        self.last_reconcile: dict | None = None
+        # manual triggers handed over by non-leaders (sync_state rows), merged until the next tick
+        self._requested: dict = {}
+
     async def start(self) -> None:
         if not settings.SYNC_ENABLED:
             log.info("SYNC_ENABLED=false -> scheduler not started")
@@ -23,24 +53,306 @@ class Scheduler:
             return
 
         self._stop.clear()
+        get_http_client()  # pooled ERPNext client, reused by every cycle
+        if self.lease is not None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
         self._task = asyncio.create_task(self._loop())
-        log.info("Scheduler started (interval=%ss)", settings.SYNC_INTERVAL_SECONDS)
+        log.info(
+            "Scheduler started (interval=%ss, max=%ss)",
+            settings.SYNC_INTERVAL_SECONDS,
+            settings.SYNC_INTERVAL_MAX_SECONDS,
+        )
 
     async def stop(self) -> None:
         self._stop.set()
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
         if self._task:
             await asyncio.sleep(0)  # allow loop to exit
-            self._task.cancel()
+            task, self._task = self._task, None
+            # cycle first: it checkpoints what it wrote (own session) before the loop goes away
+            await self.sync.stop()
+            task.cancel()
+            await asyncio.wait([task], timeout=settings.SYNC_STOP_TIMEOUT_SECONDS)
+            await close_http_client()
+        if self.lease is not None and self._leading.is_set():
+            self._leading.clear()
+            try:
+                await asyncio.to_thread(self.lease.release)  # next worker takes over without waiting for expiry
+            except Exception as e:
+                log.warning("lease release failed: %s", e)
 
-    async def _loop(self) -> None:
+    async def run_exclusive(self, job: Callable[[], Awaitable[Any]], request: dict | list[dict]) -> Any | None:
+        """
+        Run a manual trigger (/sync/*, webhook drain) under the single-writer rule:
+        - this process leads (same lock as the loop), or leader election is off and the
+          sync runs here (not APP_ROLE=api) => job() runs right away
+        - lease free => held for the duration of job() (renewed; lost => running cycle stopped)
+        - someone else leads (or the worker, for APP_ROLE=api without election) => `request`
+          ({"cycle"|"backfill"|"reconcile"|"remove": ...}, or a list of them) is left in
+          sync_state for the leader's loop
+        Returns job()'s result, or None when handed over.
+        """
+        if self.lease is None:
+            if settings.APP_ROLE != "api" or not settings.SYNC_ENABLED:
+                return await job()
+            await asyncio.to_thread(self._add_request, request)
+            return None
+
+        if self._leading.is_set():
+            return await job()
+
+        current = asyncio.current_task()
+
+        async def lost() -> None:
+            await self.sync.stop()
+            current.cancel()
+
+        manual = Lease(self.lease.ttl_seconds, key=self.lease.key, session_factory=self.lease.session_factory)
+        async with hold_lease(manual, on_lost=lost) as held:
+            if held:
+                return await job()
+        await asyncio.to_thread(self._add_request, request)
+        return None
+
+    def _add_request(self, request: dict | list[dict]) -> None:
+        requests = request if isinstance(request, list) else [request]
+        db: Session = self.session_factory()
+        try:
+            for req in requests:
+                add_sync_request(db, req)
+        finally:
+            db.close()
+        log.info("sync request handed over to the leader: %s", request)
+
+    async def _take_requests(self) -> bool:
+        """
+        Merge pending manual triggers into self._requested. True if there were any.
+        """
+        def take() -> list[dict]:
+            db: Session = self.session_factory()
+            try:
+                return take_sync_requests(db)
+            finally:
+                db.close()
+
+        try:
+            requests = await asyncio.to_thread(take)
+        except Exception as e:
+            log.warning("reading sync requests failed: %s", e)
+            return False
+        for req in requests:
+            if req.get("backfill"):
+                prev = self._requested.get("backfill") or {}
+                self._requested["backfill"] = {
+                    "pages": max(int(prev.get("pages") or 0), int(req["backfill"].get("pages") or 1)),
+                    "reset": bool(prev.get("reset") or req["backfill"].get("reset")),
+                }
+            if req.get("reconcile"):
+                self._requested["reconcile"] = True
+            if req.get("cycle"):
+                self._requested["cycle"] = True
+            if req.get("remove"):
+                self._requested["remove"] = sorted(set(self._requested.get("remove") or []) | set(req["remove"]))
+        if requests:
+            log.info("picked up %s handed-over sync request(s): %s", len(requests), self._requested)
+        return bool(requests)
+
+    async def _sleep(self, delay: float) -> None:
+        """
+        Wait `delay` seconds; wake early on stop or when a non-leader hands over a trigger.
+        """
+        deadline = time.monotonic() + delay
+        poll = max(0.05, settings.SYNC_REQUEST_POLL_SECONDS)
+        while not self._stop.is_set():
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=min(left, poll))
+            except asyncio.TimeoutError:
+                pass
+            if await self._take_requests():
+                return
+
+    def status(self) -> dict:
+        return {
+            "running": bool(self._task and not self._task.done()),
+            "leader": self._leading.is_set(),
+            "leader_election": self.lease is not None,
+            "holder_id": self.lease.holder_id if self.lease is not None else None,
+            "current_interval_seconds": round(self.current_interval, 3),
+            "base_interval_seconds": _base_interval(),
+            "webhooks_enabled": bool(settings.SYNC_WEBHOOK_SECRET),
+            "max_interval_seconds": settings.SYNC_INTERVAL_MAX_SECONDS,
+            "next_run_in_seconds": (
+                round(max(0.0, self.next_run_at - time.time()), 3) if self.next_run_at else None
+            ),
+            "last_cycle_at": self.last_cycle_at,
+            "cycles": self.cycles,
+            "last_result": self.last_result,
+            "pipeline": self.sync.pipeline_status(),
+            "ai_enrichment": get_enrichment_queue().status(),
+            "erp": erp_health(),
+            "last_reconcile_at": self.last_reconcile_at,
+            "last_reconcile": self.last_reconcile,
+        }
+
+    def next_interval(self, res: dict | None, backfill: dict | None = None) -> float:
+        """
+        Adaptive delay before the next cycle:
+        - page was full and made progress (cursor moved or rows written) / backfill still
+          running => 0 (drain backlog now); a full page stuck on a failing invoice is not a backlog
+        - idle (no candidates or nothing written), failed or ERPNext unavailable => exponential backoff up to the max
+        - otherwise => base interval (low-frequency safety net when webhooks are enabled)
+        Jitter (+-SYNC_JITTER_RATIO) avoids many workers polling ERPNext in lockstep.
+        """
+        base = _base_interval()
+        ceiling = float(max(base, settings.SYNC_INTERVAL_MAX_SECONDS))
+
+        backlog = bool(
+            (
+                res and res.get("status") == "ok"
+                and res.get("candidates", 0) >= settings.SYNC_MAX_CHANGED_PER_CYCLE
+                and (res.get("cursor_moved") or res.get("db_updated", 0) > 0)
+            )
+            or (backfill and backfill.get("status") == "running")
+        )
+        idle = res is None or res.get("status") != "ok" or (
+            res.get("candidates", 0) == 0 or res.get("db_updated", 0) == 0
+        )
+
+        if backlog:
+            self.current_interval = base
+            return 0.0
+
+        if idle:
+            self.current_interval = min(ceiling, self.current_interval * max(1.0, settings.SYNC_BACKOFF_FACTOR))
+        else:
+            self.current_interval = base
+
+        jitter = max(0.0, settings.SYNC_JITTER_RATIO)
+        return self.current_interval * random.uniform(1.0 - jitter, 1.0 + jitter)
+
+    def _reconcile_due(self) -> bool:
+        if not settings.SYNC_RECONCILE_ENABLED or settings.SYNC_RECONCILE_INTERVAL_SECONDS <= 0:
+            return False
+        if self.last_reconcile_at is None:
+            return True
+        return time.time() - self.last_reconcile_at >= settings.SYNC_RECONCILE_INTERVAL_SECONDS
+
+    async def _heartbeat(self) -> None:
+        """
+        Acquire / renew the lease every third of its duration.
+        A worker that cannot renew (DB error or taken over) stops running cycles, including
+        the one in progress (it checkpoints what it wrote, the new leader resumes from there).
+        Lease calls use their own thread, not the sync executor, so a busy pipeline can't
+        delay a renewal past expiry.
+        """
+        interval = _heartbeat_interval()
         while not self._stop.is_set():
-            db: Session = SessionLocal()
             try:
-                res = await self.sync.run_one_cycle(db)
-                log.info("sync cycle result: %s", res)
+                leading = await asyncio.to_thread(self.lease.try_acquire)
             except Exception as e:
-                log.exception("sync cycle failed: %s", e)
+                log.warning("lease heartbeat failed: %s", e)
+                leading = False
+
+            if leading and not self._leading.is_set():
+                log.info("acquired scheduler lease (%s)", self.lease.holder_id)
+                self._leading.set()
+            elif not leading and self._leading.is_set():
+                log.warning("lost scheduler lease (%s)", self.lease.holder_id)
+                self._leading.clear()
+                await self.sync.stop()
+                if self._work is not None:
+                    self._work.cancel()
+
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _tick(self, requested: dict) -> tuple[dict | None, dict | None]:
+        """
+        One leader tick: handed-over removals, delta cycle, then backfill / reconcile
+        when due or requested.
+        """
+        res: dict | None = None
+        bf: dict | None = None
+        db: Session = self.session_factory()
+        try:
+            if requested.get("remove"):
+                removed = await self.sync.remove_invoices(db, requested["remove"])
+                log.info("removed %s handed-over invoice(s): %s", removed, requested["remove"][:20])
+
+            res = await self.sync.run_one_cycle(db)
+            log.info("sync cycle result: %s", res)
+
+            backfill_req = requested.get("backfill")
+            if settings.SYNC_BACKFILL_ENABLED or backfill_req:
+                bf = await self.sync.run_backfill(
+                    db,
+                    max_pages=(backfill_req or {}).get("pages") or settings.SYNC_BACKFILL_PAGES_PER_TICK,
+                    reset=bool((backfill_req or {}).get("reset")),
+                )
+                if bf.get("status") != "done" or bf.get("pages_run"):
+                    log.info("backfill result: %s", bf)
+
+            if self._reconcile_due() or requested.get("reconcile"):
+                rec = await self.sync.run_reconcile(db)
+                self.last_reconcile_at = time.time()
+                self.last_reconcile = rec
+                log.info("reconcile result: %s", rec)
+        except Exception as e:
+            log.exception("sync cycle failed: %s", e)
+        finally:
+            db.close()
+        return res, bf
+
+    async def _loop(self) -> None:
+        while not self._stop.is_set():
+            if not self._leading.is_set():
+                # follower: wait for the heartbeat to win the lease
+                try:
+                    await asyncio.wait_for(self._leading.wait(), timeout=_heartbeat_interval())
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._take_requests()
+            requested, self._requested = self._requested, {}
+
+            # own task: a lost lease cancels it (see _heartbeat) without ending the loop
+            work = asyncio.ensure_future(self._tick(requested))
+            self._work = work
+            try:
+                res, bf = await work
+            except asyncio.CancelledError:
+                if not work.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                log.warning("sync cycle stopped: scheduler lease lost")
+                res, bf = None, None
             finally:
-                db.close()
+                self._work = None
+
+            self.cycles += 1
+            self.last_cycle_at = time.time()
+            self.last_result = res
+
+            delay = self.next_interval(res, bf)
+            self.next_run_at = time.time() + delay
+            if delay <= 0:
+                await asyncio.sleep(0)  # backlog: loop immediately, but let other tasks run
+                continue
+            await self._sleep(delay)
+
+
+def _heartbeat_interval() -> float:
+    return max(0.1, settings.SYNC_LEADER_LEASE_SECONDS / 3)
+
 
-            await asyncio.sleep(max(1, settings.SYNC_INTERVAL_SECONDS))
+def _base_interval() -> float:
+    if settings.SYNC_WEBHOOK_SECRET:
+        return float(max(1, settings.SYNC_WEBHOOK_POLL_INTERVAL_SECONDS))
+    return float(max(1, settings.SYNC_INTERVAL_SECONDS))
@@ -1,120 +1,795 @@
 import asyncio
+import json
 import logging
+import threading
+import time
+from typing import Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from core.config import settings
-from services.erp_client import ERPClient
+from db.session import SessionLocal, run_read
+from services.ai_enrichment import get_enrichment_queue
+from services.erp_client import ERPClient, is_cancelled
+from services.executor import run_blocking
 from services.hasher import items_hash
-from services.risk_engine import compute_risk
+from services.pipeline import Pipeline, Stage
+from services.resilience import CircuitOpenError
+from services.reconciler import reconcile
+from services.risk_engine import compute_risk, result_fingerprint
+from services.risk_rules import refresh_rules
 
-from queries.sync_state import get_state, set_state
-from queries.invoices import get_invoice_by_invoice_id, upsert_invoice_and_items
-from queries.risk import upsert_risk
+from queries.sync_state import (
+    clear_sync_failures,
+    get_cursor,
+    get_state,
+    get_state_async,
+    list_dead_letters,
+    record_sync_failures,
+    set_cursor,
+    set_state,
+)
+from queries.invoices import bulk_upsert_invoices_and_items, delete_invoices, get_erp_modified_map, normalize_item
+from queries.risk import bulk_upsert_risk
 
 log = logging.getLogger("sync")
 
 
 SYNC_STATE_KEY = "purchase_invoice_last_modified"
+BACKFILL_STATE_KEY = "purchase_invoice_backfill"
+
+HASH_BATCH_SIZE = 50  # invoices hashed per thread-pool call
+DEAD_LETTER_RETRY_LIMIT = 100  # dead-lettered invoices retried per reconcile pass
 
 
 class SyncService:
     def __init__(self) -> None:
         self.erp = ERPClient()
+        # serializes everything that writes invoices (cycle, backfill, reconcile, webhook sync)
         self._lock = asyncio.Lock()
 
+        # single-flight: the running cycle + at most one queued follow-up shared by late callers
+        self._cycle: asyncio.Future | None = None
+        self._next_cycle: asyncio.Future | None = None
+
+        self._pipeline: Pipeline | None = None  # running / last pipeline (live stage stats)
+
+        # webhook queue: names waiting for a targeted sync (coalesced between drains)
+        self.session_factory = SessionLocal
+        self._pending: set[str] = set()
+
     async def run_one_cycle(self, db: Session) -> dict:
+        """
+        Single-flight entry point for every trigger (scheduler, /sync/run).
+        - no cycle running => start one and return its result
+        - a cycle is running => everyone arriving now shares ONE follow-up cycle
+          (it starts when the current one ends, so their changes are seen)
+        Coalesced callers get the follow-up result with "coalesced": True.
+        """
+        if self._cycle is None or self._cycle.done():
+            self._cycle = asyncio.ensure_future(self._run_cycle(db))
+            return await asyncio.shield(self._cycle)
+
+        if self._next_cycle is None:
+            self._next_cycle = asyncio.ensure_future(self._run_follow_up(self._cycle, db))
+        res = await asyncio.shield(self._next_cycle)
+        return {**res, "coalesced": True}
+
+    async def _run_follow_up(self, previous: asyncio.Future, db: Session) -> dict:
+        await asyncio.wait([previous])  # never raises; the previous caller already got its error
+        self._cycle, self._next_cycle = asyncio.current_task(), None
+        return await self._run_cycle(db)
+
+    async def _run_cycle(self, db: Session) -> dict:
+        # the cycle is shielded and may outlive its caller (scheduler stop, cancelled request):
+        # it works on a session of its own so the caller closing `db` can't roll back its rows
+        own = type(db)(bind=db.get_bind(), autoflush=db.autoflush)  # same sessionmaker class => same events
+        try:
+            return await self._run_cycle_in(own)
+        finally:
+            own.close()
+
+    async def _run_cycle_in(self, db: Session) -> dict:
         """
         Cycle rule:
-        - bring latest invoices list
-        - choose changed invoices using last_modified + DB compare
+        - bring the next invoices after the (modified, name) cursor, oldest first
+        - choose changed invoices using the cursor + DB compare
         - fetch invoice details only for changed ones
         - upsert DB + compute risk only if changed
+        Waits for backfill / reconcile / webhook syncs holding the lock instead of skipping.
         """
-        if self._lock.locked():
-            # Prevent parallel sync => avoids infinite loop / dogpile
-            return {"status": "skipped", "reason": "sync already running"}
-
         async with self._lock:
-            last_modified = get_state(db, SYNC_STATE_KEY)
+            cursor = await run_blocking(get_cursor, db, SYNC_STATE_KEY)
 
-            rows = await self.erp.list_purchase_invoices(limit=settings.SYNC_MAX_CHANGED_PER_CYCLE)
+            # (modified, name) cursor is pushed to ERPNext => only real changes come back,
+            # oldest first, each invoice exactly once even when many share one `modified`
+            try:
+                rows = await self.erp.list_purchase_invoices(
+                    limit=settings.SYNC_MAX_CHANGED_PER_CYCLE,
+                    modified_after=cursor[0],
+                    name_after=cursor[1],
+                )
+            except CircuitOpenError as e:
+                # ERPNext known to be down: finish now instead of waiting on timeouts
+                return _erp_unavailable(e)
 
             changed = []
-            newest_seen = last_modified
-
             for r in rows:
-                inv_id = r.get("name")
-                erp_mod = r.get("modified")
-                if not inv_id:
+                meta = _meta_from_row(r)
+                if meta is None:
                     continue
 
-                # track newest modified seen
-                if erp_mod and (newest_seen is None or erp_mod > newest_seen):
-                    newest_seen = erp_mod
-
-                # delta by last_modified (fast filter)
-                if last_modified and erp_mod and erp_mod <= last_modified:
+                # strict tuple compare (safety net; ERPNext already filtered)
+                if not _is_after(meta, cursor):
                     continue
 
-                changed.append({
-                    "invoice_id": inv_id,
-                    "supplier": r.get("supplier"),
-                    "posting_date": r.get("posting_date"),
-                    "grand_total": r.get("grand_total"),
-                    "modified": erp_mod,
-                })
-
-            updated_count = 0
-            recalculated_count = 0
+                changed.append(meta)
+            changed.sort(key=_cursor_key)
 
-            for meta in changed:
-                inv_id = meta["invoice_id"]
-                details = await self.erp.get_purchase_invoice(inv_id)
-                items = details.get("items") or []
+            new_cursor = cursor
 
-                h = items_hash(items)
-
-                existing = get_invoice_by_invoice_id(db, inv_id)
-                if existing and existing.erp_modified == meta["modified"] and existing.items_hash == h:
-                    # no real change => do nothing
-                    continue
+            def stage_cursor(done: set[str], final: bool) -> None:
+                nonlocal new_cursor
+                # advance over the prefix that is stored => a failed / unfinished invoice is retried next cycle
+                new_cursor = _advance_cursor(cursor, changed, done)
 
-                invoice_data = {
-                    "invoice_id": inv_id,
-                    "supplier": meta.get("supplier"),
-                    "posting_date": meta.get("posting_date"),
-                    "grand_total": float(meta.get("grand_total") or 0),
-                    "erp_modified": meta.get("modified"),
-                    "items_hash": h,
-                }
+                # update sync cursor (same transaction as the persisted chunk => checkpoint)
+                if new_cursor != cursor:
+                    set_cursor(db, SYNC_STATE_KEY, *new_cursor, commit=False)
 
-                inv = upsert_invoice_and_items(db, invoice_data=invoice_data, items=items)
+            updated_count, failed, unchanged, writes = await self._sync_batch(db, changed, on_commit=stage_cursor)
 
-                updated_count += 1
+            return {
+                "status": "ok",
+                "last_modified_before": cursor[0],
+                "last_modified_after": new_cursor[0],
+                "last_name_after": new_cursor[1],
+                "cursor_moved": new_cursor != cursor,
+                "candidates": len(changed),
+                "unchanged_skipped": unchanged,
+                "db_updated": updated_count,
+                "risk_recalculated": updated_count,
+                **writes,
+                "failed": len(failed),
+                "failed_ids": [m["invoice_id"] for m in failed],
+                "pipeline": self.pipeline_status(),
+            }
 
-                # compute risk only when changed
-                risk = compute_risk(
-                    {"grand_total": inv.grand_total},
-                    [{"qty": it.qty, "rate": it.rate, "amount": it.amount, "item_code": it.item_code, "item_name": it.item_name, "idx": it.idx} for it in inv.items],
-                )
-                upsert_risk(
-                    db,
-                    invoice_pk=inv.id,
-                    rate=risk["rate"],
-                    risk_level=risk["risk_level"],
-                    reasons=risk["reasons"],
-                )
-                recalculated_count += 1
+    async def sync_invoices(self, db: Session, names: list[str]) -> dict:
+        """
+        Targeted sync for specific invoices (webhook path).
+        Same hash / upsert / risk pipeline as a cycle, but no list scan and no cursor move.
+        Waits for a running cycle (the change must not be lost).
+        """
+        async with self._lock:
+            rows = await self.erp.list_purchase_invoices_by_name(names)
+            metas = [m for m in (_meta_from_row(r) for r in rows) if m is not None]
 
-            # update sync cursor
-            if newest_seen and newest_seen != last_modified:
-                set_state(db, SYNC_STATE_KEY, newest_seen)
+            updated_count, failed, unchanged, writes = await self._sync_batch(db, metas)
 
+            found = {m["invoice_id"] for m in metas}
             return {
                 "status": "ok",
-                "last_modified_before": last_modified,
-                "last_modified_after": newest_seen,
-                "candidates": len(changed),
+                "requested": len(names),
+                "not_found": sorted(set(names) - found),
+                "unchanged_skipped": unchanged,
                 "db_updated": updated_count,
-                "risk_recalculated": recalculated_count,
+                **writes,
+                "failed_ids": [m["invoice_id"] for m in failed],
             }
+
+    def enqueue_invoices(self, names: list[str]) -> None:
+        self._pending.update(names)
+
+    async def remove_invoices(self, db: Session, names: list[str]) -> int:
+        """
+        Remove invoices cancelled / deleted in ERPNext (webhook path).
+        Holds the sync lock so a running cycle can't store them again in between.
+        """
+        async with self._lock:
+            return await run_blocking(delete_invoices, db, names)
+
+    def discard_pending(self) -> None:
+        self._pending.clear()
+
+    async def drain_pending(self) -> list[dict]:
+        """
+        Sync everything queued by webhooks; names arriving meanwhile are picked up in the same drain.
+        Failures are logged only: the polling cycle is the safety net.
+        """
+        results = []
+        while self._pending:
+            names = sorted(self._pending)
+            self._pending.clear()
+
+            db = self.session_factory()
+            try:
+                res = await self.sync_invoices(db, names)
+                log.info("webhook sync result: %s", res)
+                results.append(res)
+            except Exception as e:
+                log.exception("webhook sync failed for %s: %s", names, e)
+            finally:
+                db.close()
+        return results
+
+    async def run_backfill(self, db: Session, *, max_pages: int | None = None, reset: bool = False) -> dict:
+        """
+        Backfill / backlog drain:
+        - page through ERPNext in ascending (modified, name) order (keyset, no offsets)
+        - apply every page like a normal cycle
+        - commit the backfill cursor after each page => resumable after crash/restart
+        Cursor = last (modified, name) fully done, kept in its own sync_state row; a delta
+        cursor behind it is moved up to it (no re-walk of what backfill already stored).
+        """
+        async with self._lock:
+            if reset:
+                await run_blocking(_save_backfill, db, _new_backfill_state())
+
+            state = await run_blocking(get_backfill_state, db)
+            if state["done"]:
+                return {"status": "done", **state}
+
+            page_size = max(1, settings.SYNC_BACKFILL_PAGE_SIZE)
+            pages_run = 0
+            updated_total = 0
+            writes_total = _new_write_counts()
+            failed_ids: list[str] = []
+
+            while max_pages is None or pages_run < max_pages:
+                try:
+                    rows = await self.erp.list_purchase_invoices(
+                        limit=page_size,
+                        modified_after=state["modified"],
+                        name_after=state["name"],
+                    )
+                except CircuitOpenError as e:
+                    return {**_erp_unavailable(e), **state, "pages_run": pages_run, "db_updated": updated_total}
+                metas = sorted((m for m in (_meta_from_row(r) for r in rows) if m is not None), key=_cursor_key)
+                page_start = dict(state)
+
+                def stage_page_cursor(done: set[str], final: bool) -> None:
+                    # advance cursor over the page prefix that is stored (checkpoints + page end)
+                    prefix = 0
+                    for meta in metas:
+                        if meta["invoice_id"] not in done:
+                            break
+                        prefix += 1
+                    # recomputed from page_start every time: a rolled-back chunk must not leave it too far
+                    if prefix:
+                        state["modified"], state["name"] = metas[prefix - 1]["modified"], metas[prefix - 1]["invoice_id"]
+                    else:
+                        state["modified"], state["name"] = page_start["modified"], page_start["name"]
+                    state["processed"] = page_start["processed"] + prefix
+
+                    if final:
+                        if prefix == len(metas) and len(rows) < page_size:
+                            state["done"] = True
+                        state["pages"] += 1
+                    _save_backfill(db, state, commit=False)
+
+                updated, failed, _, writes = await self._sync_batch(db, metas, on_commit=stage_page_cursor)
+                updated_total += updated
+                _add_counts(writes_total, writes)
+                pages_run += 1
+                failed_ids = [m["invoice_id"] for m in failed]
+
+                if failed or state["done"]:
+                    break
+
+            if state["modified"]:
+                await run_blocking(_handover_cursor, db, state["modified"], state["name"])
+
+            return {
+                "status": "done" if state["done"] else ("partial" if failed_ids else "running"),
+                **state,
+                "pages_run": pages_run,
+                "db_updated": updated_total,
+                **writes_total,
+                "failed_ids": failed_ids,
+            }
+
+    async def backfill_progress(self, db: Session | AsyncSession) -> dict:
+        """
+        Current backfill cursor + remaining invoices in ERPNext (best effort).
+        Read-only: works on the read session (AsyncSession when DB_ASYNC_ENABLED).
+        """
+        state = _parse_backfill_state(await run_read(db, get_state, get_state_async, key=BACKFILL_STATE_KEY))
+        remaining = None
+        if not state["done"]:
+            try:
+                remaining = await self.erp.count_purchase_invoices(
+                    modified_after=state["modified"],
+                    name_after=state["name"],
+                )
+            except Exception as e:
+                log.warning("backfill remaining count failed: %s", e)
+        return {**state, "remaining": remaining}
+
+    async def stop(self) -> None:
+        """
+        Graceful shutdown: cancel the running / queued cycle and wait for it to
+        checkpoint what it already wrote.
+        """
+        futures = [f for f in (self._next_cycle, self._cycle) if f is not None and not f.done()]
+        for f in futures:
+            f.cancel()
+        if futures:
+            await asyncio.wait(futures)
+
+    async def run_reconcile(self, db: Session) -> dict:
+        """
+        Remove local invoices deleted / cancelled in ERPNext (see services.reconciler),
+        then retry dead-lettered invoices the cursor moved past.
+        Runs under the sync lock so it never races a cycle writing the same rows.
+        """
+        async with self._lock:
+            res = await reconcile(self.erp, db, delete=settings.SYNC_RECONCILE_DELETE)
+            return {**res, "dead_letters": await self._retry_dead_letters(db)}
+
+    async def _retry_dead_letters(self, db: Session) -> dict:
+        """
+        Sync dead-lettered invoices again by name (caller holds the lock). Stored ones leave
+        the dead-letter table, failing ones stay for the next pass, names ERPNext no longer
+        lists are dropped (reconcile handles their local copy).
+        """
+        names = await run_blocking(
+            list_dead_letters, db, max(1, settings.SYNC_MAX_INVOICE_ATTEMPTS), DEAD_LETTER_RETRY_LIMIT
+        )
+        if not names:
+            return {"retried": 0, "recovered": 0}
+        try:
+            rows = await self.erp.list_purchase_invoices_by_name(names)
+        except Exception as e:
+            log.warning("dead-letter retry failed to list %s invoice(s): %s", len(names), e)
+            return {"retried": 0, "recovered": 0}
+
+        metas = [m for m in (_meta_from_row(r) for r in rows) if m is not None]
+        gone = sorted(set(names) - {m["invoice_id"] for m in metas})
+        if gone:
+            await run_blocking(clear_sync_failures, db, gone)
+        _, failed, _, _ = await self._sync_batch(db, metas)
+        recovered = len(metas) - len(failed)
+        if recovered:
+            log.info("dead-letter retry stored %s of %s invoice(s)", recovered, len(metas))
+        return {"retried": len(metas), "recovered": recovered}
+
+    async def _sync_batch(
+        self,
+        db: Session,
+        changed: list[dict],
+        on_commit: Callable[[set[str], bool], None] | None = None,
+    ) -> tuple[int, list[dict], int, dict[str, int]]:
+        """
+        Fetch details for `changed`, hash, score, persist in bulk.
+        Cancelled invoices (docstatus 2) are removed locally instead (committed at once; deleting
+        again after a lost cursor commit is a no-op) and count as stored for the cursor.
+        Invoices whose `modified` already matches the DB are dropped BEFORE any detail call.
+        The rest flows through a staged pipeline (see _build_pipeline).
+        on_commit(done_ids, final) stages cursor writes into every persist commit
+        (checkpoints + the final one); done_ids = invoices stored for good so far.
+        Cancelled mid-way (shutdown): what is already written is committed with its
+        checkpoint before the cancellation goes on, so the next cycle resumes from there.
+        Failures are counted per invoice (sync_failures); one that failed SYNC_MAX_INVOICE_ATTEMPTS
+        times is dead-lettered: done for the cursor, so it can't pin it, and retried by reconcile.
+        Returns (updated_count, failed_metas, unchanged_count, writes); updated_count = invoices
+        evaluated and persisted, writes = rows actually written (identical rows are skipped).
+        """
+        failed: list[dict] = []
+
+        # score under the published rules, even if another process reloaded them
+        await run_blocking(refresh_rules, db)
+
+        cancelled = [m["invoice_id"] for m in changed if is_cancelled(m)]
+        removed = await run_blocking(delete_invoices, db, cancelled) if cancelled else 0
+        live = [m for m in changed if not is_cancelled(m)]
+
+        known = await run_blocking(get_erp_modified_map, db, [m["invoice_id"] for m in live])
+        todo = [
+            m for m in live
+            if not (m["modified"] and m["invoice_id"] in known and known[m["invoice_id"]] == m["modified"])
+        ]
+        unchanged = len(live) - len(todo)
+
+        stored = {m["invoice_id"] for m in changed} - {m["invoice_id"] for m in todo}
+        writer = _ChunkWriter(db, failed, stored, on_commit)
+        self._pipeline = self._build_pipeline(writer, failed)
+        try:
+            await self._pipeline.run(todo)
+        except asyncio.CancelledError:
+            await asyncio.shield(run_blocking(writer.checkpoint))
+            raise
+
+        parked = await run_blocking(writer.settle_failures, {m["invoice_id"] for m in changed})
+        if parked:
+            log.warning("dead-lettered %s invoice(s) after repeated failures: %s", len(parked), sorted(parked)[:20])
+        updated_count, writes = await run_blocking(writer.finish)
+        return updated_count, failed, unchanged, {**writes, "invoices_removed": removed, "dead_lettered": len(parked)}
+
+    def pipeline_status(self) -> dict:
+        """
+        Stage stats of the running (or last) pipeline: queue depth, throughput, utilization.
+        """
+        return self._pipeline.stats() if self._pipeline is not None else {}
+
+    def _build_pipeline(self, writer: "_ChunkWriter", failed: list[dict]) -> Pipeline:
+        """
+        fetch -> hash -> score -> persist, connected by bounded queues:
+        - fetch: SYNC_FETCH_CONCURRENCY workers; with SYNC_BATCH_ITEMS each takes up to
+          SYNC_ITEMS_BATCH_SIZE queued invoices per child-table request
+        - hash: items_hash + invoice row (thread pool)
+        - score: compute_risk (may call OpenAI) with SYNC_SCORE_CONCURRENCY workers
+        - persist: one writer, takes whatever records are ready (up to SYNC_PERSIST_CHUNK_SIZE)
+        A slow stage fills its queue and stalls the stages before it (backpressure).
+        """
+        queue_size = max(1, settings.SYNC_PIPELINE_QUEUE_SIZE)
+        sem = asyncio.Semaphore(max(1, settings.SYNC_FETCH_CONCURRENCY))  # ERPNext requests in flight
+
+        def fail_all(key: str) -> Callable[[list, BaseException], None]:
+            return lambda batch, e: failed.extend(x[key] if key else x for x in batch)
+
+        return Pipeline([
+            Stage(
+                "fetch",
+                lambda metas: self._fetch_stage(metas, failed, sem),
+                workers=settings.SYNC_FETCH_CONCURRENCY,
+                batch_size=settings.SYNC_ITEMS_BATCH_SIZE if settings.SYNC_BATCH_ITEMS else 1,
+                queue_size=queue_size,
+                on_error=fail_all(""),
+            ),
+            Stage(
+                "hash",
+                lambda batch: run_blocking(_hash_batch, batch),
+                batch_size=HASH_BATCH_SIZE,
+                queue_size=queue_size,
+                on_error=fail_all("meta"),
+            ),
+            Stage(
+                "score",
+                lambda batch: run_blocking(_score_batch, batch),
+                workers=settings.SYNC_SCORE_CONCURRENCY,
+                queue_size=queue_size,
+                on_error=fail_all("meta"),
+            ),
+            Stage(
+                "persist",
+                lambda records: run_blocking(writer.write, records),
+                batch_size=settings.SYNC_PERSIST_CHUNK_SIZE,
+                queue_size=queue_size,
+                on_error=fail_all("meta"),
+            ),
+        ])
+
+    async def _fetch_stage(self, metas: list[dict], failed: list[dict], sem: asyncio.Semaphore) -> list[dict]:
+        """
+        Items for a batch of invoices. One child-table request per batch (SYNC_BATCH_ITEMS);
+        a failed batch falls back to per-invoice detail calls. Failures are recorded, not raised,
+        so one bad invoice can't abort the batch.
+        """
+        results: list[dict | BaseException]
+        if settings.SYNC_BATCH_ITEMS:
+            ids = [m["invoice_id"] for m in metas]
+            try:
+                async with sem:
+                    grouped = await self.erp.list_purchase_invoice_items(ids)
+                results = [{"name": i, "items": grouped.get(i) or []} for i in ids]
+            except Exception as e:
+                log.warning("batch items fetch failed (%s invoices): %s -> per-invoice fallback", len(ids), e)
+                results = await self._fetch_one_by_one(ids, sem)
+        else:
+            results = await self._fetch_one_by_one([m["invoice_id"] for m in metas], sem)
+
+        out = []
+        for meta, details in zip(metas, results):
+            if isinstance(details, BaseException):
+                log.warning("detail fetch failed for %s: %s", meta["invoice_id"], details)
+                failed.append(meta)
+                continue
+            out.append({"meta": meta, "details": details})
+        return out
+
+    async def _fetch_one_by_one(self, ids: list[str], sem: asyncio.Semaphore) -> list[dict | BaseException]:
+        async def fetch(inv_id: str) -> dict:
+            async with sem:
+                return await self.erp.get_purchase_invoice(inv_id)
+
+        return await asyncio.gather(*(fetch(i) for i in ids), return_exceptions=True)
+
+
+class _ChunkWriter:
+    """
+    Persist stage: writes each ready batch into the open transaction and commits every
+    SYNC_PERSIST_CHUNK_SIZE records or SYNC_CHECKPOINT_SECONDS, whichever comes first.
+    Every commit carries a cursor checkpoint (on_commit), so a stopped cycle loses at most
+    the uncommitted tail; a cycle that fits in one chunk still costs exactly one commit.
+    A failing write/commit is rolled back and the uncommitted records are retried one by
+    one to isolate the bad invoice.
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        failed: list[dict],
+        stored: set[str],
+        on_commit: Callable[[set[str], bool], None] | None,
+    ) -> None:
+        self.db = db
+        self.failed = failed
+        self.stored = stored  # invoice ids stored for good (unchanged or committed)
+        self.on_commit = on_commit
+        self.pending: list[dict] = []  # written, not committed yet
+        self.written = 0
+        # rows actually written (no-op upserts are skipped), committed / still pending
+        self.writes = _new_write_counts()
+        self._pending_writes = _new_write_counts()
+        self.last_commit = time.monotonic()
+        # the persist stage runs on the thread pool; checkpoint() after a cancel must wait for it
+        self._mutex = threading.Lock()
+
+    def write(self, records: list[dict]) -> list:
+        with self._mutex:
+            staged = False
+            try:
+                writes = _write_records(self.db, records)
+                self.pending.extend(records)
+                _add_counts(self._pending_writes, writes)
+                staged = True
+                if (
+                    len(self.pending) >= max(1, settings.SYNC_PERSIST_CHUNK_SIZE)
+                    or time.monotonic() - self.last_commit >= settings.SYNC_CHECKPOINT_SECONDS
+                ):
+                    self._commit(final=False)
+            except Exception as e:
+                self.db.rollback()
+                retry = self.pending if staged else self.pending + records
+                self.pending = []
+                self._pending_writes = _new_write_counts()
+                log.warning("bulk persist failed (%s invoices): %s -> per-invoice retry", len(retry), e)
+                self._write_one_by_one(retry)
+        return []
+
+    def checkpoint(self) -> None:
+        """
+        Commit what is written so far + its cursor checkpoint (cycle cancelled).
+        """
+        with self._mutex:
+            if not self.pending:
+                return
+            try:
+                self._commit(final=False)
+            except Exception as e:
+                self.db.rollback()
+                log.warning("checkpoint on cancel failed: %s", e)
+
+    def settle_failures(self, invoice_ids: set[str]) -> set[str]:
+        """
+        Stage failure bookkeeping into the final commit: one more attempt for every failed
+        invoice, failure rows of the stored ones dropped. Returns the failed ids that reached
+        SYNC_MAX_INVOICE_ATTEMPTS; they count as done for the cursor from now on.
+        """
+        with self._mutex:
+            done = self.stored | {r["meta"]["invoice_id"] for r in self.pending}
+            clear_sync_failures(self.db, sorted(done & invoice_ids), commit=False)
+            attempts = record_sync_failures(self.db, self.failed) if self.failed else {}
+            parked = {i for i, n in attempts.items() if n >= max(1, settings.SYNC_MAX_INVOICE_ATTEMPTS)}
+            self.stored |= parked
+            return parked
+
+    def finish(self) -> tuple[int, dict[str, int]]:
+        with self._mutex:
+            self._commit(final=True)
+            return self.written, self.writes
+
+    def _commit(self, final: bool) -> None:
+        ids = {r["meta"]["invoice_id"] for r in self.pending}
+        if self.on_commit is not None:
+            self.on_commit(self.stored | ids, final)
+        self.db.commit()
+        self.stored |= ids
+        self.written += len(self.pending)
+        _add_counts(self.writes, self._pending_writes)
+        _enqueue_enrichment(self.pending)
+        self.pending = []
+        self._pending_writes = _new_write_counts()
+        self.last_commit = time.monotonic()
+
+    def _write_one_by_one(self, records: list[dict]) -> None:
+        for rec in records:
+            try:
+                writes = _write_records(self.db, [rec])
+                self.db.commit()
+                self.written += 1
+                _add_counts(self.writes, writes)
+                self.stored.add(rec["meta"]["invoice_id"])
+                _enqueue_enrichment([rec])
+            except Exception as e:
+                # isolate per-invoice DB errors => keep the rest of the batch
+                self.db.rollback()
+                log.exception("persist failed for %s: %s", rec["meta"]["invoice_id"], e)
+                self.failed.append(rec["meta"])
+        self.last_commit = time.monotonic()
+
+
+def _hash_batch(batch: list[dict]) -> list[dict]:
+    """
+    Hash stage: invoice row (with items_hash) for each fetched invoice, no DB access.
+    """
+    out = []
+    for f in batch:
+        meta, items = f["meta"], f["details"].get("items") or []
+        out.append({
+            "meta": meta,
+            "items": items,
+            "invoice_data": {
+                "invoice_id": meta["invoice_id"],
+                "supplier": meta.get("supplier"),
+                "posting_date": meta.get("posting_date"),
+                "grand_total": float(meta.get("grand_total") or 0),
+                "erp_modified": meta.get("modified"),
+                "items_hash": items_hash(items),
+            },
+        })
+    return out
+
+
+def _score_batch(batch: list[dict]) -> list[dict]:
+    """
+    Score stage: risk on the same values that will be stored (calls OpenAI only with
+    AI_ASYNC_ENRICHMENT off; otherwise AI rows are stored "pending" and enriched after commit).
+    """
+    for rec in batch:
+        risk = compute_risk(
+            {"grand_total": rec["invoice_data"]["grand_total"]},
+            [normalize_item(it) for it in rec["items"]],
+        )
+        rec["risk"] = {
+            "rate": risk["rate"],
+            "risk_level": risk["risk_level"],
+            "reasons": risk["reasons"],
+            "rules_version": risk.get("rules_version"),
+            "input_fingerprint": result_fingerprint(
+                rec["invoice_data"]["items_hash"], rec["invoice_data"]["grand_total"], risk
+            ),
+            "ai_status": risk.get("ai_status"),
+        }
+    return batch
+
+
+_service: SyncService | None = None
+
+
+def get_sync_service() -> SyncService:
+    """
+    Process-wide sync coordinator shared by the scheduler and the /sync endpoints
+    (one lock + one in-flight cycle per process). Created lazily.
+    """
+    global _service
+    if _service is None:
+        _service = SyncService()
+    return _service
+
+
+def _erp_unavailable(e: CircuitOpenError) -> dict:
+    return {"status": "erp_unavailable", "reason": str(e), "retry_in_seconds": round(e.retry_in, 3)}
+
+
+def _write_records(db: Session, records: list[dict]) -> dict[str, int]:
+    """
+    Upsert invoices + items + risk (no commit). Returns rows actually written.
+    """
+    if not records:
+        return _new_write_counts()
+    pk_by_id, counts = bulk_upsert_invoices_and_items(db, [(r["invoice_data"], r["items"]) for r in records])
+    for r in records:
+        r["invoice_pk"] = pk_by_id[r["invoice_data"]["invoice_id"]]
+    risk_written = bulk_upsert_risk(db, [{"invoice_pk": r["invoice_pk"], **r["risk"]} for r in records])
+    return {
+        "invoices_written": counts["written"],
+        "items_written": counts["items_written"],
+        "risk_written": risk_written,
+    }
+
+
+def _enqueue_enrichment(records: list[dict]) -> None:
+    """
+    Committed records still waiting for AI => background enrichment (never blocks the sync).
+    """
+    pks = [r["invoice_pk"] for r in records if r["risk"].get("ai_status") == "pending"]
+    if pks:
+        get_enrichment_queue().enqueue(pks)
+
+
+def _new_write_counts() -> dict[str, int]:
+    return {"invoices_written": 0, "items_written": 0, "risk_written": 0}
+
+
+def _add_counts(total: dict[str, int], counts: dict[str, int]) -> None:
+    for key, n in counts.items():
+        total[key] = total.get(key, 0) + n
+
+
+def _meta_from_row(r: dict) -> dict | None:
+    inv_id = r.get("name")
+    if not inv_id:
+        return None
+    return {
+        "invoice_id": inv_id,
+        "supplier": r.get("supplier"),
+        "posting_date": r.get("posting_date"),
+        "grand_total": r.get("grand_total"),
+        "modified": r.get("modified"),
+        "docstatus": r.get("docstatus"),
+    }
+
+
+def _new_backfill_state() -> dict:
+    return {"modified": None, "name": None, "done": False, "processed": 0, "pages": 0}
+
+
+def get_backfill_state(db: Session) -> dict:
+    """
+    Backfill cursor stored as JSON in sync_state.
+    Missing row => backfill never ran => start from the oldest invoice.
+    """
+    return _parse_backfill_state(get_state(db, BACKFILL_STATE_KEY))
+
+
+def _parse_backfill_state(raw: str | None) -> dict:
+    state = _new_backfill_state()
+    if raw:
+        try:
+            state.update(json.loads(raw))
+        except ValueError:
+            log.warning("invalid backfill state %r -> restarting backfill", raw)
+
+    # older (modified, offset) cursor: re-read that modified (unchanged rows are skipped before fetching)
+    if state.pop("offset", 0) and state["name"] is None:
+        state["name"] = ""
+    return state
+
+
+def _handover_cursor(db: Session, modified: str, name: str | None) -> None:
+    # everything up to the backfill cursor is stored => a delta cursor behind it
+    # (first sync ever, or delta ran before backfill) jumps ahead instead of re-walking history
+    current = get_cursor(db, SYNC_STATE_KEY)
+    if current[0] is None or (modified, name or "") > (current[0], current[1] or ""):
+        set_cursor(db, SYNC_STATE_KEY, modified, name)
+
+
+def _save_backfill(db: Session, state: dict, commit: bool = True) -> None:
+    set_state(db, BACKFILL_STATE_KEY, json.dumps(state, separators=(",", ":")), commit=commit)
+
+
+def _cursor_key(meta: dict) -> tuple[str, str]:
+    return (meta.get("modified") or "", meta["invoice_id"])
+
+
+def _is_after(meta: dict, cursor: tuple[str | None, str | None]) -> bool:
+    """
+    (modified, name) > cursor. Cursor without name (written before names were stored)
+    compares on modified only; rows without modified are always kept.
+    """
+    modified, name = cursor
+    if not modified or not meta.get("modified"):
+        return True
+    if name is None:
+        return meta["modified"] > modified
+    return (meta["modified"], meta["invoice_id"]) > (modified, name)
+
+
+def _advance_cursor(
+    cursor: tuple[str | None, str | None],
+    changed: list[dict],
+    done: set[str],
+) -> tuple[str | None, str | None]:
+    """
+    Last (modified, name) of the sorted `changed` prefix that is stored (`done`).
+    Everything from the first failed / unfinished invoice on stays visible to the next cycle.
+    """
+    for meta in changed:
+        if meta["invoice_id"] not in done:
+            break
+        if meta.get("modified"):
+            cursor = (meta["modified"], meta["invoice_id"])
+    return cursor
@@ -0,0 +1,56 @@
+import base64
+import hashlib
+import hmac
+from typing import Any, Mapping
+
+from services.erp_client import is_cancelled
+
+
+CANCEL_EVENTS = {"on_cancel", "on_trash"}
+
+
+def verify_signature(body: bytes, headers: Mapping[str, str], secret: str) -> bool:
+    """
+    ERPNext webhook auth:
+    - X-Frappe-Webhook-Signature: base64(HMAC-SHA256(secret, raw body))  (Webhook Secret in ERPNext)
+    - or X-Webhook-Secret: <secret>  (plain shared secret, e.g. behind a proxy)
+    """
+    signature = headers.get("x-frappe-webhook-signature")
+    if signature:
+        expected = base64.b64encode(hmac.new(secret.encode("utf-8"), body, hashlib.sha256).digest()).decode()
+        return hmac.compare_digest(signature.strip(), expected)
+
+    shared = headers.get("x-webhook-secret")
+    if shared:
+        return hmac.compare_digest(shared.strip(), secret)
+
+    return False
+
+
+def parse_payload(payload: Any) -> tuple[list[str], list[str]]:
+    """
+    Webhook JSON -> (names to sync, names to remove).
+    Accepted shapes (ERPNext request body template):
+      {"doctype": "Purchase Invoice", "name": "...", "event": "on_update", "docstatus": 1}
+      {"doctype": "Purchase Invoice", "names": ["...", "..."], "event": "..."}
+    Cancelled (docstatus=2) or deleted (on_cancel / on_trash) invoices are removed locally.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("payload must be a JSON object")
+
+    doctype = payload.get("doctype")
+    if doctype and doctype != "Purchase Invoice":
+        raise ValueError(f"unsupported doctype: {doctype}")
+
+    raw = payload.get("names")
+    if raw is None:
+        raw = [payload.get("name")]
+    if not isinstance(raw, list):
+        raise ValueError("names must be a list")
+
+    names = sorted({str(n).strip() for n in raw if n and str(n).strip()})
+    if not names:
+        raise ValueError("name is required")
+
+    cancelled = payload.get("event") in CANCEL_EVENTS or is_cancelled(payload)
+    return ([], names) if cancelled else (names, [])
@@ -0,0 +1,68 @@
+"""
+Standalone sync worker: `python -m services.worker`
+
+Runs only the sync / risk pipeline (delta cycles, backfill, reconcile), so API
+replicas started with APP_ROLE=api keep their event loop for requests and both
+sides can be scaled independently. Several workers are fine: the scheduler
+lease lets only one of them run cycles at a time.
+"""
+import asyncio
+import logging
+import signal
+
+from core.config import settings
+from core.logging import setup_logging
+from db.schema import ensure_schema
+from db.session import async_engine, engine
+from services.ai_enrichment import get_enrichment_queue
+from services.erp_client import close_http_client
+from services.executor import shutdown_executor
+from services.scheduler import Scheduler
+
+log = logging.getLogger("worker")
+
+
+async def run_worker(scheduler: Scheduler | None = None, stop: asyncio.Event | None = None) -> None:
+    """
+    Run the scheduler until `stop` is set (SIGINT / SIGTERM set it too).
+    """
+    scheduler = scheduler or Scheduler()
+    stop = stop or asyncio.Event()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows / not the main thread: Ctrl+C still raises KeyboardInterrupt
+
+    await get_enrichment_queue().start()
+    await scheduler.start()
+    log.info("sync worker running (role=worker, lease=%s)", scheduler.lease.holder_id if scheduler.lease else "off")
+    try:
+        await stop.wait()
+    finally:
+        await scheduler.stop()
+        await get_enrichment_queue().stop()
+        await close_http_client()
+        if async_engine is not None:
+            await async_engine.dispose()
+        log.info("sync worker stopped")
+
+
+def main() -> None:
+    setup_logging()
+    if not settings.SYNC_ENABLED:
+        log.warning("SYNC_ENABLED=false -> sync worker has nothing to run")
+        return
+
+    # the worker owns schema changes when API replicas run with APP_ROLE=api
+    ensure_schema(engine)
+    try:
+        asyncio.run(run_worker())
+    finally:
+        shutdown_executor()
+
+
+if __name__ == "__main__":
+    main()
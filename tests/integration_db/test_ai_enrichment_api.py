@@ -0,0 +1,216 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import app
+from db.session import get_db
+from models.base import Base
+from models.invoice import Invoice, InvoiceItem
+from services.ai_enrichment import AIEnrichmentQueue
+from services.risk_engine import input_fingerprint
+from services.sync_service import SyncService
+
+
+class _StubOpenAI(BaseHTTPRequestHandler):
+    """
+    OpenAI-compatible POST /v1/chat/completions answering after `delay` seconds.
+    """
+
+    delay = 0.0
+    requests = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        type(self).requests += 1
+        time.sleep(self.delay)
+        content = json.dumps({
+            "risk_adjustment": 0.1,
+            "extra_reasons": ["Supplier changed bank details"],
+            "supplier_signal": "HIGH",
+        })
+        body = json.dumps({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "stub-model",
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _ERP:
+    async def list_purchase_invoices(self, limit: int = 500, modified_after=None, name_after=None):
+        rows = [
+            {"name": f"INV-{i}", "supplier": "S", "posting_date": "2026-01-22", "grand_total": 1000.0,
+             "modified": f"2026-01-22 04:21:0{i}"}
+            for i in range(1, 4)
+        ]
+        return [r for r in rows if modified_after is None or (r["modified"], r["name"]) > (modified_after, name_after or "")]
+
+    async def get_purchase_invoice(self, name: str):
+        return {"name": name, "items": [{"idx": 1, "item_code": "X", "qty": 1, "rate": 12000, "amount": 12000}]}
+
+
+class TestAIEnrichmentAPI(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".db")
+        self._tmp.close()
+
+        self.engine = create_engine(
+            f"sqlite:///{self._tmp.name}",
+            connect_args={"check_same_thread": False},
+            future=True,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine, autocommit=False, autoflush=False, future=True)
+        Base.metadata.create_all(bind=self.engine)
+
+        def override_get_db():
+            db = self.SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = override_get_db
+        self.client = TestClient(app)
+        app.state.ttl_cache = {}
+
+        _StubOpenAI.delay, _StubOpenAI.requests = 0.0, 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _StubOpenAI)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self._patches = [
+            patch("core.config.settings.AI_ENABLED", True),
+            patch("core.config.settings.AI_PROVIDER", "openai"),
+            patch("core.config.settings.OPENAI_API_KEY", "sk-test"),
+            patch("core.config.settings.OPENAI_MODEL", "stub-model"),
+            patch("core.config.settings.OPENAI_BASE_URL", f"http://127.0.0.1:{self.server.server_port}/v1"),
+            patch("core.config.settings.AI_ASYNC_ENRICHMENT", True),
+            patch("core.config.settings.AI_ENRICH_CONCURRENCY", 2),
+            patch("core.config.settings.SYNC_BATCH_ITEMS", False),
+        ]
+        for p in self._patches:
+            p.start()
+
+        self.queue = AIEnrichmentQueue(session_factory=self.SessionLocal)
+        self._queue_patches = [
+            patch("services.sync_service.get_enrichment_queue", return_value=self.queue),
+            patch("services.risk_recalc.get_enrichment_queue", return_value=self.queue),
+        ]
+        for p in self._queue_patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self._queue_patches + self._patches:
+            p.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        self.client.close()
+        app.dependency_overrides.clear()
+        try:
+            self.engine.dispose()
+        finally:
+            if os.path.exists(self._tmp.name):
+                os.unlink(self._tmp.name)
+
+    def _risk(self) -> dict:
+        with self.SessionLocal() as db:
+            return {
+                inv.invoice_id: (inv.risk, inv.items_hash, inv.grand_total)
+                for inv in db.query(Invoice).all()
+            }
+
+    def _assert_enriched(self, risk, items_hash, grand_total):
+        self.assertEqual(risk.ai_status, "done")
+        self.assertAlmostEqual(risk.rate, 0.9)  # "Very high unit price" 0.8 + AI 0.1
+        self.assertEqual(risk.risk_level, "CRITICAL")
+        reasons = [r["reason"] for r in risk.reasons]
+        self.assertEqual(reasons, ["Very high unit price", "AI insight", "AI metadata"])
+        self.assertEqual(risk.reasons[-1]["details"]["supplier_signal"], "HIGH")
+        self.assertEqual(risk.input_fingerprint, input_fingerprint(items_hash, grand_total, risk.rules_version))
+
+    def test_sync_stores_rule_risk_at_once_and_worker_patches_it(self):
+        _StubOpenAI.delay = 0.5  # slower than the whole cycle
+        sync = SyncService()
+        sync.erp = _ERP()
+
+        async def run():
+            await self.queue.start()
+            try:
+                with self.SessionLocal() as db:
+                    res = await sync.run_one_cycle(db)
+                pending = self._risk()
+                await asyncio.wait_for(self.queue.join(), timeout=10)
+                return res, pending
+            finally:
+                await self.queue.stop()
+
+        res, pending = asyncio.run(run())
+
+        self.assertEqual((res["status"], res["db_updated"]), ("ok", 3))
+        # the cycle finished without waiting for the model
+        for risk, _, _ in pending.values():
+            self.assertEqual(risk.ai_status, "pending")
+            self.assertEqual((risk.rate, risk.risk_level), (0.8, "HIGH"))
+            self.assertEqual([r["reason"] for r in risk.reasons], ["Very high unit price"])
+
+        self.assertEqual(_StubOpenAI.requests, 3)
+        self.assertEqual(self.queue.status()["done"], 3)
+        for row in self._risk().values():
+            self._assert_enriched(*row)
+
+    def test_recalculate_enqueues_pending_rows_once(self):
+        with self.SessionLocal() as db:
+            for i in (1, 2):
+                inv = Invoice(invoice_id=f"INV-{i}", supplier="S", grand_total=1000, erp_modified=f"m{i}")
+                db.add(inv)
+                db.flush()
+                db.add(InvoiceItem(invoice_id_fk=inv.id, idx=1, item_code="X", qty=1, rate=12000, amount=12000))
+            db.commit()
+
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        asyncio.run_coroutine_threadsafe(self.queue.start(), loop).result(timeout=5)
+        try:
+            data = self.client.post("/risk/recalculate").json()["data"]
+            self.assertEqual((data["recalculated"], data["written"]), (2, 2))
+            asyncio.run_coroutine_threadsafe(self.queue.join(), loop).result(timeout=10)
+
+            for row in self._risk().values():
+                self._assert_enriched(*row)
+
+            # enriched rows are up to date => nothing to rescore / enqueue
+            data = self.client.post("/risk/recalculate").json()["data"]
+            self.assertEqual(data["recalculated"], 0)
+            self.assertEqual(_StubOpenAI.requests, 2)
+        finally:
+            asyncio.run_coroutine_threadsafe(self.queue.stop(), loop).result(timeout=5)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout=5)
+            loop.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from app import app
+from db.session import async_database_url, get_read_db
+from models.base import Base
+from models.invoice import Invoice, InvoiceItem
+from models.risk import RiskAnalysis
+from models.sync_state import SyncState
+from services.sync_service import BACKFILL_STATE_KEY
+
+
+class TestAsyncReadAPI(unittest.TestCase):
+    """
+    Read endpoints served through the async engine (DB_ASYNC_ENABLED=true path).
+    """
+
+    def setUp(self):
+        self._tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".db")
+        self._tmp.close()
+
+        self.engine = create_engine(f"sqlite:///{self._tmp.name}", future=True)
+        self.SessionLocal = sessionmaker(bind=self.engine, autocommit=False, autoflush=False, future=True)
+        Base.metadata.create_all(bind=self.engine)
+
+        self.async_url = async_database_url(f"sqlite:///{self._tmp.name}")
+
+        async def override_get_read_db():
+            # engine per request: TestClient runs each request in its own event loop
+            async_engine = create_async_engine(self.async_url)
+            try:
+                async with async_sessionmaker(async_engine, expire_on_commit=False)() as db:
+                    yield db
+            finally:
+                await async_engine.dispose()
+
+        app.dependency_overrides[get_read_db] = override_get_read_db
+        self.client = TestClient(app)
+        app.state.ttl_cache = {}
+
+    def tearDown(self):
+        self.client.close()
+        app.dependency_overrides.clear()
+        try:
+            self.engine.dispose()
+        finally:
+            if os.path.exists(self._tmp.name):
+                os.unlink(self._tmp.name)
+
+    def _seed(self):
+        with self.SessionLocal() as db:
+            inv1 = Invoice(invoice_id="INV-1", supplier="A", grand_total=1000, erp_modified="m1")
+            inv2 = Invoice(invoice_id="INV-2", supplier="B", grand_total=250000, erp_modified="m2")
+            db.add_all([inv1, inv2])
+            db.flush()
+            db.add(InvoiceItem(invoice_id_fk=inv1.id, idx=1, item_code="X", item_name="X", qty=1, rate=1000, amount=1000))
+            db.add(RiskAnalysis(invoice_id_fk=inv2.id, rate=0.9, risk_level="CRITICAL", reasons=[{"reason": "boom"}]))
+            db.commit()
+
+    def test_async_url_mapping(self):
+        self.assertTrue(self.async_url.startswith("sqlite+aiosqlite:///"))
+        self.assertEqual(
+            async_database_url("postgresql+psycopg2://u:p@h:5432/db"),
+            "postgresql+asyncpg://u:p@h:5432/db",
+        )
+        with self.assertRaises(ValueError):
+            async_database_url("mysql://u:p@h/db")
+
+    def test_invoices_async(self):
+        self._seed()
+        r = self.client.get("/invoices?limit=10&include_items=true")
+        self.assertEqual(r.status_code, 200)
+        rows = {inv["invoice_id"]: inv for inv in r.json()["data"]}
+        self.assertEqual(len(rows["INV-1"]["items"]), 1)
+        self.assertEqual(rows["INV-2"]["items"], [])
+
+    def test_anomalies_async(self):
+        self._seed()
+        r = self.client.get("/risk/anomalies?min_rate=0.6")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual([x["invoice_id"] for x in r.json()["data"]], ["INV-2"])
+
+    def test_dashboard_and_vendors_async(self):
+        self._seed()
+        summary = self.client.get("/dashboard/summary").json()["data"]
+        self.assertEqual(summary["total_invoices"], 2)
+        self.assertEqual(summary["risk_counts"]["CRITICAL"], 1)
+
+        vendors = self.client.get("/risk/vendors").json()["data"]["rows"]
+        self.assertEqual({v["supplier"] for v in vendors}, {"A", "B"})
+
+    def test_invoice_detail_async(self):
+        self._seed()
+        data = self.client.get("/invoices/INV-1").json()["data"]
+        self.assertEqual((data["supplier"], len(data["items"])), ("A", 1))
+        self.assertEqual(self.client.get("/invoices/NOPE").status_code, 404)
+
+    def test_rules_status_and_backfill_progress_async(self):
+        self._seed()
+        with self.SessionLocal() as db:
+            state = {"modified": "m2", "name": "INV-2", "done": True, "processed": 2, "pages": 1}
+            db.add(SyncState(key=BACKFILL_STATE_KEY, value=json.dumps(state)))
+            db.commit()
+
+        rules = self.client.get("/risk/rules").json()["data"]
+        self.assertEqual(rules["stale_invoices"], 2)  # INV-1 unscored, INV-2 without rules version
+
+        progress = self.client.get("/sync/backfill").json()["data"]
+        self.assertEqual((progress["done"], progress["processed"], progress["remaining"]), (True, 2, None))
+
+    def test_many_concurrent_reads(self):
+        self._seed()
+        app.dependency_overrides.clear()
+
+        # one engine + one loop => all requests share the async pool concurrently
+        async_engine = create_async_engine(self.async_url)
+        Session = async_sessionmaker(async_engine, expire_on_commit=False)
+
+        async def override_get_read_db():
+            async with Session() as db:
+                yield db
+
+        app.dependency_overrides[get_read_db] = override_get_read_db
+
+        import httpx
+
+        async def run():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                rs = await asyncio.gather(*(client.get("/invoices?limit=10") for _ in range(50)))
+            await async_engine.dispose()
+            return rs
+
+        responses = asyncio.run(run())
+        self.assertTrue(all(r.status_code == 200 and len(r.json()["data"]) == 2 for r in responses))
+
+
+if __name__ == "__main__":
+    unittest.main()
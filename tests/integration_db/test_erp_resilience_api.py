@@ -0,0 +1,189 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+import uuid
+from unittest.mock import patch
+
+import httpx
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import app
+from db.session import get_db
+from models.base import Base
+from services.erp_client import ERPClient, get_guard
+from services.resilience import CircuitOpenError, TokenBucket
+
+
+class _ScriptedERP:
+    """
+    httpx MockTransport handler: answers with the scripted status codes in order,
+    then keeps repeating the last one. Counts requests.
+    """
+
+    def __init__(self, *statuses: int):
+        self.statuses = list(statuses)
+        self.requests = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        return httpx.Response(status, json={"data": [{"name": "INV-1", "modified": "m1"}]})
+
+
+def _client() -> ERPClient:
+    erp = ERPClient()
+    erp.base = f"http://erp-{uuid.uuid4().hex[:8]}.test"  # own host => own budget + breaker
+    return erp
+
+
+class TestERPResilienceAPI(unittest.TestCase):
+    def setUp(self):
+        self._patches = [
+            patch("services.erp_client.settings.ERPNEXT_MAX_RETRIES", 2),
+            patch("services.erp_client.settings.ERPNEXT_RETRY_BACKOFF_SECONDS", 0.001),
+            patch("services.erp_client.settings.ERPNEXT_RETRY_BACKOFF_MAX_SECONDS", 0.01),
+            patch("services.erp_client.settings.ERPNEXT_BREAKER_FAILURE_THRESHOLD", 2),
+            patch("services.erp_client.settings.ERPNEXT_BREAKER_RESET_SECONDS", 60),
+        ]
+        for p in self._patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self._patches:
+            p.stop()
+
+    def _run(self, handler: _ScriptedERP, coro_fn):
+        async def run():
+            transport = httpx.MockTransport(handler)
+            async with httpx.AsyncClient(transport=transport) as client:
+                with patch("services.erp_client.get_http_client", return_value=client):
+                    return await coro_fn()
+
+        return asyncio.run(run())
+
+    def test_retries_5xx_then_succeeds(self):
+        handler = _ScriptedERP(503, 502, 200)
+        erp = _client()
+
+        rows = self._run(handler, lambda: erp.list_purchase_invoices(limit=10))
+        self.assertEqual(rows[0]["name"], "INV-1")
+        self.assertEqual(handler.requests, 3)
+        self.assertEqual(get_guard(erp.base).breaker.state, "closed")
+
+    def test_client_error_is_not_retried_and_keeps_circuit_closed(self):
+        handler = _ScriptedERP(404)
+        erp = _client()
+
+        with self.assertRaises(httpx.HTTPStatusError):
+            self._run(handler, lambda: erp.get_purchase_invoice("NOPE"))
+        self.assertEqual(handler.requests, 1)
+        self.assertEqual(get_guard(erp.base).breaker.failures, 0)
+
+    def test_client_errors_do_not_reset_failure_count(self):
+        erp = _client()
+        with self.assertRaises(httpx.HTTPStatusError):
+            self._run(_ScriptedERP(500), lambda: erp.list_purchase_invoices(limit=10))
+        self.assertEqual(get_guard(erp.base).breaker.failures, 1)
+
+        for _ in range(3):
+            with self.assertRaises(httpx.HTTPStatusError):
+                self._run(_ScriptedERP(403), lambda: erp.get_purchase_invoice("DENIED"))
+        self.assertEqual(get_guard(erp.base).breaker.failures, 1)
+
+        # the next outage still opens the circuit at the threshold
+        with self.assertRaises(httpx.HTTPStatusError):
+            self._run(_ScriptedERP(500), lambda: erp.list_purchase_invoices(limit=10))
+        self.assertEqual(get_guard(erp.base).breaker.state, "open")
+
+    def test_breaker_opens_and_short_circuits(self):
+        handler = _ScriptedERP(500)
+        erp = _client()
+
+        for _ in range(2):
+            with self.assertRaises(httpx.HTTPStatusError):
+                self._run(handler, lambda: erp.list_purchase_invoices(limit=10))
+        self.assertEqual(handler.requests, 6)  # 2 calls x (1 + 2 retries)
+        self.assertEqual(get_guard(erp.base).breaker.state, "open")
+
+        # open circuit: no request at all
+        with self.assertRaises(CircuitOpenError):
+            self._run(handler, lambda: erp.list_purchase_invoices(limit=10))
+        self.assertEqual(handler.requests, 6)
+
+        # after the reset window one trial goes out; success closes the circuit
+        handler.statuses = [200]
+        with patch("services.resilience.time.monotonic", return_value=time.monotonic() + 61):
+            self._run(handler, lambda: erp.list_purchase_invoices(limit=10))
+        self.assertEqual(get_guard(erp.base).breaker.state, "closed")
+
+    def test_token_bucket_limits_request_rate(self):
+        bucket = TokenBucket(rate=50, burst=2)
+
+        async def run():
+            started = time.perf_counter()
+            for _ in range(7):
+                await bucket.acquire()
+            return time.perf_counter() - started
+
+        # 2 from the burst, 5 more at 50/s => >= ~0.1s
+        self.assertGreaterEqual(asyncio.run(run()), 0.09)
+
+
+class TestSyncWhileERPDownAPI(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".db")
+        self._tmp.close()
+
+        self.engine = create_engine(
+            f"sqlite:///{self._tmp.name}",
+            connect_args={"check_same_thread": False},
+            future=True,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine, autocommit=False, autoflush=False, future=True)
+        Base.metadata.create_all(bind=self.engine)
+
+        def override_get_db():
+            db = self.SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = override_get_db
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        self.client.close()
+        app.dependency_overrides.clear()
+        try:
+            self.engine.dispose()
+        finally:
+            if os.path.exists(self._tmp.name):
+                os.unlink(self._tmp.name)
+
+    def test_open_circuit_finishes_cycle_fast_and_shows_in_status(self):
+        import controllers.sync as sync_controller
+        erp = _client()
+        sync_controller._sync.erp = erp
+
+        breaker = get_guard(erp.base).breaker
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+
+        started = time.perf_counter()
+        data = self.client.post("/sync/run").json()["data"]
+        self.assertLess(time.perf_counter() - started, 1.0)
+        self.assertEqual(data["status"], "erp_unavailable")
+        self.assertGreater(data["retry_in_seconds"], 0)
+
+        status = self.client.get("/sync/status").json()["data"]
+        host = httpx.URL(erp.base).host
+        self.assertEqual(status["erp"][host]["state"], "open")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import app
+from db.session import get_db
+from models.base import Base
+from services.risk_engine import compute_risk
+
+
+BLOCKING_SECONDS = 1.0
+
+
+class _FakeERP:
+    async def list_purchase_invoices(self, limit: int = 500, modified_after=None, name_after=None):
+        return [{"name": "INV-SLOW", "supplier": "S", "posting_date": "2026-01-22", "grand_total": 10.0, "modified": "m1"}]
+
+    async def list_purchase_invoice_items(self, parents):
+        return {p: [{"idx": 1, "item_code": "X", "qty": 1, "rate": 10, "amount": 10}] for p in parents}
+
+
+def _slow_compute_risk(invoice, items):
+    # stands in for a slow blocking OpenAI call inside compute_risk
+    time.sleep(BLOCKING_SECONDS)
+    return compute_risk(invoice, items)
+
+
+class TestHealthDuringSyncAPI(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".db")
+        self._tmp.close()
+
+        self.engine = create_engine(
+            f"sqlite:///{self._tmp.name}",
+            connect_args={"check_same_thread": False},
+            future=True,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine, autocommit=False, autoflush=False, future=True)
+        Base.metadata.create_all(bind=self.engine)
+
+        def override_get_db():
+            db = self.SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = override_get_db
+        app.state.ttl_cache = {}
+
+    def tearDown(self):
+        app.dependency_overrides.clear()
+        try:
+            self.engine.dispose()
+        finally:
+            if os.path.exists(self._tmp.name):
+                os.unlink(self._tmp.name)
+
+    def test_health_latency_stays_low_while_sync_blocks(self):
+        import controllers.sync as sync_controller
+        sync_controller._sync.erp = _FakeERP()
+
+        # one shared event loop for all requests (like a real uvicorn worker); no scheduler
+        with patch("services.scheduler.settings.SYNC_ENABLED", False), \
+                patch("services.sync_service.compute_risk", _slow_compute_risk), \
+                TestClient(app) as client:
+            result = {}
+            t = threading.Thread(target=lambda: result.setdefault("r", client.post("/sync/run")))
+            t.start()
+            time.sleep(0.2)  # cycle is now inside the blocking stage
+
+            started = time.perf_counter()
+            r = client.get("/health")
+            elapsed = time.perf_counter() - started
+
+            t.join()
+
+        self.assertEqual(r.status_code, 200)
+        self.assertLess(elapsed, BLOCKING_SECONDS / 2)
+        self.assertEqual(result["r"].status_code, 200)
+        self.assertEqual(result["r"].json()["data"]["db_updated"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
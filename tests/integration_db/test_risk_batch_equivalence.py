@@ -0,0 +1,59 @@
+import time
+import unittest
+
+from hypothesis import given, settings, strategies as st
+
+from services.risk_engine import _compute_rule_based, compute_risk_batch
+
+# values around every rule threshold + anything else
+_thresholds = [0, 10, 15, 25, 30, 3000, 7000, 10000, 80000, 200000]
+_number = st.one_of(
+    st.sampled_from(_thresholds),
+    st.sampled_from(_thresholds).map(lambda x: x - 0.5),
+    st.floats(min_value=-1e7, max_value=1e7, allow_nan=False),
+    st.floats(allow_nan=False),
+)
+_item = st.fixed_dictionaries({"qty": st.one_of(st.none(), _number), "rate": st.one_of(st.none(), _number)})
+_invoice = st.tuples(st.one_of(st.none(), _number), st.lists(_item, max_size=8))
+
+
+def _columns(invoices: list[tuple]) -> tuple[list, list, list, list]:
+    qty, rate, offsets, totals = [], [], [0], []
+    for total, items in invoices:
+        totals.append(float(total or 0))
+        for it in items:
+            qty.append(float(it["qty"] or 0))
+            rate.append(float(it["rate"] or 0))
+        offsets.append(len(qty))
+    return qty, rate, offsets, totals
+
+
+class TestRiskBatchEquivalence(unittest.TestCase):
+    @settings(max_examples=300, deadline=None)
+    @given(st.lists(_invoice, max_size=20))
+    def test_batch_matches_scalar_rules(self, invoices):
+        expected = [_compute_rule_based({"grand_total": total}, items) for total, items in invoices]
+        self.assertEqual(compute_risk_batch(*_columns(invoices)), expected)
+
+    def test_empty_invoices_and_empty_batch(self):
+        self.assertEqual(compute_risk_batch([], [], [0], []), [])
+        self.assertEqual(
+            compute_risk_batch([], [], [0, 0], [250000]),
+            [_compute_rule_based({"grand_total": 250000}, [])],
+        )
+
+    def test_batch_scales_to_many_items(self):
+        n_invoices, per_invoice = 20_000, 50  # 1M items
+        qty = [float(i % 40) for i in range(n_invoices * per_invoice)]
+        rate = [float((i * 37) % 12000) for i in range(n_invoices * per_invoice)]
+        offsets = list(range(0, n_invoices * per_invoice + 1, per_invoice))
+        totals = [float(i * 17) for i in range(n_invoices)]
+
+        started = time.perf_counter()
+        out = compute_risk_batch(qty, rate, offsets, totals)
+        self.assertEqual(len(out), n_invoices)
+        self.assertLess(time.perf_counter() - started, 30)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import app
+from db.session import get_db
+from models.base import Base
+from models.invoice import Invoice, InvoiceItem
+from models.risk import RiskAnalysis
+from services.risk_engine import input_fingerprint
+import services.risk_rules as risk_rules
+from services.risk_rules import DEFAULT_RULES_PATH, RuleSet, get_rules, refresh_rules, reload_rules
+
+
+class TestRiskRulesAPI(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".db")
+        self._tmp.close()
+        self._rules = tempfile.NamedTemporaryFile(delete=False, suffix=".json")
+        self._rules.close()
+
+        self.engine = create_engine(
+            f"sqlite:///{self._tmp.name}",
+            connect_args={"check_same_thread": False},
+            future=True,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine, autocommit=False, autoflush=False, future=True)
+        Base.metadata.create_all(bind=self.engine)
+
+        def override_get_db():
+            db = self.SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = override_get_db
+        self.client = TestClient(app)
+        app.state.ttl_cache = {}
+
+        self._patch = patch("services.risk_rules.settings.RISK_RULES_PATH", self._rules.name)
+        self._patch.start()
+
+    def tearDown(self):
+        self._patch.stop()
+        reload_rules()  # back to the bundled rules for other tests
+        self.client.close()
+        app.dependency_overrides.clear()
+        try:
+            self.engine.dispose()
+        finally:
+            for path in (self._tmp.name, self._rules.name):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def _write_rules(self, version: str, unit_price_threshold: float = 10000) -> None:
+        with open(DEFAULT_RULES_PATH, encoding="utf-8") as f:
+            spec = json.load(f)
+        spec["version"] = version
+        spec["item_ladder"][2]["when"]["unit_price"]["gte"] = unit_price_threshold
+        with open(self._rules.name, "w", encoding="utf-8") as f:
+            json.dump(spec, f)
+
+    def _seed(self, current: str) -> None:
+        with self.SessionLocal() as db:
+            invs = [Invoice(invoice_id=f"INV-{i}", supplier="S", grand_total=1000, erp_modified=f"m{i}") for i in (1, 2, 3)]
+            db.add_all(invs)
+            db.flush()
+            for inv in invs:
+                db.add(InvoiceItem(invoice_id_fk=inv.id, idx=1, item_code="X", qty=1, rate=6000, amount=6000))
+
+            # INV-1 scored by older rules, INV-2 already on the current ones, INV-3 never scored
+            db.add(RiskAnalysis(invoice_id_fk=invs[0].id, rate=0.0, risk_level="LOW", reasons=[], rules_version="old"))
+            db.add(RiskAnalysis(invoice_id_fk=invs[1].id, rate=0.0, risk_level="LOW", reasons=[{"reason": "keep"}],
+                                rules_version=current, input_fingerprint=input_fingerprint(None, 1000, current)))
+            db.commit()
+
+    def _risk(self) -> dict:
+        with self.SessionLocal() as db:
+            return {inv.invoice_id: inv.risk for inv in db.query(Invoice).all()}
+
+    def test_bundled_rules_reproduce_the_baseline_ladder(self):
+        rules = RuleSet.from_file(DEFAULT_RULES_PATH)
+        out = rules.evaluate(
+            {"grand_total": 250000},
+            [{"qty": 30, "rate": 10000}, {"qty": 5, "rate": 7500}, {"qty": 16, "rate": 100}],
+        )
+
+        self.assertEqual(out["rate"], 1.0)
+        self.assertEqual(out["risk_level"], "CRITICAL")
+        self.assertEqual(
+            [r["reason"] for r in out["reasons"]],
+            ["Extreme quantity & unit price", "Elevated unit price", "Notable quantity", "Very high invoice total"],
+        )
+        self.assertEqual(rules.level(0.45), "MEDIUM")
+
+    def test_reload_rescores_only_rows_from_other_versions(self):
+        self._write_rules("v1")
+        reload_rules()
+        self._seed(current="v1")
+
+        self.assertEqual(self.client.get("/risk/rules").json()["data"]["stale_invoices"], 2)
+
+        # same version again: INV-1 (old) + INV-3 (unscored) only
+        data = self.client.post("/risk/rules/reload").json()["data"]
+        self.assertEqual((data["previous_version"], data["rules_version"], data["recalculated"]), ("v1", "v1", 2))
+        risk = self._risk()
+        self.assertEqual(risk["INV-2"].reasons, [{"reason": "keep"}])
+        self.assertEqual({r.rules_version for r in risk.values()}, {"v1"})
+        self.assertEqual(risk["INV-1"].risk_level, "LOW")
+
+        # new version lowers the unit price threshold => every row is rescored under it
+        self._write_rules("v2", unit_price_threshold=5000)
+        data = self.client.post("/risk/rules/reload").json()["data"]
+        self.assertEqual((data["previous_version"], data["rules_version"], data["recalculated"]), ("v1", "v2", 3))
+        risk = self._risk()
+        self.assertTrue(all(r.rules_version == "v2" and r.risk_level == "HIGH" for r in risk.values()))
+        self.assertEqual(self.client.get("/risk/rules").json()["data"]["stale_invoices"], 0)
+
+        # nothing stale => nothing rescored
+        self.assertEqual(self.client.post("/risk/rules/reload").json()["data"]["recalculated"], 0)
+
+    def test_reload_applies_to_other_processes(self):
+        self._write_rules("v1")
+        self.assertEqual(self.client.post("/risk/rules/reload").json()["data"]["rules_version"], "v1")
+
+        # another process (sync worker, API replica) still runs the rules it loaded at start
+        risk_rules._active, risk_rules._active_id = RuleSet.from_file(DEFAULT_RULES_PATH), None
+        self.assertEqual(get_rules().version, "2026.01-baseline")
+
+        # its next scoring entry point / status read switches to the published version
+        self.assertEqual(self.client.get("/risk/rules").json()["data"]["version"], "v1")
+        self.assertEqual(get_rules().version, "v1")
+
+        # published document wins over the local file (not re-read)
+        self._write_rules("v2")
+        with self.SessionLocal() as db:
+            self.assertEqual(refresh_rules(db).version, "v1")
+
+    def test_broken_rules_file_keeps_current_rules(self):
+        self._write_rules("v1")
+        reload_rules()
+
+        with open(self._rules.name, "w", encoding="utf-8") as f:
+            json.dump({"version": "v9", "item_rules": [{"reason": "bad", "rate": 1, "when": {"colour": {"gte": 1}}}]}, f)
+
+        r = self.client.post("/risk/rules/reload")
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(get_rules().version, "v1")
+
+
+if __name__ == "__main__":
+    unittest.main()
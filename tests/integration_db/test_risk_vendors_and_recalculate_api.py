@@ -12,6 +12,9 @@ from db.session import get_db
 from models.base import Base
 from models.invoice import Invoice, InvoiceItem
 from models.risk import RiskAnalysis
+from queries.invoices import bulk_upsert_invoices_and_items
+from queries.risk import upsert_risk
+from services.risk_engine import _compute_rule_based
 
 
 class TestRiskVendorsAndRecalculateAPI(unittest.TestCase):
@@ -140,6 +143,80 @@ class TestRiskVendorsAndRecalculateAPI(unittest.TestCase):
             self.assertIsNotNone(inv3)
             self.assertIsNotNone(inv3.risk)
 
+    def test_recalculate_batch_matches_scalar_engine(self):
+        self._seed()
+
+        r = self.client.post("/risk/recalculate?limit=500")
+        self.assertEqual(r.json()["data"]["recalculated"], 3)
+
+        with self.SessionLocal() as db:
+            for inv in db.query(Invoice).all():
+                expected = _compute_rule_based(
+                    {"grand_total": inv.grand_total},
+                    [{"qty": it.qty, "rate": it.rate} for it in inv.items],
+                )
+                self.assertEqual(
+                    {
+                        "rate": inv.risk.rate,
+                        "risk_level": inv.risk.risk_level,
+                        "reasons": inv.risk.reasons,
+                        "rules_version": inv.risk.rules_version,
+                    },
+                    expected,
+                )
+
+    def test_recalculate_only_rescores_changed_inputs(self):
+        self._seed()
+
+        # seeded rows carry no fingerprint => all stale once
+        first = self.client.post("/risk/recalculate").json()["data"]
+        self.assertEqual((first["checked"], first["recalculated"]), (3, 3))
+        again = self.client.post("/risk/recalculate").json()["data"]
+        self.assertEqual((again["checked"], again["recalculated"]), (3, 0))
+
+        with self.SessionLocal() as db:
+            inv3 = db.query(Invoice).filter_by(invoice_id="INV-3").one()
+            inv3.grand_total = 90000
+            db.commit()
+
+        changed = self.client.post("/risk/recalculate").json()["data"]
+        self.assertEqual(changed["recalculated"], 1)
+        with self.SessionLocal() as db:
+            inv3 = db.query(Invoice).filter_by(invoice_id="INV-3").one()
+            self.assertEqual(inv3.risk.risk_level, "MEDIUM")
+
+        # forced: everything is evaluated, but identical results are not written
+        forced = self.client.post("/risk/recalculate?force=true").json()["data"]
+        self.assertEqual((forced["recalculated"], forced["written"]), (3, 0))
+
+        # switching AI on changes every fingerprint
+        with patch("services.risk_engine.settings.AI_ENABLED", True), \
+                patch("services.risk_engine.settings.AI_PROVIDER", "openai"), \
+                patch("services.ai_risk.AIRiskClient.analyze_invoice", return_value={
+                    "risk_adjustment": 0.0,
+                    "extra_reasons": [],
+                    "supplier_signal": "UNKNOWN",
+                }):
+            self.assertEqual(self.client.post("/risk/recalculate").json()["data"]["recalculated"], 3)
+
+    def test_upsert_skips_identical_rows(self):
+        self._seed()
+
+        with self.SessionLocal() as db:
+            inv = db.query(Invoice).filter_by(invoice_id="INV-1").one()
+            args = dict(invoice_pk=inv.id, rate=0.5, risk_level="MEDIUM", reasons=[{"reason": "r"}], rules_version="v")
+            self.assertTrue(upsert_risk(db, **args))
+            self.assertFalse(upsert_risk(db, **args))
+            self.assertTrue(upsert_risk(db, **{**args, "rate": 0.6}))
+
+            data = {"invoice_id": "INV-1", "supplier": "VendorA", "grand_total": 1000, "erp_modified": "m9"}
+            items = [{"idx": 1, "item_code": "X", "item_name": "X", "qty": 1, "rate": 1000, "amount": 1000}]
+            _, counts = bulk_upsert_invoices_and_items(db, [(data, items)])
+            self.assertEqual(counts, {"evaluated": 1, "written": 1, "items_written": 1})  # seeded line had no fingerprint
+            db.commit()
+            _, counts = bulk_upsert_invoices_and_items(db, [(data, items)])
+            self.assertEqual(counts, {"evaluated": 1, "written": 0, "items_written": 0})
+
     def test_recalculate_cache_optional_branch(self):
         self._seed()
 
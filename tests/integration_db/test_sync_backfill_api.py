@@ -0,0 +1,309 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app import app
+from db.session import get_db
+from models.base import Base
+from models.invoice import Invoice
+from models.sync_state import SyncFailure
+from queries.sync_state import get_cursor
+import services.sync_service as sync_service
+from services.sync_service import SYNC_STATE_KEY
+
+
+class _PagedERP:
+    """
+    In-memory ERPNext with 5 invoices; 3 of them share the same `modified`
+    (bulk submit) so page boundaries fall inside a tie. Listing is a
+    (modified, name) keyset like ERPClient.list_purchase_invoices.
+    """
+
+    def __init__(self, fail_once: set[str] | None = None):
+        self.rows = [
+            {"name": "INV-A", "modified": "2026-01-01 10:00:00"},
+            {"name": "INV-B", "modified": "2026-01-02 10:00:00"},
+            {"name": "INV-C", "modified": "2026-01-02 10:00:00"},
+            {"name": "INV-D", "modified": "2026-01-02 10:00:00"},
+            {"name": "INV-E", "modified": "2026-01-03 10:00:00"},
+        ]
+        for r in self.rows:
+            r.update({"supplier": "S", "posting_date": "2026-01-01", "grand_total": 100.0})
+        self.fail_once = set(fail_once or [])
+        self.item_fetches = 0
+        self.fetched: list[str] = []
+
+    def _after(self, modified_after, name_after):
+        rows = sorted(self.rows, key=lambda r: (r["modified"], r["name"]))
+        if not modified_after:
+            return rows
+        if name_after is None:
+            return [r for r in rows if r["modified"] > modified_after]
+        return [r for r in rows if (r["modified"], r["name"]) > (modified_after, name_after)]
+
+    async def list_purchase_invoices(self, limit: int = 500, modified_after=None, name_after=None):
+        return [dict(r) for r in self._after(modified_after, name_after)[:limit]]
+
+    async def count_purchase_invoices(self, modified_after=None, name_after=None):
+        return len(self._after(modified_after, name_after))
+
+    async def list_purchase_invoice_items(self, parents):
+        self.item_fetches += 1
+        self.fetched.extend(parents)
+        return {name: (await self.get_purchase_invoice(name))["items"] for name in parents}
+
+    async def get_purchase_invoice(self, name: str):
+        if name in self.fail_once:
+            self.fail_once.discard(name)
+            raise Exception("ERP timeout")
+        return {"name": name, "items": [{"idx": 1, "item_code": "X", "qty": 1, "rate": 100, "amount": 100}]}
+
+
+class _PoisonERP(_PagedERP):
+    """
+    `n` invoices in January; the items and detail fetch of every name in `broken` always fail
+    (403). Answers the reconcile digest calls too.
+    """
+
+    def __init__(self, n: int, broken: set[str]):
+        super().__init__()
+        self.rows = [
+            {"name": f"INV-{i:03d}", "modified": f"2026-01-02 10:{i // 60:02d}:{i % 60:02d}",
+             "supplier": "S", "posting_date": "2026-01-01", "grand_total": 100.0}
+            for i in range(1, n + 1)
+        ]
+        self.broken = set(broken)
+
+    async def get_purchase_invoice(self, name: str):
+        if name in self.broken:
+            raise Exception("403 Forbidden")
+        return await super().get_purchase_invoice(name)
+
+    async def count_purchase_invoices_in_month(self, month):
+        return len(self.rows)
+
+    async def list_purchase_invoice_names_in_month(self, month):
+        return [r["name"] for r in self.rows]
+
+    async def list_purchase_invoices_by_name(self, names):
+        return [dict(r) for r in self.rows if r["name"] in names]
+
+
+class TestSyncBackfillAPI(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".db")
+        self._tmp.close()
+
+        self.engine = create_engine(
+            f"sqlite:///{self._tmp.name}",
+            connect_args={"check_same_thread": False},
+            future=True,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine, autocommit=False, autoflush=False, future=True)
+        Base.metadata.create_all(bind=self.engine)
+
+        def override_get_db():
+            db = self.SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = override_get_db
+        self.client = TestClient(app, raise_server_exceptions=False)
+        app.state.ttl_cache = {}
+
+        self._page_size = patch("services.sync_service.settings.SYNC_BACKFILL_PAGE_SIZE", 2)
+        self._page_size.start()
+
+    def tearDown(self):
+        self._page_size.stop()
+        self.client.close()
+        app.dependency_overrides.clear()
+        try:
+            self.engine.dispose()
+        finally:
+            if os.path.exists(self._tmp.name):
+                os.unlink(self._tmp.name)
+
+    def _invoice_ids(self):
+        with self.SessionLocal() as db:
+            return sorted(i.invoice_id for i in db.query(Invoice).all())
+
+    def test_backfill_pages_through_ties_and_resumes(self):
+        import controllers.sync as sync_controller
+        sync_controller._sync.erp = _PagedERP()
+
+        r1 = self.client.post("/sync/backfill?pages=1&reset=true")
+        self.assertEqual(r1.status_code, 200)
+        d1 = r1.json()["data"]
+        self.assertEqual(d1["status"], "running")
+        self.assertEqual(d1["processed"], 2)
+        self.assertEqual(self._invoice_ids(), ["INV-A", "INV-B"])
+
+        progress = self.client.get("/sync/backfill").json()["data"]
+        self.assertEqual(progress["modified"], "2026-01-02 10:00:00")
+        self.assertEqual(progress["name"], "INV-B")
+        self.assertEqual(progress["remaining"], 3)
+
+        # next call resumes from the committed cursor (inside the tie)
+        r2 = self.client.post("/sync/backfill?pages=10")
+        d2 = r2.json()["data"]
+        self.assertEqual(d2["status"], "done")
+        self.assertEqual(d2["processed"], 5)
+        self.assertEqual(self._invoice_ids(), ["INV-A", "INV-B", "INV-C", "INV-D", "INV-E"])
+
+        # delta sync continues from where backfill stopped
+        with self.SessionLocal() as db:
+            self.assertEqual(get_cursor(db, SYNC_STATE_KEY), ("2026-01-03 10:00:00", "INV-E"))
+
+    def test_backfill_failure_keeps_cursor_before_failed_invoice(self):
+        import controllers.sync as sync_controller
+        sync_controller._sync.erp = _PagedERP(fail_once={"INV-C"})
+
+        with patch("services.sync_service.settings.SYNC_BATCH_ITEMS", False):
+            d1 = self.client.post("/sync/backfill?pages=10&reset=true").json()["data"]
+        self.assertEqual(d1["status"], "partial")
+        self.assertEqual(d1["failed_ids"], ["INV-C"])
+        self.assertEqual((d1["modified"], d1["name"]), ("2026-01-02 10:00:00", "INV-B"))
+
+        d2 = self.client.post("/sync/backfill?pages=10").json()["data"]
+        self.assertEqual(d2["status"], "done")
+        self.assertEqual(self._invoice_ids(), ["INV-A", "INV-B", "INV-C", "INV-D", "INV-E"])
+
+    def test_backfill_failed_chunk_and_retry_keep_cursor_at_page_start(self):
+        import controllers.sync as sync_controller
+        sync_controller._sync.erp = _PagedERP()
+
+        # INV-A's chunk commit fails after its checkpoint was staged, then INV-A fails its retry too
+        step = {"a_writes": 0, "fail_commit": False}
+        write_records = sync_service._write_records
+
+        def flaky_write(db, records):
+            if any(r["meta"]["invoice_id"] == "INV-A" for r in records):
+                step["a_writes"] += 1
+                if step["a_writes"] > 1:
+                    raise RuntimeError("INV-A rejected")
+                step["fail_commit"] = True
+            return write_records(db, records)
+
+        def before_commit(session):
+            if step["fail_commit"]:
+                step["fail_commit"] = False
+                raise RuntimeError("commit failed")
+
+        event.listen(self.SessionLocal, "before_commit", before_commit)
+        try:
+            with patch("services.sync_service._write_records", side_effect=flaky_write), \
+                    patch("services.sync_service.settings.SYNC_PERSIST_CHUNK_SIZE", 1):
+                d1 = self.client.post("/sync/backfill?pages=10&reset=true").json()["data"]
+        finally:
+            event.remove(self.SessionLocal, "before_commit", before_commit)
+
+        self.assertEqual(d1["status"], "partial")
+        self.assertEqual(d1["failed_ids"], ["INV-A"])
+        self.assertEqual((d1["modified"], d1["name"], d1["processed"]), (None, None, 0))
+        progress = self.client.get("/sync/backfill").json()["data"]
+        self.assertEqual((progress["modified"], progress["name"]), (None, None))
+
+        d2 = self.client.post("/sync/backfill?pages=10").json()["data"]
+        self.assertEqual(d2["status"], "done")
+        self.assertEqual(self._invoice_ids(), ["INV-A", "INV-B", "INV-C", "INV-D", "INV-E"])
+
+    def test_backfill_reset_skips_unchanged_invoices_before_fetching(self):
+        import controllers.sync as sync_controller
+        erp = _PagedERP()
+        sync_controller._sync.erp = erp
+
+        self.client.post("/sync/backfill?pages=10&reset=true")
+        self.assertGreater(erp.item_fetches, 0)
+
+        # cursor reset: everything is already in DB with the same `modified`
+        erp.item_fetches = 0
+        d = self.client.post("/sync/backfill?pages=10&reset=true").json()["data"]
+        self.assertEqual(d["status"], "done")
+        self.assertEqual(d["db_updated"], 0)
+        self.assertEqual(erp.item_fetches, 0)
+
+    def test_delta_cycles_page_through_ties_reading_each_invoice_once(self):
+        import controllers.sync as sync_controller
+        erp = _PagedERP()
+        sync_controller._sync.erp = erp
+
+        with patch("services.sync_service.settings.SYNC_MAX_CHANGED_PER_CYCLE", 2):
+            cycles = [self.client.post("/sync/run").json()["data"] for _ in range(4)]
+
+        # page boundaries fall inside the INV-B/C/D tie; nothing skipped, nothing re-read
+        self.assertEqual([c["candidates"] for c in cycles], [2, 2, 1, 0])
+        self.assertEqual(erp.fetched, ["INV-A", "INV-B", "INV-C", "INV-D", "INV-E"])
+        self.assertEqual((cycles[0]["last_modified_after"], cycles[0]["last_name_after"]), ("2026-01-02 10:00:00", "INV-B"))
+        self.assertEqual(self._invoice_ids(), ["INV-A", "INV-B", "INV-C", "INV-D", "INV-E"])
+
+        with self.SessionLocal() as db:
+            self.assertEqual(get_cursor(db, SYNC_STATE_KEY), ("2026-01-03 10:00:00", "INV-E"))
+
+    def test_backfill_ahead_of_delta_hands_its_cursor_over(self):
+        import controllers.sync as sync_controller
+        erp = _PagedERP()
+        sync_controller._sync.erp = erp
+
+        # the scheduler runs the delta cycle first: its cursor is no longer empty
+        with patch("services.sync_service.settings.SYNC_MAX_CHANGED_PER_CYCLE", 2):
+            self.client.post("/sync/run")
+        with self.SessionLocal() as db:
+            self.assertEqual(get_cursor(db, SYNC_STATE_KEY), ("2026-01-02 10:00:00", "INV-B"))
+
+        d = self.client.post("/sync/backfill?pages=1&reset=true").json()["data"]
+        self.assertEqual(d["status"], "running")
+        with self.SessionLocal() as db:
+            self.assertEqual(get_cursor(db, SYNC_STATE_KEY), ("2026-01-02 10:00:00", "INV-B"))  # not behind
+
+        d = self.client.post("/sync/backfill?pages=10").json()["data"]
+        self.assertEqual(d["status"], "done")
+        with self.SessionLocal() as db:
+            self.assertEqual(get_cursor(db, SYNC_STATE_KEY), ("2026-01-03 10:00:00", "INV-E"))
+
+        # nothing left for the delta sync to re-walk
+        erp.fetched = []
+        res = self.client.post("/sync/run").json()["data"]
+        self.assertEqual((res["candidates"], erp.fetched), (0, []))
+
+    def test_invoice_that_always_fails_is_dead_lettered_and_retried_by_reconcile(self):
+        import controllers.sync as sync_controller
+        erp = _PoisonERP(120, broken={"INV-001"})
+        sync_controller._sync.erp = erp
+
+        with patch("services.sync_service.settings.SYNC_MAX_CHANGED_PER_CYCLE", 50), \
+                patch("services.sync_service.settings.SYNC_MAX_INVOICE_ATTEMPTS", 3):
+            cycles = [self.client.post("/sync/run").json()["data"] for _ in range(5)]
+
+            # INV-001 pins the cursor for 3 attempts, then the cursor moves past it
+            self.assertEqual([c["cursor_moved"] for c in cycles], [False, False, True, True, True])
+            self.assertEqual([c["dead_lettered"] for c in cycles], [0, 0, 1, 0, 0])
+            self.assertEqual([c["candidates"] for c in cycles], [50, 50, 50, 50, 20])
+            self.assertEqual(len(self._invoice_ids()), 119)
+            with self.SessionLocal() as db:
+                self.assertEqual(get_cursor(db, SYNC_STATE_KEY), ("2026-01-02 10:02:00", "INV-120"))
+                self.assertEqual([(f.invoice_id, f.attempts) for f in db.query(SyncFailure).all()], [("INV-001", 3)])
+
+            # ERPNext fixed: the reconcile pass retries the dead letter
+            erp.broken.clear()
+            data = self.client.post("/sync/reconcile").json()["data"]
+
+        self.assertEqual(data["dead_letters"], {"retried": 1, "recovered": 1})
+        self.assertEqual(len(self._invoice_ids()), 120)
+        with self.SessionLocal() as db:
+            self.assertEqual(db.query(SyncFailure).count(), 0)
+
+    def test_backfill_validation_pages_zero(self):
+        r = self.client.post("/sync/backfill?pages=0")
+        self.assertEqual(r.status_code, 422)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models.base import Base
+from models.invoice import Invoice
+from queries.sync_state import get_cursor
+from services.scheduler import Scheduler
+from services.sync_service import SYNC_STATE_KEY, SyncService
+
+
+class _StallingERP:
+    """
+    INV-1..INV-6 changed; fetching `stall_on` hangs until the cycle is cancelled.
+    """
+
+    def __init__(self, stall_on: str | None):
+        self.stall_on = stall_on
+        self.stalled = asyncio.Event()
+        self.fetched = []
+
+    async def list_purchase_invoices(self, limit: int = 500, modified_after=None, name_after=None):
+        rows = [
+            {"name": f"INV-{i}", "supplier": "S", "posting_date": "2026-01-22", "grand_total": 100.0,
+             "modified": f"2026-01-22 04:21:0{i}"}
+            for i in range(1, 7)
+        ]
+        return [r for r in rows if modified_after is None or (r["modified"], r["name"]) > (modified_after, name_after or "")]
+
+    async def get_purchase_invoice(self, name: str):
+        if name == self.stall_on:
+            self.stalled.set()
+            await asyncio.Event().wait()
+        self.fetched.append(name)
+        return {"name": name, "items": [{"idx": 1, "item_code": "X", "qty": 1, "rate": 100, "amount": 100}]}
+
+
+class TestSyncCheckpointAPI(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".db")
+        self._tmp.close()
+
+        self.engine = create_engine(
+            f"sqlite:///{self._tmp.name}",
+            connect_args={"check_same_thread": False},
+            future=True,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine, autocommit=False, autoflush=False, future=True)
+        Base.metadata.create_all(bind=self.engine)
+
+        self._patches = [
+            patch("services.sync_service.settings.SYNC_BATCH_ITEMS", False),
+            patch("services.sync_service.settings.SYNC_FETCH_CONCURRENCY", 1),
+            patch("services.sync_service.settings.SYNC_PIPELINE_QUEUE_SIZE", 1),
+            # one chunk for the whole cycle + no time-based checkpoint: only the cancel commits early
+            patch("services.sync_service.settings.SYNC_PERSIST_CHUNK_SIZE", 100),
+            patch("services.sync_service.settings.SYNC_CHECKPOINT_SECONDS", 3600),
+            patch("services.ai_risk.AIRiskClient.analyze_invoice", return_value={
+                "risk_adjustment": 0.0,
+                "extra_reasons": [],
+                "supplier_signal": "UNKNOWN",
+            }),
+        ]
+        for p in self._patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self._patches:
+            p.stop()
+        try:
+            self.engine.dispose()
+        finally:
+            if os.path.exists(self._tmp.name):
+                os.unlink(self._tmp.name)
+
+    def _stored(self) -> list[str]:
+        with self.SessionLocal() as db:
+            return sorted(i.invoice_id for i in db.query(Invoice).all())
+
+    def test_stopped_cycle_keeps_progress_and_next_cycle_resumes(self):
+        sync = SyncService()
+        sync.erp = _StallingERP(stall_on="INV-4")
+
+        async def stop_mid_cycle():
+            with self.SessionLocal() as db:
+                cycle = asyncio.ensure_future(sync.run_one_cycle(db))
+                await sync.erp.stalled.wait()
+                while sync.pipeline_status()["stages"]["persist"]["processed"] < 3:
+                    await asyncio.sleep(0.01)
+                await sync.stop()
+                with self.assertRaises(asyncio.CancelledError):
+                    await cycle
+
+        asyncio.run(stop_mid_cycle())
+
+        # INV-1..3 were written before the stop => committed with their cursor checkpoint
+        self.assertEqual(self._stored(), ["INV-1", "INV-2", "INV-3"])
+        with self.SessionLocal() as db:
+            self.assertEqual(get_cursor(db, SYNC_STATE_KEY), ("2026-01-22 04:21:03", "INV-3"))
+
+        sync.erp = _StallingERP(stall_on=None)
+
+        async def resume():
+            with self.SessionLocal() as db:
+                return await sync.run_one_cycle(db)
+
+        res = asyncio.run(resume())
+
+        # restart picks up at INV-4: nothing already stored is fetched again
+        self.assertEqual(sync.erp.fetched, ["INV-4", "INV-5", "INV-6"])
+        self.assertEqual(res["db_updated"], 3)
+        self.assertEqual(res["last_name_after"], "INV-6")
+        self.assertEqual(len(self._stored()), 6)
+
+    def test_scheduler_stop_mid_cycle_keeps_rows_with_their_cursor(self):
+        scheduler = Scheduler()
+        scheduler.lease = None
+        scheduler._leading.set()
+        scheduler.session_factory = self.SessionLocal
+        scheduler.sync = SyncService()
+        scheduler.sync.erp = _StallingERP(stall_on="INV-4")
+
+        async def stop_mid_cycle():
+            await scheduler.start()
+            await scheduler.sync.erp.stalled.wait()
+            while scheduler.sync.pipeline_status()["stages"]["persist"]["processed"] < 3:
+                await asyncio.sleep(0.01)
+            await scheduler.stop()
+
+        with patch("services.scheduler.settings.SYNC_ENABLED", True), \
+                patch("services.scheduler.settings.SYNC_BACKFILL_ENABLED", False), \
+                patch("services.scheduler.settings.SYNC_RECONCILE_ENABLED", False):
+            asyncio.run(stop_mid_cycle())
+
+        # the loop's session is closed after the cycle checkpointed: rows and cursor agree
+        self.assertEqual(self._stored(), ["INV-1", "INV-2", "INV-3"])
+        with self.SessionLocal() as db:
+            self.assertEqual(get_cursor(db, SYNC_STATE_KEY), ("2026-01-22 04:21:03", "INV-3"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,318 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import app
+from db.session import get_db
+from models.base import Base
+from models.invoice import Invoice
+from models.sync_state import SyncState
+from queries.sync_state import SYNC_REQUEST_PREFIX, add_sync_request
+from services.leader import Lease
+from services.scheduler import Scheduler
+
+
+class _CountingSync:
+    def __init__(self):
+        self.cycles = 0
+        self.backfills = []
+        self.reconciles = 0
+        self.removed = []
+
+    async def remove_invoices(self, db, names):
+        self.removed.append(list(names))
+        return len(names)
+
+    async def run_one_cycle(self, db):
+        self.cycles += 1
+        return {"status": "ok", "candidates": 0, "db_updated": 0}
+
+    async def run_backfill(self, db, *, max_pages=None, reset=False):
+        self.backfills.append((max_pages, reset))
+        return {"status": "done", "pages_run": 0}
+
+    async def run_reconcile(self, db):
+        self.reconciles += 1
+        return {"status": "ok"}
+
+    def pipeline_status(self):
+        return {}
+
+    async def stop(self):
+        pass
+
+
+class _HangingSync(_CountingSync):
+    """
+    Cycle that only ends when stopped (like SyncService: shielded future, stop() cancels it).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.stops = 0
+        self._cycle = None
+
+    async def run_one_cycle(self, db):
+        self.cycles += 1
+        self._cycle = asyncio.ensure_future(asyncio.sleep(60))
+        await asyncio.shield(self._cycle)
+        return {"status": "ok", "candidates": 0, "db_updated": 0}
+
+    async def stop(self):
+        self.stops += 1
+        if self._cycle is not None and not self._cycle.done():
+            self._cycle.cancel()
+            await asyncio.wait([self._cycle])
+
+
+class TestSyncLeaderLease(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".db")
+        self._tmp.close()
+
+        self.engine = create_engine(
+            f"sqlite:///{self._tmp.name}",
+            connect_args={"check_same_thread": False},
+            future=True,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine, autocommit=False, autoflush=False, future=True)
+        Base.metadata.create_all(bind=self.engine)
+
+    def tearDown(self):
+        try:
+            self.engine.dispose()
+        finally:
+            if os.path.exists(self._tmp.name):
+                os.unlink(self._tmp.name)
+
+    def _lease(self, holder: str, ttl: float = 30) -> Lease:
+        return Lease(ttl, holder_id=holder, session_factory=self.SessionLocal)
+
+    def test_single_holder_renew_and_takeover_after_expiry(self):
+        a, b = self._lease("A"), self._lease("B")
+
+        with patch("services.leader.time.time", return_value=1000.0):
+            self.assertTrue(a.try_acquire())
+            self.assertFalse(b.try_acquire())
+            self.assertEqual(b.current_holder(), "A")
+
+        # heartbeat before expiry keeps it
+        with patch("services.leader.time.time", return_value=1020.0):
+            self.assertTrue(a.try_acquire())
+            self.assertFalse(b.try_acquire())
+
+        # A died (no renew): lease expires at 1050 => B takes over, A can't come back
+        with patch("services.leader.time.time", return_value=1051.0):
+            self.assertTrue(b.try_acquire())
+            self.assertFalse(a.try_acquire())
+            self.assertEqual(a.current_holder(), "B")
+
+    def test_release_frees_lease_immediately(self):
+        a, b = self._lease("A"), self._lease("B")
+        self.assertTrue(a.try_acquire())
+        b.release()  # not the holder => no effect
+        self.assertFalse(b.try_acquire())
+
+        a.release()
+        self.assertIsNone(b.current_holder())
+        self.assertTrue(b.try_acquire())
+
+    def test_only_leader_scheduler_runs_cycles(self):
+        def scheduler(holder: str) -> Scheduler:
+            s = Scheduler()
+            s.lease = self._lease(holder, ttl=0.3)
+            s.sync = _CountingSync()
+            return s
+
+        async def run():
+            a, b = scheduler("A"), scheduler("B")
+            await a.start()
+            await asyncio.sleep(0.05)
+            await b.start()
+            await asyncio.sleep(0.3)
+            first = (a.status()["leader"], b.status()["leader"], a.sync.cycles, b.sync.cycles)
+
+            # graceful stop releases the lease => B takes over on its next heartbeat
+            await a.stop()
+            await asyncio.sleep(0.3)
+            second = (b.status()["leader"], b.sync.cycles)
+            await b.stop()
+            return first, second
+
+        with patch("services.scheduler.settings.SYNC_ENABLED", True), \
+                patch("services.scheduler.settings.SYNC_LEADER_LEASE_SECONDS", 0.3), \
+                patch("services.scheduler.settings.SYNC_BACKFILL_ENABLED", False), \
+                patch("services.scheduler.settings.SYNC_RECONCILE_ENABLED", False):
+            (a_leads, b_leads, a_cycles, b_cycles), (b_leads_after, b_cycles_after) = asyncio.run(run())
+
+        self.assertTrue(a_leads)
+        self.assertFalse(b_leads)
+        self.assertGreaterEqual(a_cycles, 1)
+        self.assertEqual(b_cycles, 0)
+
+        self.assertTrue(b_leads_after)
+        self.assertGreaterEqual(b_cycles_after, 1)
+
+    def test_lost_lease_stops_the_running_cycle(self):
+        async def run():
+            s = Scheduler()
+            s.lease = self._lease("A", ttl=0.3)
+            s.sync = _HangingSync()
+            await s.start()
+            await asyncio.sleep(0.2)
+            running = (s.status()["leader"], s.sync.cycles, s.sync._cycle.done())
+
+            # A stalls past expiry and B takes over => A's next heartbeat must stop its cycle
+            with self.SessionLocal() as db:
+                row = db.query(SyncState).filter(SyncState.key == "scheduler_leader").one()
+                row.value, row.expires_at = "B", time.time() + 60
+                db.commit()
+            await asyncio.sleep(0.3)
+            after = (s.status()["leader"], s.sync.stops, s.sync._cycle.cancelled(), s._task.done())
+            await s.stop()
+            return running, after
+
+        with patch("services.scheduler.settings.SYNC_ENABLED", True), \
+                patch("services.scheduler.settings.SYNC_LEADER_LEASE_SECONDS", 0.3), \
+                patch("services.scheduler.settings.SYNC_BACKFILL_ENABLED", False), \
+                patch("services.scheduler.settings.SYNC_RECONCILE_ENABLED", False):
+            running, after = asyncio.run(run())
+
+        self.assertEqual(running, (True, 1, False))
+        leader, stops, cancelled, loop_done = after
+        self.assertFalse(leader)
+        self.assertEqual(stops, 1)
+        self.assertTrue(cancelled)
+        self.assertFalse(loop_done)  # back to follower, still waiting for the lease
+
+    def test_manual_triggers_on_a_non_leader_are_handed_over(self):
+        worker = self._lease("worker", ttl=60)
+        self.assertTrue(worker.try_acquire())
+
+        def override_get_db():
+            db = self.SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        scheduler = app.state.scheduler
+        saved = (scheduler.lease, scheduler.session_factory, scheduler.sync)
+        scheduler.lease, scheduler.session_factory = self._lease("api"), self.SessionLocal
+        fake = scheduler.sync = _CountingSync()
+        app.dependency_overrides[get_db] = override_get_db
+        client = TestClient(app)
+        try:
+            r1 = client.post("/sync/run")
+            r2 = client.post("/sync/backfill?pages=3&reset=true")
+            r3 = client.post("/sync/reconcile")
+        finally:
+            client.close()
+            scheduler.lease, scheduler.session_factory, scheduler.sync = saved
+            app.dependency_overrides.clear()
+
+        self.assertEqual([r.status_code for r in (r1, r2, r3)], [202, 202, 202])
+        self.assertEqual([r.json()["data"]["action"] for r in (r1, r2, r3)], ["cycle", "backfill", "reconcile"])
+        self.assertEqual((fake.cycles, fake.backfills, fake.reconciles), (0, [], 0))
+        with self.SessionLocal() as db:
+            keys = [k for (k,) in db.query(SyncState.key).all()]
+        self.assertEqual(len([k for k in keys if k.startswith(SYNC_REQUEST_PREFIX)]), 3)
+
+    def test_webhook_removal_on_a_non_leader_is_handed_over(self):
+        with self.SessionLocal() as db:
+            db.add(Invoice(invoice_id="INV-X", supplier="S", grand_total=10, erp_modified="m1"))
+            db.commit()
+        worker = self._lease("worker", ttl=60)
+        self.assertTrue(worker.try_acquire())
+
+        def override_get_db():
+            db = self.SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        scheduler = app.state.scheduler
+        saved = (scheduler.lease, scheduler.session_factory, scheduler.sync)
+        scheduler.lease, scheduler.session_factory = self._lease("api"), self.SessionLocal
+        scheduler.sync = _CountingSync()
+        app.dependency_overrides[get_db] = override_get_db
+        client = TestClient(app)
+        try:
+            with patch("controllers.sync.settings.SYNC_WEBHOOK_SECRET", "s3cret"):
+                r = client.post(
+                    "/sync/webhook",
+                    json={"names": ["INV-X", "INV-Y"], "event": "on_trash"},
+                    headers={"X-Webhook-Secret": "s3cret"},
+                )
+        finally:
+            client.close()
+            scheduler.lease, scheduler.session_factory, scheduler.sync = saved
+            app.dependency_overrides.clear()
+
+        self.assertEqual(r.status_code, 202)
+        self.assertIsNone(r.json()["data"]["removed"])
+        with self.SessionLocal() as db:
+            self.assertEqual(db.query(Invoice).count(), 1)  # not written outside the lease
+
+        # the leader removes them on its next tick, before the cycle
+        worker.release()
+        s = Scheduler()
+        s.lease, s.session_factory = self._lease("worker"), self.SessionLocal
+        s.sync = _CountingSync()
+
+        async def run():
+            await s._take_requests()
+            requested, s._requested = s._requested, {}
+            await s._tick(requested)
+
+        with patch("services.scheduler.settings.SYNC_BACKFILL_ENABLED", False), \
+                patch("services.scheduler.settings.SYNC_RECONCILE_ENABLED", False):
+            asyncio.run(run())
+        self.assertEqual(s.sync.removed, [["INV-X", "INV-Y"]])
+        self.assertEqual(s.sync.cycles, 1)
+
+    def test_leader_wakes_up_for_handed_over_requests(self):
+        s = Scheduler()
+        s.lease = self._lease("worker")
+        s.session_factory = self.SessionLocal
+        s.sync = _CountingSync()
+
+        async def run():
+            await s.start()
+            while s.sync.cycles < 1:
+                await asyncio.sleep(0.01)
+            # the loop now sleeps for the (long) interval; a request wakes it up
+            with self.SessionLocal() as db:
+                add_sync_request(db, {"backfill": {"pages": 3, "reset": True}})
+                add_sync_request(db, {"reconcile": True})
+            for _ in range(200):
+                if s.sync.reconciles:
+                    break
+                await asyncio.sleep(0.01)
+            await s.stop()
+
+        with patch("services.scheduler.settings.SYNC_ENABLED", True), \
+                patch("services.scheduler.settings.SYNC_INTERVAL_SECONDS", 3600), \
+                patch("services.scheduler.settings.SYNC_WEBHOOK_SECRET", None), \
+                patch("services.scheduler.settings.SYNC_REQUEST_POLL_SECONDS", 0.05), \
+                patch("services.scheduler.settings.SYNC_BACKFILL_ENABLED", False), \
+                patch("services.scheduler.settings.SYNC_RECONCILE_ENABLED", False):
+            asyncio.run(run())
+
+        self.assertEqual(s.sync.cycles, 2)
+        self.assertEqual(s.sync.backfills, [(3, True)])
+        self.assertEqual(s.sync.reconciles, 1)
+        with self.SessionLocal() as db:
+            self.assertEqual(db.query(SyncState).filter(SyncState.key.like(f"{SYNC_REQUEST_PREFIX}%")).count(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,194 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import app
+from db.session import get_db
+from models.base import Base
+from models.invoice import Invoice, InvoiceItem
+from models.risk import RiskAnalysis
+
+
+class _ReconcileERP:
+    """
+    ERPNext side: INV-J2 was deleted, INV-F2 was cancelled, INV-M1 moved from
+    January to March (not synced yet). Tracks which months get drilled into.
+    """
+
+    def __init__(self):
+        self.rows = {
+            "INV-J1": ("2026-01-05", 1),
+            "INV-F1": ("2026-02-01", 1),
+            "INV-F2": ("2026-02-10", 2),
+            "INV-M1": ("2026-03-02", 1),
+            "INV-N1": ("2026-03-20", 1),
+            "INV-A1": ("2026-04-01", 1),
+        }
+        self.drilled: list[str] = []
+
+    def _month(self, month):
+        return [n for n, (date, status) in self.rows.items() if date.startswith(month) and status != 2]
+
+    async def count_purchase_invoices_in_month(self, month):
+        return len(self._month(month))
+
+    async def list_purchase_invoice_names_in_month(self, month):
+        self.drilled.append(month)
+        return self._month(month)
+
+    async def list_purchase_invoices(self, limit: int = 500, modified_after=None, name_after=None):
+        rows = [
+            {"name": n, "supplier": "S", "posting_date": date, "grand_total": 10.0,
+             "modified": f"{date} 10:00:00", "docstatus": status}
+            for n, (date, status) in sorted(self.rows.items(), key=lambda kv: kv[1][0])
+        ]
+        after = [r for r in rows if modified_after is None or (r["modified"], r["name"]) > (modified_after, name_after or "")]
+        return after[:limit]
+
+    async def list_purchase_invoice_items(self, parents):
+        return {p: [{"idx": 1, "item_code": "A", "qty": 1, "rate": 10, "amount": 10}] for p in parents}
+
+    async def list_purchase_invoices_by_name(self, names):
+        return [
+            {"name": n, "posting_date": self.rows[n][0], "docstatus": self.rows[n][1]}
+            for n in names if n in self.rows
+        ]
+
+
+class TestSyncReconcileAPI(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".db")
+        self._tmp.close()
+
+        self.engine = create_engine(
+            f"sqlite:///{self._tmp.name}",
+            connect_args={"check_same_thread": False},
+            future=True,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine, autocommit=False, autoflush=False, future=True)
+        Base.metadata.create_all(bind=self.engine)
+
+        def override_get_db():
+            db = self.SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = override_get_db
+        self.client = TestClient(app)
+        app.state.ttl_cache = {}
+
+        import controllers.sync as sync_controller
+        self.erp = _ReconcileERP()
+        sync_controller._sync.erp = self.erp
+
+        with self.SessionLocal() as db:
+            for inv_id, date in [
+                ("INV-J1", "2026-01-05"),
+                ("INV-J2", "2026-01-06"),
+                ("INV-M1", "2026-01-31"),
+                ("INV-F1", "2026-02-01"),
+                ("INV-F2", "2026-02-10"),
+                ("INV-N1", "2026-03-20"),
+                ("INV-A1", "2026-04-01"),
+            ]:
+                inv = Invoice(invoice_id=inv_id, supplier="S", posting_date=date, grand_total=10, erp_modified="m1")
+                db.add(inv)
+                db.flush()
+                db.add(InvoiceItem(invoice_id_fk=inv.id, idx=1, item_code="A", qty=1, rate=10, amount=10))
+                db.add(RiskAnalysis(invoice_id_fk=inv.id, rate=0.1, risk_level="LOW", reasons=[]))
+            db.commit()
+
+    def tearDown(self):
+        self.client.close()
+        app.dependency_overrides.clear()
+        try:
+            self.engine.dispose()
+        finally:
+            if os.path.exists(self._tmp.name):
+                os.unlink(self._tmp.name)
+
+    def _invoice_ids(self):
+        with self.SessionLocal() as db:
+            return sorted(i.invoice_id for i in db.query(Invoice).all())
+
+    def test_reconcile_removes_deleted_and_cancelled_only(self):
+        r = self.client.post("/sync/reconcile")
+        self.assertEqual(r.status_code, 200)
+        data = r.json()["data"]
+
+        # April counts match => never listed
+        self.assertEqual(data["buckets"], 4)
+        self.assertEqual(data["mismatched_buckets"], ["2026-01", "2026-02", "2026-03"])
+        self.assertEqual(sorted(self.erp.drilled), ["2026-01", "2026-02", "2026-03"])
+
+        # INV-M1 is missing from its old month but still exists => kept
+        self.assertEqual(data["orphans"], ["INV-J2", "INV-F2"])
+        self.assertEqual(data["removed"], 2)
+        self.assertEqual(self._invoice_ids(), ["INV-A1", "INV-F1", "INV-J1", "INV-M1", "INV-N1"])
+
+        with self.SessionLocal() as db:
+            self.assertEqual(db.query(InvoiceItem).count(), 5)
+            self.assertEqual(db.query(RiskAnalysis).count(), 5)
+
+    def test_reconcile_flag_only_keeps_rows(self):
+        with patch("services.sync_service.settings.SYNC_RECONCILE_DELETE", False):
+            data = self.client.post("/sync/reconcile").json()["data"]
+
+        self.assertEqual(data["orphans"], ["INV-J2", "INV-F2"])
+        self.assertEqual(data["removed"], 0)
+        self.assertEqual(len(self._invoice_ids()), 7)
+
+    def test_failed_orphan_check_skips_only_its_batch(self):
+        confirm = self.erp.list_purchase_invoices_by_name
+
+        async def flaky(names):
+            if "INV-J2" in names:
+                raise RuntimeError("ERPNext 502")
+            return await confirm(names)
+
+        self.erp.list_purchase_invoices_by_name = flaky
+        with patch("services.reconciler.CONFIRM_BATCH_SIZE", 1):
+            data = self.client.post("/sync/reconcile").json()["data"]
+
+        self.assertEqual(data["status"], "partial")
+        self.assertEqual(data["unconfirmed"], ["INV-J2"])
+        self.assertEqual(data["orphans"], ["INV-F2"])
+        self.assertEqual(data["removed"], 1)
+        self.assertIn("INV-J2", self._invoice_ids())
+        self.assertNotIn("INV-F2", self._invoice_ids())
+
+    def test_reconcile_in_sync_lists_nothing(self):
+        self.erp.rows["INV-J2"] = ("2026-01-06", 1)
+        self.erp.rows["INV-F2"] = ("2026-02-10", 1)
+        self.erp.rows["INV-M1"] = ("2026-01-31", 1)
+
+        data = self.client.post("/sync/reconcile").json()["data"]
+        self.assertEqual(data["mismatched_buckets"], [])
+        self.assertEqual(self.erp.drilled, [])
+        self.assertEqual(data["removed"], 0)
+
+    def test_backfill_skips_cancelled_invoices_like_the_digest(self):
+        with self.SessionLocal() as db:
+            db.query(Invoice).delete()
+            db.commit()
+
+        data = self.client.post("/sync/backfill?pages=10&reset=true").json()["data"]
+        self.assertEqual(data["status"], "done")
+        self.assertEqual(self._invoice_ids(), ["INV-A1", "INV-F1", "INV-J1", "INV-M1", "INV-N1"])
+        self.assertEqual(self.client.get("/dashboard/summary").json()["data"]["total_invoices"], 5)
+
+        # same rule on both sides => every month matches, nothing to drill into
+        data = self.client.post("/sync/reconcile").json()["data"]
+        self.assertEqual(data["mismatched_buckets"], [])
+        self.assertEqual(self.erp.drilled, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,22 +1,31 @@
+import asyncio
 import os
 import tempfile
+import time
 import unittest
 from unittest.mock import patch
 
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
 from app import app
 from db.session import get_db
 from models.base import Base
-from models.invoice import Invoice
+from models.invoice import Invoice, InvoiceItem
 from models.risk import RiskAnalysis
+from services.risk_engine import compute_risk
 
 
 class _FakeERP:
-    async def list_purchase_invoices(self, limit: int = 500):
+    def __init__(self):
+        self.list_calls = []
+
+    async def list_purchase_invoices(self, limit: int = 500, modified_after=None, name_after=None):
+        self.list_calls.append(modified_after)
         # ERPNext list endpoint returns minimal meta rows
+        if modified_after and modified_after >= "2026-01-22 04:21:05":
+            return []
         return [
             {
                 "name": "ACC-PINV-2026-00001",
@@ -27,6 +36,10 @@ class _FakeERP:
             }
         ]
 
+    async def list_purchase_invoice_items(self, parents):
+        # ERPNext child table endpoint: items of many invoices at once
+        return {name: (await self.get_purchase_invoice(name))["items"] for name in parents}
+
     async def get_purchase_invoice(self, name: str):
         # ERPNext details endpoint includes items
         return {
@@ -37,6 +50,85 @@ class _FakeERP:
         }
 
 
+class _ConcurrentERP:
+    """
+    5 changed invoices; detail fetch is slow and one invoice always fails.
+    Tracks how many detail requests are in flight at the same time.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def list_purchase_invoices(self, limit: int = 500, modified_after=None, name_after=None):
+        return [
+            {
+                "name": f"INV-{i}",
+                "supplier": "S",
+                "posting_date": "2026-01-22",
+                "grand_total": 100.0,
+                "modified": f"2026-01-22 04:21:0{i}",
+            }
+            for i in range(5, 0, -1)
+        ]
+
+    async def get_purchase_invoice(self, name: str):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.05)
+            if name == "INV-3":
+                raise Exception("ERP 500 for this invoice")
+            return {"name": name, "items": [{"idx": 1, "item_code": "X", "qty": 1, "rate": 100, "amount": 100}]}
+        finally:
+            self.in_flight -= 1
+
+
+class _BatchCountingERP(_ConcurrentERP):
+    """Same 5 invoices, but items come from the child-table batch call."""
+
+    def __init__(self):
+        super().__init__()
+        self.batch_calls = []
+        self.detail_calls = 0
+
+    async def list_purchase_invoice_items(self, parents):
+        self.batch_calls.append(list(parents))
+        return {p: [{"parent": p, "idx": 1, "item_code": "X", "qty": 1, "rate": 100, "amount": 100}] for p in parents}
+
+    async def get_purchase_invoice(self, name: str):
+        self.detail_calls += 1
+        return await super().get_purchase_invoice(name)
+
+
+class _EditableERP:
+    """One invoice with 3 lines; tests edit `items` and bump `modified` between cycles."""
+
+    def __init__(self):
+        self.modified = "2026-01-22 04:21:05"
+        self.items = [
+            {"idx": 1, "item_code": "A", "item_name": "A", "qty": 1, "rate": 10, "amount": 10},
+            {"idx": 2, "item_code": "B", "item_name": "B", "qty": 2, "rate": 10, "amount": 20},
+            {"idx": 3, "item_code": "C", "item_name": "C", "qty": 3, "rate": 10, "amount": 30},
+        ]
+
+    async def list_purchase_invoices(self, limit: int = 500, modified_after=None, name_after=None):
+        if modified_after and modified_after >= self.modified:
+            return []
+        return [{"name": "INV-EDIT", "supplier": "S", "posting_date": "2026-01-22", "grand_total": 60.0, "modified": self.modified}]
+
+    async def list_purchase_invoice_items(self, parents):
+        return {p: [dict(it) for it in self.items] for p in parents}
+
+
+class _SlowListERP(_FakeERP):
+    """Listing takes a while, so triggers pile up behind the running cycle."""
+
+    async def list_purchase_invoices(self, limit: int = 500, modified_after=None, name_after=None):
+        await asyncio.sleep(0.1)
+        return await super().list_purchase_invoices(limit, modified_after, name_after)
+
+
 class TestSyncRunAPI(unittest.TestCase):
     def setUp(self):
         self._tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".db")
@@ -120,11 +212,218 @@ class TestSyncRunAPI(unittest.TestCase):
 
         self.assertEqual(r.json()["data"]["status"], "ok")
 
+    def test_sync_run_pushes_cursor_to_erp(self):
+        import controllers.sync as sync_controller
+        fake = _FakeERP()
+        sync_controller._sync.erp = fake
+
+        with patch("services.ai_risk.AIRiskClient.analyze_invoice", return_value={
+            "risk_adjustment": 0.0,
+            "extra_reasons": [],
+            "supplier_signal": "UNKNOWN",
+        }):
+            first = self.client.post("/sync/run").json()["data"]
+            second = self.client.post("/sync/run").json()["data"]
+
+        # first cycle has no cursor, second sends it => idle cycle returns nothing
+        self.assertEqual(fake.list_calls, [None, "2026-01-22 04:21:05"])
+        self.assertEqual(first["candidates"], 1)
+        self.assertEqual(second["candidates"], 0)
+
+    def test_sync_run_concurrent_fetch_isolates_failures(self):
+        import controllers.sync as sync_controller
+        fake = _ConcurrentERP()
+        sync_controller._sync.erp = fake
+
+        with patch("services.sync_service.settings.SYNC_FETCH_CONCURRENCY", 2), \
+                patch("services.sync_service.settings.SYNC_BATCH_ITEMS", False), \
+                patch("services.ai_risk.AIRiskClient.analyze_invoice", return_value={
+                    "risk_adjustment": 0.0,
+                    "extra_reasons": [],
+                    "supplier_signal": "UNKNOWN",
+                }):
+            r = self.client.post("/sync/run")
+            self.assertEqual(r.status_code, 200)
+
+        data = r.json()["data"]
+        self.assertEqual(data["status"], "ok")
+        self.assertEqual(data["db_updated"], 4)
+        self.assertEqual(data["failed_ids"], ["INV-3"])
+
+        # bounded concurrency: parallel, but never above the limit
+        self.assertEqual(fake.max_in_flight, 2)
+
+        # cursor must stay below the failed invoice so it is retried next cycle
+        self.assertEqual(data["last_modified_after"], "2026-01-22 04:21:02")
+
+    def test_sync_run_batches_item_fetches(self):
+        import controllers.sync as sync_controller
+        fake = _BatchCountingERP()
+        sync_controller._sync.erp = fake
+
+        with patch("services.sync_service.settings.SYNC_ITEMS_BATCH_SIZE", 2), \
+                patch("services.ai_risk.AIRiskClient.analyze_invoice", return_value={
+                    "risk_adjustment": 0.0,
+                    "extra_reasons": [],
+                    "supplier_signal": "UNKNOWN",
+                }):
+            data = self.client.post("/sync/run").json()["data"]
+
+        # 5 invoices => 3 child-table requests, no per-invoice detail calls
+        self.assertEqual(data["db_updated"], 5)
+        self.assertEqual(sorted(len(b) for b in fake.batch_calls), [1, 2, 2])
+        self.assertEqual(fake.detail_calls, 0)
+
+    def test_sync_run_persists_cycle_in_one_transaction(self):
+        import controllers.sync as sync_controller
+        sync_controller._sync.erp = _BatchCountingERP()
+
+        commits = []
+        event.listen(self.SessionLocal, "after_commit", lambda session: commits.append(1))
+
+        with patch("services.ai_risk.AIRiskClient.analyze_invoice", return_value={
+            "risk_adjustment": 0.0,
+            "extra_reasons": [],
+            "supplier_signal": "UNKNOWN",
+        }):
+            data = self.client.post("/sync/run").json()["data"]
+
+        # 5 invoices + items + risk + cursor => a single commit
+        self.assertEqual(data["db_updated"], 5)
+        self.assertEqual(len(commits), 1)
+
+        with self.SessionLocal() as db:
+            invoices = db.query(Invoice).all()
+            self.assertEqual(len(invoices), 5)
+            self.assertTrue(all(inv.risk is not None and len(inv.items) == 1 for inv in invoices))
+
+    def test_sync_run_updates_only_changed_item_lines(self):
+        import controllers.sync as sync_controller
+        erp = _EditableERP()
+        sync_controller._sync.erp = erp
+
+        def item_rows():
+            with self.SessionLocal() as db:
+                return {it.item_code: (it.id, it.qty) for it in db.query(InvoiceItem).all()}
+
+        self.client.post("/sync/run")
+        before = item_rows()
+
+        # edit line B, drop line C, add line D
+        erp.items[1] = {**erp.items[1], "qty": 5, "amount": 50}
+        erp.items = erp.items[:2] + [{"idx": 4, "item_code": "D", "item_name": "D", "qty": 1, "rate": 1, "amount": 1}]
+        erp.modified = "2026-01-23 09:00:00"
+        self.client.post("/sync/run")
+        after = item_rows()
+
+        self.assertEqual(sorted(after), ["A", "B", "D"])
+        self.assertEqual(after["A"], before["A"])  # untouched line keeps its row
+        self.assertEqual(after["B"], (before["B"][0], 5.0))  # updated in place
+
+    def test_synced_risk_is_not_rescored_until_inputs_change(self):
+        import controllers.sync as sync_controller
+        erp = _EditableERP()
+        sync_controller._sync.erp = erp
+
+        self.client.post("/sync/run")
+
+        # the sync already stored the input fingerprint => nothing to recalculate
+        data = self.client.post("/risk/recalculate").json()["data"]
+        self.assertEqual((data["checked"], data["recalculated"]), (1, 0))
+
+        # touched in ERPNext without a relevant change: header written, identical risk not
+        erp.modified = "2026-01-23 09:00:00"
+        data = self.client.post("/sync/run").json()["data"]
+        self.assertEqual(
+            (data["db_updated"], data["invoices_written"], data["items_written"], data["risk_written"]),
+            (1, 1, 0, 0),
+        )
+
+        with self.SessionLocal() as db:
+            db.query(Invoice).update({Invoice.grand_total: 250000.0})
+            db.commit()
+
+        data = self.client.post("/risk/recalculate").json()["data"]
+        self.assertEqual((data["checked"], data["recalculated"]), (1, 1))
+        with self.SessionLocal() as db:
+            self.assertEqual(db.query(RiskAnalysis).one().risk_level, "HIGH")
+
+    def test_concurrent_triggers_share_one_follow_up_cycle(self):
+        import controllers.sync as sync_controller
+        sync = sync_controller._sync
+        fake = _SlowListERP()
+        sync.erp = fake
+
+        # scheduler and endpoints use the same coordinator (one lock per process)
+        self.assertIs(app.state.scheduler.sync, sync)
+
+        async def trigger(delay: float):
+            await asyncio.sleep(delay)
+            with self.SessionLocal() as db:
+                return await sync.run_one_cycle(db)
+
+        async def run():
+            return await asyncio.gather(*(trigger(d) for d in (0, 0.02, 0.03, 0.04)))
+
+        first, *late = asyncio.run(run())
+
+        # 4 triggers => 2 cycles: the running one + one follow-up for the 3 late callers
+        self.assertEqual(len(fake.list_calls), 2)
+        self.assertEqual(first["status"], "ok")
+        self.assertNotIn("coalesced", first)
+        self.assertEqual(first["db_updated"], 1)
+        self.assertTrue(all(r["coalesced"] and r["status"] == "ok" for r in late))
+        self.assertEqual(late[0], late[1])
+        self.assertEqual(late[0]["last_modified_before"], "2026-01-22 04:21:05")
+
+    def test_sync_run_pipeline_overlaps_stages_with_backpressure(self):
+        import controllers.sync as sync_controller
+        events = []
+
+        class _TracingERP(_ConcurrentERP):
+            async def list_purchase_invoices(self, limit: int = 500, modified_after=None, name_after=None):
+                return [
+                    {"name": f"INV-{i:02d}", "supplier": "S", "posting_date": "2026-01-22", "grand_total": 100.0,
+                     "modified": f"2026-01-22 04:21:{i:02d}"}
+                    for i in range(1, 13)
+                ]
+
+            async def get_purchase_invoice(self, name: str):
+                events.append(f"fetch:{name}")
+                return {"name": name, "items": [{"idx": 1, "item_code": "X", "qty": 1, "rate": 100, "amount": 100}]}
+
+        def slow_score(invoice, items):
+            time.sleep(0.05)  # slow scoring stage (e.g. AI enrichment)
+            events.append("score")
+            return compute_risk(invoice, items)
+
+        sync_controller._sync.erp = _TracingERP()
+
+        with patch("services.sync_service.settings.SYNC_BATCH_ITEMS", False), \
+                patch("services.sync_service.settings.SYNC_FETCH_CONCURRENCY", 1), \
+                patch("services.sync_service.settings.SYNC_SCORE_CONCURRENCY", 1), \
+                patch("services.sync_service.settings.SYNC_PIPELINE_QUEUE_SIZE", 1), \
+                patch("services.sync_service.compute_risk", slow_score):
+            data = self.client.post("/sync/run").json()["data"]
+
+        self.assertEqual(data["db_updated"], 12)
+
+        # a score finished before the last fetch: stages overlap, and the bounded
+        # queues held fetching back instead of buffering everything up front
+        self.assertLess(events.index("score"), events.index("fetch:INV-12"))
+
+        stages = data["pipeline"]["stages"]
+        self.assertEqual(list(stages), ["fetch", "hash", "score", "persist"])
+        self.assertTrue(all(st["processed"] == 12 and st["max_queue_depth"] <= 1 for st in stages.values()))
+        self.assertEqual(stages["persist"]["emitted"], 0)
+        self.assertGreater(stages["score"]["utilization"], stages["fetch"]["utilization"])
+        self.assertIsNotNone(stages["score"]["throughput_per_s"])
+
     def test_sync_run_failure_erp_raises(self):
         import controllers.sync as sync_controller
 
         class _FailERP:
-            async def list_purchase_invoices(self, limit: int = 50):
+            async def list_purchase_invoices(self, limit: int = 50, modified_after=None, name_after=None):
                 raise Exception("ERP down")
 
             async def get_purchase_invoice(self, name: str):
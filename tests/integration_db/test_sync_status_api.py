@@ -0,0 +1,78 @@
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from app import app
+from services.scheduler import Scheduler
+
+
+def _ok(candidates: int, db_updated: int, cursor_moved: bool = True) -> dict:
+    return {"status": "ok", "candidates": candidates, "db_updated": db_updated, "cursor_moved": cursor_moved}
+
+
+class TestSyncStatusAPI(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+        self._patches = [
+            patch("services.scheduler.settings.SYNC_INTERVAL_SECONDS", 5),
+            patch("services.scheduler.settings.SYNC_INTERVAL_MAX_SECONDS", 40),
+            patch("services.scheduler.settings.SYNC_BACKOFF_FACTOR", 2.0),
+            patch("services.scheduler.settings.SYNC_JITTER_RATIO", 0.0),
+            patch("services.scheduler.settings.SYNC_MAX_CHANGED_PER_CYCLE", 50),
+        ]
+        for p in self._patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self._patches:
+            p.stop()
+        self.client.close()
+
+    def test_status_exposes_current_interval(self):
+        r = self.client.get("/sync/status")
+        self.assertEqual(r.status_code, 200)
+        data = r.json()["data"]
+        self.assertFalse(data["running"])  # TestClient without context => no startup
+        self.assertIn("current_interval_seconds", data)
+        self.assertIn("last_result", data)
+
+    def test_idle_backs_off_exponentially_up_to_ceiling(self):
+        s = Scheduler()
+        delays = [s.next_interval(_ok(0, 0)) for _ in range(5)]
+        self.assertEqual(delays, [10, 20, 40, 40, 40])
+
+    def test_full_page_loops_immediately_then_activity_resets(self):
+        s = Scheduler()
+        s.next_interval(_ok(0, 0))
+        s.next_interval(_ok(0, 0))
+
+        self.assertEqual(s.next_interval(_ok(50, 50)), 0.0)
+        self.assertEqual(s.next_interval(_ok(3, 3)), 5)
+
+    def test_full_page_without_progress_backs_off(self):
+        s = Scheduler()
+        # a failing invoice pins the cursor: same full page every cycle, nothing written
+        stuck = {**_ok(50, 0, cursor_moved=False), "failed": 1}
+        self.assertEqual([s.next_interval(stuck) for _ in range(4)], [10, 20, 40, 40])
+
+        # unchanged rows only, but the cursor moved => still a backlog
+        self.assertEqual(s.next_interval(_ok(50, 0)), 0.0)
+
+    def test_backfill_running_loops_immediately(self):
+        s = Scheduler()
+        self.assertEqual(s.next_interval(_ok(0, 0), {"status": "running"}), 0.0)
+
+    def test_failed_cycle_backs_off(self):
+        s = Scheduler()
+        self.assertEqual(s.next_interval(None), 10)
+
+    def test_jitter_stays_within_ratio(self):
+        s = Scheduler()
+        with patch("services.scheduler.settings.SYNC_JITTER_RATIO", 0.2):
+            delays = [s.next_interval(_ok(1, 1)) for _ in range(50)]
+        self.assertTrue(all(4.0 <= d <= 6.0 for d in delays))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import app
+from db.session import get_db
+from models.base import Base
+from models.invoice import Invoice, InvoiceItem
+from models.risk import RiskAnalysis
+
+
+SECRET = "s3cr3t"
+
+
+class _FakeERP:
+    def __init__(self):
+        self.list_calls = []
+        self.cancelled: set[str] = set()  # docstatus 2, `modified` bumped by the cancel
+
+    def _row(self, name):
+        cancelled = name in self.cancelled
+        return {
+            "name": name, "supplier": "S", "posting_date": "2026-01-22", "grand_total": 250000.0,
+            "modified": "2026-01-22 11:00:00" if cancelled else "2026-01-22 10:00:00",
+            "docstatus": 2 if cancelled else 1,
+        }
+
+    async def list_purchase_invoices_by_name(self, names):
+        self.list_calls.append(list(names))
+        return [self._row(n) for n in names if n != "INV-GONE"]
+
+    async def list_purchase_invoices(self, limit: int = 500, modified_after=None, name_after=None):
+        rows = [self._row(n) for n in ("INV-1", "INV-2")]
+        return [r for r in rows if modified_after is None or (r["modified"], r["name"]) > (modified_after, name_after or "")]
+
+    async def list_purchase_invoice_items(self, parents):
+        return {p: [{"idx": 1, "item_code": "X", "qty": 30, "rate": 10000, "amount": 300000}] for p in parents}
+
+
+def _sign(body: bytes) -> str:
+    return base64.b64encode(hmac.new(SECRET.encode(), body, hashlib.sha256).digest()).decode()
+
+
+class TestSyncWebhookAPI(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".db")
+        self._tmp.close()
+
+        self.engine = create_engine(
+            f"sqlite:///{self._tmp.name}",
+            connect_args={"check_same_thread": False},
+            future=True,
+        )
+        self.SessionLocal = sessionmaker(bind=self.engine, autocommit=False, autoflush=False, future=True)
+        Base.metadata.create_all(bind=self.engine)
+
+        def override_get_db():
+            db = self.SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = override_get_db
+        self.client = TestClient(app)
+        app.state.ttl_cache = {}
+
+        import controllers.sync as sync_controller
+        self.sync = sync_controller._sync
+        self.erp = _FakeERP()
+        self.sync.erp = self.erp
+        self._old_factory = self.sync.session_factory
+        self.sync.session_factory = self.SessionLocal
+
+        self._secret = patch("controllers.sync.settings.SYNC_WEBHOOK_SECRET", SECRET)
+        self._secret.start()
+
+    def tearDown(self):
+        self._secret.stop()
+        self.sync.session_factory = self._old_factory
+        self.client.close()
+        app.dependency_overrides.clear()
+        try:
+            self.engine.dispose()
+        finally:
+            if os.path.exists(self._tmp.name):
+                os.unlink(self._tmp.name)
+
+    def _post(self, payload: dict, signature: str | None = None):
+        body = json.dumps(payload).encode()
+        headers = {"Content-Type": "application/json", "X-Frappe-Webhook-Signature": signature or _sign(body)}
+        return self.client.post("/sync/webhook", content=body, headers=headers)
+
+    def test_webhook_update_syncs_invoice_and_risk(self):
+        r = self._post({"doctype": "Purchase Invoice", "name": "INV-1", "event": "on_submit"})
+        self.assertEqual(r.status_code, 202)
+        self.assertEqual(r.json()["data"]["queued"], ["INV-1"])
+
+        # background task ran after the response
+        self.assertEqual(self.erp.list_calls, [["INV-1"]])
+        with self.SessionLocal() as db:
+            inv = db.query(Invoice).filter_by(invoice_id="INV-1").one()
+            self.assertEqual(len(inv.items), 1)
+            self.assertEqual(inv.risk.risk_level, "CRITICAL")
+
+    def test_webhook_shared_secret_header_and_names_list(self):
+        r = self.client.post(
+            "/sync/webhook",
+            json={"names": ["INV-2", "INV-1", "INV-GONE"]},
+            headers={"X-Webhook-Secret": SECRET},
+        )
+        self.assertEqual(r.status_code, 202)
+        self.assertEqual(self.erp.list_calls, [["INV-1", "INV-2", "INV-GONE"]])
+        with self.SessionLocal() as db:
+            self.assertEqual(db.query(Invoice).count(), 2)
+
+    def test_webhook_cancel_removes_invoice(self):
+        with self.SessionLocal() as db:
+            inv = Invoice(invoice_id="INV-X", supplier="S", grand_total=10, erp_modified="m1")
+            db.add(inv)
+            db.flush()
+            db.add(InvoiceItem(invoice_id_fk=inv.id, idx=1, item_code="A", qty=1, rate=1, amount=1))
+            db.add(RiskAnalysis(invoice_id_fk=inv.id, rate=0.1, risk_level="LOW", reasons=[]))
+            db.commit()
+
+        r = self._post({"doctype": "Purchase Invoice", "name": "INV-X", "event": "on_cancel", "docstatus": 2})
+        self.assertEqual(r.status_code, 202)
+        self.assertEqual(r.json()["data"]["removed"], 1)
+        self.assertEqual(self.erp.list_calls, [])
+
+        with self.SessionLocal() as db:
+            self.assertEqual(db.query(Invoice).count(), 0)
+            self.assertEqual(db.query(InvoiceItem).count(), 0)
+            self.assertEqual(db.query(RiskAnalysis).count(), 0)
+
+    def test_cancelled_invoice_is_not_reimported_by_poll_or_webhook(self):
+        self.assertEqual(self.client.post("/sync/run").json()["data"]["db_updated"], 2)
+
+        # INV-1 cancelled in ERPNext: webhook removes it, the cancel bumped `modified`
+        self.erp.cancelled.add("INV-1")
+        r = self._post({"doctype": "Purchase Invoice", "name": "INV-1", "event": "on_cancel", "docstatus": 2})
+        self.assertEqual(r.json()["data"]["removed"], 1)
+
+        data = self.client.post("/sync/run").json()["data"]
+        self.assertEqual((data["candidates"], data["db_updated"], data["invoices_removed"]), (1, 0, 0))
+        self.assertEqual(data["last_name_after"], "INV-1")
+
+        # missed webhook: an update event for an invoice ERPNext reports as cancelled removes it too
+        self.erp.cancelled.add("INV-2")
+        self._post({"doctype": "Purchase Invoice", "name": "INV-2", "event": "on_update"})
+        with self.SessionLocal() as db:
+            self.assertEqual(db.query(Invoice).count(), 0)
+            self.assertEqual(db.query(RiskAnalysis).count(), 0)
+
+    def test_webhook_invalid_signature(self):
+        r = self._post({"name": "INV-1"}, signature="bm9wZQ==")
+        self.assertEqual(r.status_code, 401)
+
+        r2 = self.client.post("/sync/webhook", json={"name": "INV-1"})
+        self.assertEqual(r2.status_code, 401)
+        self.assertEqual(self.erp.list_calls, [])
+
+    def test_webhook_validation(self):
+        self.assertEqual(self._post({"doctype": "Sales Invoice", "name": "X"}).status_code, 400)
+        self.assertEqual(self._post({"doctype": "Purchase Invoice"}).status_code, 400)
+
+    def test_webhook_disabled_without_secret(self):
+        with patch("controllers.sync.settings.SYNC_WEBHOOK_SECRET", None):
+            r = self._post({"name": "INV-1"})
+        self.assertEqual(r.status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
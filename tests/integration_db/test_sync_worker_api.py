@@ -0,0 +1,55 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from app import app
+from services.scheduler import Scheduler
+from services.worker import run_worker
+
+
+class _CountingSync:
+    def __init__(self):
+        self.cycles = 0
+
+    async def run_one_cycle(self, db):
+        self.cycles += 1
+        return {"status": "ok", "candidates": 0, "db_updated": 0}
+
+    def pipeline_status(self):
+        return {}
+
+    async def stop(self):
+        pass
+
+
+class TestSyncWorkerAPI(unittest.TestCase):
+    def test_api_role_does_not_start_scheduler(self):
+        with patch("app.settings.APP_ROLE", "api"), \
+                patch("services.scheduler.settings.SYNC_ENABLED", True), \
+                TestClient(app) as client:
+            self.assertEqual(client.get("/health").status_code, 200)
+            self.assertFalse(client.get("/sync/status").json()["data"]["running"])
+
+    def test_worker_runs_scheduler_until_stopped(self):
+        with patch("services.scheduler.settings.SYNC_ENABLED", True), \
+                patch("services.scheduler.settings.SYNC_LEADER_ELECTION", False), \
+                patch("services.scheduler.settings.SYNC_BACKFILL_ENABLED", False), \
+                patch("services.scheduler.settings.SYNC_RECONCILE_ENABLED", False):
+            scheduler = Scheduler()
+            scheduler.sync = _CountingSync()
+
+            async def run():
+                stop = asyncio.Event()
+                asyncio.get_running_loop().call_later(0.2, stop.set)
+                await run_worker(scheduler, stop)
+
+            asyncio.run(run())
+
+        self.assertGreaterEqual(scheduler.sync.cycles, 1)
+        self.assertFalse(scheduler.status()["running"])
+
+
+if __name__ == "__main__":
+    unittest.main()